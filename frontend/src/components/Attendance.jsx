@@ -1,4 +1,4 @@
-import React, { useEffect, useState } from 'react'
+import React, { useEffect, useRef, useState } from 'react'
 import { API_ENDPOINTS } from '../config.js'
 
 export default function Attendance() {
@@ -8,6 +8,20 @@ export default function Attendance() {
     const [msg, setMsg] = useState('')
     const [searchTerm, setSearchTerm] = useState('')
     const [filteredRows, setFilteredRows] = useState([])
+    const feedRef = useRef(null)
+
+    // Live arrivals over Server-Sent Events; resumes after the newest loaded row
+    const connectFeed = (lastId) => {
+        if (feedRef.current) feedRef.current.close()
+        const source = new EventSource(`${API_ENDPOINTS.ATTENDANCE_STREAM}?last_event_id=${lastId}`)
+        source.addEventListener('attendance', (e) => {
+            const row = JSON.parse(e.data)
+            setRows(prev => prev.some(r => r.attendance_id === row.attendance_id)
+                ? prev
+                : [row, ...prev].sort((a, b) => b.timestamp.localeCompare(a.timestamp)))
+        })
+        feedRef.current = source
+    }
 
     const load = async () => {
         setLoading(true)
@@ -18,6 +32,7 @@ export default function Attendance() {
             if (!res.ok) throw new Error(data.detail || 'Failed to load attendance')
             setRows(data)
             setFilteredRows(data)
+            connectFeed(data.reduce((max, r) => Math.max(max, r.attendance_id), 0))
         } catch (e) {
             setError(String(e))
         } finally {
@@ -25,7 +40,10 @@ export default function Attendance() {
         }
     }
 
-    useEffect(() => { load() }, [])
+    useEffect(() => {
+        load()
+        return () => feedRef.current && feedRef.current.close()
+    }, [])
 
     useEffect(() => {
         if (!searchTerm) {
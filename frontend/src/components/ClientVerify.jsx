@@ -1,6 +1,16 @@
 import React, { useEffect, useRef, useState } from 'react'
 import { API_ENDPOINTS } from '../config.js'
 
+// Stable id for this browser tab so the server can cache per-camera results
+const getCameraId = () => {
+    let id = sessionStorage.getItem('presensense-camera-id')
+    if (!id) {
+        id = `web-${Math.random().toString(36).slice(2, 10)}`
+        sessionStorage.setItem('presensense-camera-id', id)
+    }
+    return id
+}
+
 export default function ClientVerify({ onFullscreenChange }) {
     const [msg, setMsg] = useState('')
     const [ok, setOk] = useState(false)
@@ -9,6 +19,8 @@ export default function ClientVerify({ onFullscreenChange }) {
     const overlayCanvasRef = useRef(null)
     const [streaming, setStreaming] = useState(false)
     const timerRef = useRef(null)
+    const wsRef = useRef(null)
+    const liveRef = useRef(false)
     const [live, setLive] = useState(false)
     const [facing, setFacing] = useState('user') // 'user' | 'environment'
     const [fullscreen, setFullscreen] = useState(false)
@@ -206,6 +218,19 @@ export default function ClientVerify({ onFullscreenChange }) {
         })
     }
 
+    // Emotion and gaze are analyzed after the check-in is answered; wait for the result
+    const fetchEmotion = async (emotionDetection) => {
+        if (!emotionDetection || emotionDetection.status !== 'pending') return emotionDetection
+        try {
+            const res = await fetch(`${API_ENDPOINTS.MATCH_EMOTION_RESULT}/${emotionDetection.job_id}?wait=5`)
+            if (!res.ok) return null
+            const data = await res.json()
+            return data.status === 'done' ? data.emotion_detection : null
+        } catch (e) {
+            return null
+        }
+    }
+
     const verify = async () => {
         if (!streaming) {
             await start({ fullscreen: true })
@@ -247,20 +272,20 @@ export default function ClientVerify({ onFullscreenChange }) {
             setMsg('Verifying with emotion detection...'); setOk(false)
 
             try {
-                const res = await fetch(API_ENDPOINTS.MATCH_WITH_EMOTION, { method: 'POST', body: fd })
+                const res = await fetch(API_ENDPOINTS.MATCH_WITH_EMOTION, { method: 'POST', body: fd, headers: { 'X-Camera-Id': getCameraId() } })
                 const data = await res.json()
 
                 if (!res.ok) throw new Error(data.detail || 'Verification failed')
 
                 const faceRecognition = data.face_recognition
-                const emotionDetection = data.emotion_detection
 
                 if (faceRecognition.threshold_met) {
                     setMsg(`Attendance marked! Welcome, User ${faceRecognition.user_id}`)
                     setOk(true)
 
                     // Display emotion overlay if successful
-                    if (emotionDetection.success && overlayCtx) {
+                    const emotionDetection = await fetchEmotion(data.emotion_detection)
+                    if (emotionDetection?.success && overlayCtx) {
                         drawEmotionOverlay(overlayCtx, emotionDetection, canvas.width, canvas.height)
                         setCurrentEmotion(emotionDetection.emotion)
                         setIsLookingAtCamera(emotionDetection.gaze.is_looking_at_camera)
@@ -294,7 +319,110 @@ export default function ClientVerify({ onFullscreenChange }) {
             attentionPercentage: 0
         })
 
-        const INTERVAL_MS = 3000 // 3 seconds for emotion detection
+        const INTERVAL_MS = 3000 // Default cadence until the server recommends one
+        liveRef.current = true
+
+        // The server returns next_frame_ms based on its load and the scene; wait for
+        // each answer and follow that hint instead of sending on a fixed timer.
+        // Only one timer is ever pending, so stopLive can always cancel it
+        const scheduleNext = (ms) => {
+            clearTimeout(timerRef.current)
+            timerRef.current = null
+            if (!liveRef.current) return
+            timerRef.current = setTimeout(tick, typeof ms === 'number' ? ms : INTERVAL_MS)
+        }
+
+        const handleLiveResult = (data) => {
+            const faceRecognition = data.face_recognition
+
+            if (faceRecognition.threshold_met) {
+                setMsg(`Welcome, ${faceRecognition.user_name || 'User ' + faceRecognition.user_id}! ${faceRecognition.attendance_created ? '(New attendance)' : '(Already present)'}`)
+                setOk(true)
+            } else {
+                const sc = typeof faceRecognition.score === 'number' ?
+                    ` (Confidence: ${(faceRecognition.score * 100).toFixed(1)}%)` : ''
+                setMsg(`No face match found${sc}`)
+                setOk(false)
+            }
+        }
+
+        // Emotion arrives after the check-in: pushed on the WebSocket, or polled over HTTP
+        const handleEmotionResult = (emotionDetection) => {
+            const canvas = canvasRef.current
+            const overlayCanvas = overlayCanvasRef.current
+            const overlayCtx = overlayCanvas ? overlayCanvas.getContext('2d') : null
+
+            // Handle emotion detection overlay
+            if (liveRef.current && emotionDetection?.success && overlayCtx) {
+                drawEmotionOverlay(overlayCtx, emotionDetection, canvas.width, canvas.height)
+                setCurrentEmotion(emotionDetection.emotion)
+                const isLooking = emotionDetection.gaze.is_looking_at_camera
+                setIsLookingAtCamera(isLooking)
+                setFaceBbox(emotionDetection.face_bbox)
+                updateAttentionStats(isLooking)
+            }
+        }
+
+        // Prefer a persistent WebSocket; fall back to one POST per frame if it is unavailable
+        let seq = 0
+        // A frame sent on the WebSocket whose answer has not arrived yet
+        let inFlight = false
+        try {
+            const ws = new WebSocket(`${API_ENDPOINTS.MATCH_WS}?camera_id=${encodeURIComponent(getCameraId())}`)
+            ws.binaryType = 'arraybuffer'
+            ws.onmessage = (event) => {
+                const data = JSON.parse(event.data)
+                if (data.type === 'emotion') {
+                    if (data.status === 'done') handleEmotionResult(data.emotion_detection)
+                    return
+                }
+                inFlight = false
+                if (data.error) { setMsg('Processing...'); setOk(false) }
+                else handleLiveResult(data)
+                scheduleNext(data.next_frame_ms)
+            }
+            ws.onclose = () => {
+                if (wsRef.current !== ws) return
+                wsRef.current = null
+                // A frame in flight is lost and its answer would have scheduled the
+                // next one; continue over HTTP. Otherwise the next tick is already pending
+                if (!inFlight) return
+                inFlight = false
+                scheduleNext(INTERVAL_MS)
+            }
+            wsRef.current = ws
+        } catch (e) {
+            wsRef.current = null
+        }
+
+        const sendFrame = async (blob) => {
+            const ws = wsRef.current
+            if (ws && ws.readyState === WebSocket.OPEN) {
+                // 4-byte big-endian header length, JSON header, then the JPEG bytes
+                const header = new TextEncoder().encode(JSON.stringify({ seq: ++seq, mode: 'emotion' }))
+                const image = new Uint8Array(await blob.arrayBuffer())
+                const message = new Uint8Array(4 + header.length + image.length)
+                new DataView(message.buffer).setUint32(0, header.length)
+                message.set(header, 4)
+                message.set(image, 4 + header.length)
+                inFlight = true
+                ws.send(message)
+                return
+            }
+
+            const fd = new FormData()
+            fd.append('file', blob, 'frame.jpg')
+            const res = await fetch(API_ENDPOINTS.MATCH_WITH_EMOTION, { method: 'POST', body: fd, headers: { 'X-Camera-Id': getCameraId() } })
+            const data = await res.json()
+            if (res.ok) {
+                handleLiveResult(data)
+                fetchEmotion(data.emotion_detection).then(handleEmotionResult)
+            } else {
+                setMsg('Processing...'); setOk(false)
+            }
+            scheduleNext(data.next_frame_ms)
+        }
+
         const tick = async () => {
             const video = videoRef.current
             const canvas = canvasRef.current
@@ -325,52 +453,24 @@ export default function ClientVerify({ onFullscreenChange }) {
             ctx.restore()
 
             canvas.toBlob(async (blob) => {
-                const fd = new FormData()
-                fd.append('file', blob, 'frame.jpg')
                 try {
-                    const res = await fetch(API_ENDPOINTS.MATCH_WITH_EMOTION, { method: 'POST', body: fd })
-                    const data = await res.json()
-
-                    if (res.ok) {
-                        const faceRecognition = data.face_recognition
-                        const emotionDetection = data.emotion_detection
-
-                        if (faceRecognition.threshold_met) {
-                            setMsg(`Welcome, ${faceRecognition.user_name || 'User ' + faceRecognition.user_id}! ${faceRecognition.attendance_created ? '(New attendance)' : '(Already present)'}`)
-                            setOk(true)
-                        } else {
-                            const sc = typeof faceRecognition.score === 'number' ?
-                                ` (Confidence: ${(faceRecognition.score * 100).toFixed(1)}%)` : ''
-                            setMsg(`No face match found${sc}`)
-                            setOk(false)
-                        }
-
-                        // Handle emotion detection overlay
-                        if (emotionDetection.success && overlayCtx) {
-                            drawEmotionOverlay(overlayCtx, emotionDetection, canvas.width, canvas.height)
-                            setCurrentEmotion(emotionDetection.emotion)
-                            const isLooking = emotionDetection.gaze.is_looking_at_camera
-                            setIsLookingAtCamera(isLooking)
-                            setFaceBbox(emotionDetection.face_bbox)
-                            updateAttentionStats(isLooking)
-                        }
-                    } else {
-                        setMsg('Processing...'); setOk(false)
-                    }
+                    await sendFrame(blob)
                 } catch (e) {
                     setMsg('Live verification error: ' + e); setOk(false)
+                    scheduleNext(INTERVAL_MS)
                 }
             }, 'image/jpeg')
         }
 
-        // Start immediate analysis, then repeat every 5 seconds
-        setTimeout(tick, 1000)
-        timerRef.current = setInterval(tick, INTERVAL_MS)
+        // Start analysis shortly after the camera is up; each answer schedules the next frame
+        scheduleNext(1000)
         setMsg('Live verification with emotion tracking started'); setOk(true)
     }
 
     const stopLive = () => {
-        if (timerRef.current) { clearInterval(timerRef.current); timerRef.current = null }
+        liveRef.current = false
+        if (timerRef.current) { clearTimeout(timerRef.current); timerRef.current = null }
+        if (wsRef.current) { wsRef.current.close(); wsRef.current = null }
         setLive(false)
         setEmotionActive(false)
         stopCamera()
@@ -384,7 +484,9 @@ export default function ClientVerify({ onFullscreenChange }) {
     }
 
     useEffect(() => () => {
-        if (timerRef.current) clearInterval(timerRef.current)
+        liveRef.current = false
+        if (timerRef.current) clearTimeout(timerRef.current)
+        if (wsRef.current) wsRef.current.close()
         const v = videoRef.current
         const s = v && v.srcObject
         if (s && s.getTracks) s.getTracks().forEach(t => t.stop())
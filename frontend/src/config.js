@@ -9,9 +9,12 @@ export const API_ENDPOINTS = {
     BASE_URL: API_BASE_URL,
     UPLOAD: `${API_BASE_URL}/admin/upload`,
     ATTENDANCE: `${API_BASE_URL}/admin/attendance`,
+    ATTENDANCE_STREAM: `${API_BASE_URL}/admin/attendance/stream`,
     MATCH: `${API_BASE_URL}/match/`,
     MATCH_WITH_EMOTION: `${API_BASE_URL}/match/with-emotion`,
+    MATCH_EMOTION_RESULT: `${API_BASE_URL}/match/emotion`,
     STREAM: `${API_BASE_URL}/match/stream`,
+    MATCH_WS: `${API_BASE_URL.replace(/^http/, 'ws')}/match/ws`,
     EMOTION: {
         START_SESSION: `${API_BASE_URL}/emotion/start-session`,
         END_SESSION: `${API_BASE_URL}/emotion/end-session`,
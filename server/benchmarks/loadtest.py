@@ -0,0 +1,467 @@
+"""Load test that replays kiosk traffic against a running API.
+
+Each simulated kiosk behaves like `ClientVerify`: it sends one frame to
+`/match/with-emotion` (or over `/match/ws` with --transport ws), waits for
+the answer, then waits `next_frame_ms` from the response (3 s when absent,
+`Retry-After` on a 503) before the next frame. --cadence fixed ignores the
+server's hint and always waits --interval-ms. The frame's emotion analysis,
+which finishes after the answer, is awaited alongside (long-polled from
+`/match/emotion/{job_id}`, or pushed on the WebSocket) and reported as its
+own endpoint, timed from when the frame was sent. Admin clients poll
+`/admin/attendance` and `/admin/users` alongside, and --enroll-clients post
+`/admin/upload` back to back like a bulk import, to check that check-ins
+keep their latency while enrollments compete for the inference pool.
+
+Without --url, a server is started under uvicorn (`benchmarks.serve`) on a
+scratch SQLite database, with stub models by default (--real-models for
+INFERENCE_BACKEND), and one user is enrolled per distinct frame so that kiosks
+get matches. The report covers throughput, p50/p95/p99 latency, error and
+503 rates per endpoint, and the server's CPU and RSS (sampled from /proc or
+psutil; pass --server-pid with --url).
+
+Run from the server directory:
+
+    python -m benchmarks.loadtest --kiosks 50 --duration 120
+    python -m benchmarks.loadtest --kiosks 50 --stub-embedding-ms 150 --stub-emotion-ms 80 --json load.json
+    python -m benchmarks.loadtest --kiosks 20 --enroll-clients 8 --stub-embedding-ms 50
+    python -m benchmarks.loadtest --url http://localhost:8000 --server-pid 1234 --frames ~/kiosk-frames
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+DEFAULT_INTERVAL_MS = 3000
+
+
+class Stats:
+    """Latency and status per endpoint, for requests completed inside the measured window."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.measuring = False
+
+    def record(self, endpoint: str, status: str, seconds: float) -> None:
+        if not self.measuring:
+            return
+        self.latencies[endpoint].append(seconds)
+        self.statuses[endpoint][status] += 1
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        endpoints = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            ms = np.array(latencies) * 1000
+            statuses = dict(self.statuses[endpoint])
+            total = len(latencies)
+            errors = sum(count for status, count in statuses.items() if not status.startswith("2"))
+            endpoints[endpoint] = {
+                "requests": total,
+                "throughput_rps": round(total / elapsed, 2),
+                "p50_ms": round(float(np.percentile(ms, 50)), 1),
+                "p95_ms": round(float(np.percentile(ms, 95)), 1),
+                "p99_ms": round(float(np.percentile(ms, 99)), 1),
+                "max_ms": round(float(ms.max()), 1),
+                "error_rate": round(errors / total, 4),
+                "rate_503": round(statuses.get("503", 0) / total, 4),
+                "statuses": statuses,
+            }
+        return endpoints
+
+
+class ProcessSampler:
+    """CPU and RSS of one process, sampled every second (psutil if installed, else /proc)."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.cpu_percent: List[float] = []
+        self.rss_bytes: List[int] = []
+        try:
+            import psutil
+            self._process = psutil.Process(pid)
+            self._process.cpu_percent()
+        except ImportError:
+            self._process = None
+            self._ticks = os.sysconf("SC_CLK_TCK")
+            self._last = (time.monotonic(), self._cpu_seconds())
+
+    def _cpu_seconds(self) -> float:
+        fields = Path(f"/proc/{self.pid}/stat").read_text().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self._ticks
+
+    def _rss(self) -> int:
+        for line in Path(f"/proc/{self.pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+        return 0
+
+    def sample(self) -> None:
+        if self._process is not None:
+            self.cpu_percent.append(self._process.cpu_percent())
+            self.rss_bytes.append(self._process.memory_info().rss)
+            return
+        now, cpu = time.monotonic(), self._cpu_seconds()
+        self.cpu_percent.append((cpu - self._last[1]) / (now - self._last[0]) * 100)
+        self._last = (now, cpu)
+        self.rss_bytes.append(self._rss())
+
+    async def run(self, stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            await asyncio.sleep(1)
+            try:
+                self.sample()
+            except (OSError, ValueError):
+                return
+
+    def report(self) -> Dict[str, Any]:
+        if not self.cpu_percent:
+            return {}
+        return {
+            "pid": self.pid,
+            "cpu_percent_mean": round(float(np.mean(self.cpu_percent)), 1),
+            "cpu_percent_max": round(float(np.max(self.cpu_percent)), 1),
+            "rss_mb_mean": round(float(np.mean(self.rss_bytes)) / 1e6, 1),
+            "rss_mb_max": round(float(np.max(self.rss_bytes)) / 1e6, 1),
+        }
+
+
+def _next_wait_ms(args: argparse.Namespace, status: int, data: Optional[Dict[str, Any]], retry_after: Optional[str]) -> float:
+    if status == 503 and retry_after:
+        try:
+            return float(retry_after) * 1000
+        except ValueError:
+            pass
+    if args.cadence == "server" and data and isinstance(data.get("next_frame_ms"), (int, float)):
+        return data["next_frame_ms"]
+    return args.interval_ms
+
+
+def _emotion_status(status: str) -> str:
+    """HTTP-like status of a finished emotion analysis, so the report counts drops as 503s."""
+    return {"done": "200", "dropped": "503"}.get(status, "500")
+
+
+async def poll_emotion(client, job_id: str, start: float, stats: Stats) -> None:
+    try:
+        response = await client.get(f"/match/emotion/{job_id}", params={"wait": 10})
+        status = _emotion_status(response.json()["status"]) if response.status_code == 200 else str(response.status_code)
+    except Exception as e:
+        status = type(e).__name__
+    stats.record("emotion result (HTTP poll)", status, time.perf_counter() - start)
+
+
+async def http_kiosk(index: int, client, frames: List[bytes], stats: Stats, stop: asyncio.Event, args: argparse.Namespace) -> None:
+    # Kiosks are switched on at random times, not in lockstep
+    await asyncio.sleep(random.uniform(0, args.interval_ms / 1000))
+    sent = 0
+    polls = set()
+    while not stop.is_set():
+        frame = frames[(index + sent) % len(frames)]
+        sent += 1
+        start = time.perf_counter()
+        data, retry_after = None, None
+        try:
+            response = await client.post(
+                "/match/with-emotion",
+                files={"file": ("frame.jpg", frame, "image/jpeg")},
+                headers={"X-Camera-Id": f"kiosk-{index}"},
+            )
+            status = response.status_code
+            retry_after = response.headers.get("retry-after")
+            if response.headers.get("content-type", "").startswith("application/json"):
+                data = response.json()
+        except Exception as e:
+            status = 0
+            stats.record("POST /match/with-emotion", type(e).__name__, time.perf_counter() - start)
+        else:
+            stats.record("POST /match/with-emotion", str(status), time.perf_counter() - start)
+        emotion = (data or {}).get("emotion_detection") or {}
+        if emotion.get("status") == "pending":
+            poll = asyncio.create_task(poll_emotion(client, emotion["job_id"], start, stats))
+            polls.add(poll)
+            poll.add_done_callback(polls.discard)
+        await _sleep_unless_stopped(stop, _next_wait_ms(args, status, data, retry_after) / 1000)
+    await asyncio.gather(*polls, return_exceptions=True)
+
+
+async def ws_kiosk(index: int, base_url: str, frames: List[bytes], stats: Stats, stop: asyncio.Event, args: argparse.Namespace) -> None:
+    import websockets
+
+    await asyncio.sleep(random.uniform(0, args.interval_ms / 1000))
+    url = base_url.replace("http", "ws", 1) + f"/match/ws?camera_id=kiosk-{index}"
+    sent = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            async with websockets.connect(url, max_size=None) as ws:
+                replies: Dict[int, asyncio.Future] = {}
+                sent_at: Dict[int, float] = {}
+
+                async def read() -> None:
+                    # Emotion pushes arrive after their frame's reply, possibly after the next frame was sent
+                    try:
+                        async for message in ws:
+                            data = json.loads(message)
+                            if data.get("type") == "emotion":
+                                pushed = sent_at.pop(data.get("seq"), None)
+                                if pushed is not None:
+                                    stats.record("emotion result (WS push)", _emotion_status(data["status"]), time.perf_counter() - pushed)
+                            elif data.get("seq") in replies:
+                                replies.pop(data["seq"]).set_result(data)
+                    finally:
+                        for reply in replies.values():
+                            if not reply.done():
+                                reply.set_exception(ConnectionError("WebSocket closed"))
+
+                reader = asyncio.create_task(read())
+                try:
+                    while not stop.is_set():
+                        frame = frames[(index + sent) % len(frames)]
+                        sent += 1
+                        header = json.dumps({"seq": sent, "mode": "emotion"}).encode()
+                        start = time.perf_counter()
+                        reply = replies[sent] = asyncio.get_running_loop().create_future()
+                        sent_at[sent] = start
+                        await ws.send(len(header).to_bytes(4, "big") + header + frame)
+                        data = await asyncio.wait_for(reply, args.timeout)
+                        status = data.get("status", 200) if "error" in data else 200
+                        stats.record("WS /match/ws", str(status), time.perf_counter() - start)
+                        if (data.get("emotion_detection") or {}).get("status") != "pending":
+                            sent_at.pop(sent, None)
+                        await _sleep_unless_stopped(stop, _next_wait_ms(args, status, data, None) / 1000)
+                finally:
+                    reader.cancel()
+        except Exception as e:
+            stats.record("WS /match/ws", type(e).__name__, time.perf_counter() - start)
+            await _sleep_unless_stopped(stop, args.interval_ms / 1000)
+
+
+async def admin_client(client, stats: Stats, stop: asyncio.Event, args: argparse.Namespace) -> None:
+    await asyncio.sleep(random.uniform(0, args.admin_interval))
+    while not stop.is_set():
+        for path in ("/admin/attendance", "/admin/users"):
+            start = time.perf_counter()
+            try:
+                response = await client.get(path)
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            stats.record(f"GET {path}", status, time.perf_counter() - start)
+        await _sleep_unless_stopped(stop, args.admin_interval)
+
+
+async def enroll_client(index: int, client, frames: List[bytes], stats: Stats, stop: asyncio.Event) -> None:
+    sent = 0
+    while not stop.is_set():
+        frame = frames[(index + sent) % len(frames)]
+        sent += 1
+        start = time.perf_counter()
+        retry_after = None
+        try:
+            response = await client.post(
+                "/admin/upload",
+                data={"name": f"bulk-{index}-{sent}"},
+                files={"file": ("photo.jpg", frame, "image/jpeg")},
+            )
+            status = str(response.status_code)
+            retry_after = response.headers.get("retry-after")
+        except Exception as e:
+            status = type(e).__name__
+        stats.record("POST /admin/upload", status, time.perf_counter() - start)
+        if retry_after:
+            await _sleep_unless_stopped(stop, float(retry_after))
+
+
+async def _sleep_unless_stopped(stop: asyncio.Event, seconds: float) -> None:
+    try:
+        await asyncio.wait_for(stop.wait(), timeout=seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def run_load(base_url: str, frames: List[bytes], pid: Optional[int], args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+
+    stats = Stats()
+    stop = asyncio.Event()
+    sampler_stop = asyncio.Event()
+    # Every kiosk is its own device; its emotion long-polls must not hold up its frames
+    limits = httpx.Limits(max_connections=None)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        if args.transport == "ws":
+            kiosks = [ws_kiosk(i, base_url, frames, stats, stop, args) for i in range(args.kiosks)]
+        else:
+            kiosks = [http_kiosk(i, client, frames, stats, stop, args) for i in range(args.kiosks)]
+        admins = [admin_client(client, stats, stop, args) for _ in range(args.admin_clients)]
+        enrollers = [enroll_client(i, client, frames, stats, stop) for i in range(args.enroll_clients)]
+        tasks = [asyncio.create_task(c) for c in kiosks + admins + enrollers]
+
+        # Ramp-up (every kiosk has sent its first frames) is not measured
+        await asyncio.sleep(args.warmup)
+        sampler = ProcessSampler(pid) if pid else None
+        sampler_task = asyncio.create_task(sampler.run(sampler_stop)) if sampler else None
+        stats.measuring = True
+        started = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        elapsed = time.perf_counter() - started
+        stats.measuring = False
+
+        stop.set()
+        sampler_stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if sampler_task:
+            await sampler_task
+
+    endpoints = stats.report(elapsed)
+    total = sum(e["requests"] for e in endpoints.values())
+    return {
+        "duration_seconds": round(elapsed, 1),
+        "total_requests": total,
+        "throughput_rps": round(total / elapsed, 2),
+        "endpoints": endpoints,
+        "server": sampler.report() if sampler else {},
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(base_url: str, process: subprocess.Popen, log_path: Path, timeout: float) -> None:
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            log_tail = "\n".join(log_path.read_text().splitlines()[-20:])
+            raise SystemExit(f"Server exited with code {process.returncode}:\n{log_tail}")
+        try:
+            if httpx.get(f"{base_url}/ready", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"Server not ready after {timeout:.0f}s")
+
+
+def _print_report(result: Dict[str, Any]) -> None:
+    print(f"{result['total_requests']} requests in {result['duration_seconds']}s ({result['throughput_rps']} req/s)")
+    print(f"{'endpoint':<28}{'req':>7}{'req/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'errors':>8}{'503':>7}")
+    for endpoint, e in result["endpoints"].items():
+        print(f"{endpoint:<28}{e['requests']:>7}{e['throughput_rps']:>8.2f}{e['p50_ms']:>7.0f}ms{e['p95_ms']:>7.0f}ms"
+              f"{e['p99_ms']:>7.0f}ms{e['error_rate'] * 100:>7.1f}%{e['rate_503'] * 100:>6.1f}%")
+    server = result["server"]
+    if server:
+        print(f"server pid {server['pid']}: CPU {server['cpu_percent_mean']}% mean, {server['cpu_percent_max']}% max; "
+              f"RSS {server['rss_mb_mean']}MB mean, {server['rss_mb_max']}MB max")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="test a running server instead of starting one")
+    parser.add_argument("--server-pid", type=int, help="pid to sample CPU/RSS from when using --url")
+    parser.add_argument("--kiosks", type=int, default=20, help="concurrent kiosk clients")
+    parser.add_argument("--admin-clients", type=int, default=1, help="concurrent admin dashboard clients")
+    parser.add_argument("--admin-interval", type=float, default=10.0, help="seconds between admin polls")
+    parser.add_argument("--enroll-clients", type=int, default=0, help="concurrent clients enrolling users back to back")
+    parser.add_argument("--transport", choices=("http", "ws"), default="http", help="POST per frame or the /match/ws channel")
+    parser.add_argument("--cadence", choices=("server", "fixed"), default="server",
+                        help="follow next_frame_ms like ClientVerify, or always wait --interval-ms")
+    parser.add_argument("--interval-ms", type=float, default=DEFAULT_INTERVAL_MS, help="kiosk interval without a server hint")
+    parser.add_argument("--duration", type=float, default=60.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=10.0, help="unmeasured ramp-up seconds")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument("--frames", type=Path, help="directory of recorded JPEG frames; default synthetic frames")
+    parser.add_argument("--people", type=int, default=20, help="distinct synthetic frames (one enrolled user each)")
+    parser.add_argument("--real-models", action="store_true", help="started server uses INFERENCE_BACKEND and MediaPipe instead of stubs")
+    parser.add_argument("--stub-embedding-ms", type=float, default=0.0, help="simulated latency per stub embedding pass")
+    parser.add_argument("--stub-emotion-ms", type=float, default=0.0, help="simulated latency per stub emotion+gaze call")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for kiosk start offsets")
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON to PATH ('-' for stdout only)")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    from benchmarks.synthetic import load_frames
+
+    frame_count = len([p for p in args.frames.iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png")]) if args.frames else args.people
+    frames = load_frames(frame_count, args.frames)
+
+    process = None
+    tmp_dir = tempfile.TemporaryDirectory(prefix="presensense-load-")
+    try:
+        if args.url:
+            base_url, pid = args.url.rstrip("/"), args.server_pid
+        else:
+            frames_dir = args.frames
+            if frames_dir is None:
+                frames_dir = Path(tmp_dir.name) / "frames"
+                frames_dir.mkdir()
+                for i, frame in enumerate(frames):
+                    (frames_dir / f"person-{i:03d}.jpg").write_bytes(frame)
+            port = _free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            command = [sys.executable, "-m", "benchmarks.serve", "--port", str(port), "--enroll-frames", str(frames_dir)]
+            if not args.real_models:
+                command += ["--stub-models", "--stub-embedding-ms", str(args.stub_embedding_ms),
+                            "--stub-emotion-ms", str(args.stub_emotion_ms)]
+            env = {
+                **os.environ,
+                "DATABASE_URL": f"sqlite:///{tmp_dir.name}/load.db",
+                # Photos posted by --enroll-clients stay in the scratch directory
+                "GCP_BUCKET_NAME": "",
+                "UPLOADS_DIR": f"{tmp_dir.name}/uploads",
+                # Kiosks replay a few frames, which real cameras never repeat byte for byte
+                "INFERENCE_CACHE_ENABLED": os.environ.get("INFERENCE_CACHE_ENABLED", "false"),
+            }
+            log_path = Path(tmp_dir.name) / "server.log"
+            log_file = open(log_path, "w")
+            process = subprocess.Popen(command, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+            _wait_ready(base_url, process, log_path, timeout=300 if args.real_models else 60)
+            pid = process.pid
+
+        print(f"{args.kiosks} kiosks ({args.transport}, {args.cadence} cadence), {args.admin_clients} admin and "
+              f"{args.enroll_clients} enrollment clients "
+              f"against {base_url}: {args.warmup:.0f}s warm-up, {args.duration:.0f}s measured", file=sys.stderr)
+        result = asyncio.run(run_load(base_url, frames, pid, args))
+        result["config"] = {
+            key: getattr(args, key) for key in (
+                "kiosks", "admin_clients", "admin_interval", "enroll_clients", "transport", "cadence", "interval_ms",
+                "duration", "warmup", "real_models", "stub_embedding_ms", "stub_emotion_ms",
+            )
+        }
+        result["config"]["frames"] = str(args.frames) if args.frames else f"{args.people} synthetic"
+        result["config"]["server"] = args.url or "spawned"
+
+        if args.json == "-":
+            print(json.dumps(result, indent=2))
+            return
+        _print_report(result)
+        if args.json:
+            Path(args.json).write_text(json.dumps(result, indent=2))
+            print(f"Report written to {args.json}", file=sys.stderr)
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log_file.close()
+        tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
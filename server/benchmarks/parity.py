@@ -0,0 +1,155 @@
+"""Parity check of a converted inference backend against DeepFace.
+
+For every photo, both backends embed the face and analyze emotion. The
+check reports:
+- cosine similarity between the two backends' embeddings of the same face
+- match decisions: the first photo of each person is enrolled (per backend),
+  every other photo is matched with MATCH_THRESHOLD, and the decisions of
+  the two backends are compared (and against the true identity)
+- dominant emotion agreement
+
+Photos are laid out one directory per person (`photos/alice/1.jpg`, ...).
+Exits with status 1 when mean similarity or decision agreement is below
+the limits, so it can gate a CI job that has DeepFace installed.
+
+Run from the server directory:
+
+    python -m benchmarks.parity --photos ~/faces --backend onnx
+    python -m benchmarks.parity --photos ~/faces --backend onnx --quantization int8 --json parity.json
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import settings
+from models.backends import InferenceBackend, create_backend
+from models.gallery import Gallery, best_matches, normalize_rows
+from utils.uploads import decode_image
+
+
+def load_photos(photos_dir: Path) -> List[Tuple[str, Path]]:
+    photos = [
+        (person.name, path)
+        for person in sorted(p for p in photos_dir.iterdir() if p.is_dir())
+        for path in sorted(person.iterdir())
+        if path.suffix.lower() in (".jpg", ".jpeg", ".png")
+    ]
+    if not photos:
+        raise SystemExit(f"No photos found under {photos_dir}/<person>/")
+    return photos
+
+
+def embed(backend: InferenceBackend, image: np.ndarray) -> Optional[np.ndarray]:
+    """Embedding of the single face in the image, None when not exactly one face is found."""
+    try:
+        faces = backend.represent(image)
+    except ValueError:
+        return None
+    return np.asarray(faces[0]["embedding"], dtype=np.float32) if len(faces) == 1 else None
+
+
+def decisions(people: List[str], embeddings: List[Optional[np.ndarray]]) -> Dict[int, Optional[str]]:
+    """Matched person (or None) for every photo after the first of each person."""
+    enrolled: Dict[str, np.ndarray] = {}
+    probes = []
+    for i, (person, embedding) in enumerate(zip(people, embeddings)):
+        if person not in enrolled and embedding is not None:
+            enrolled[person] = embedding
+        elif embedding is not None:
+            probes.append(i)
+    if not enrolled:
+        return {}
+    names = list(enrolled)
+    gallery = Gallery(
+        user_ids=np.arange(len(names), dtype=np.int64),
+        names=names,
+        matrix=normalize_rows(np.stack([enrolled[n] for n in names])),
+    )
+    result: Dict[int, Optional[str]] = {}
+    if probes:
+        for i, match in zip(probes, best_matches(gallery, np.stack([embeddings[i] for i in probes]))):
+            result[i] = match.name if match.score >= settings.match_threshold else None
+    return result
+
+
+def run(photos: List[Tuple[str, Path]], reference: InferenceBackend, candidate: InferenceBackend) -> Dict[str, Any]:
+    people = [person for person, _ in photos]
+    ref_embeddings, cand_embeddings, ref_emotions, cand_emotions = [], [], [], []
+    timings = {"reference": 0.0, "candidate": 0.0}
+    for _, path in photos:
+        image, _ = decode_image(path.read_bytes(), settings.decode_max_side)
+        for key, backend, embeddings, emotions in (
+            ("reference", reference, ref_embeddings, ref_emotions),
+            ("candidate", candidate, cand_embeddings, cand_emotions),
+        ):
+            start = time.perf_counter()
+            embeddings.append(embed(backend, image))
+            emotions.append(backend.analyze_emotion(image)["dominant_emotion"])
+            timings[key] += time.perf_counter() - start
+
+    both = [(r, c) for r, c in zip(ref_embeddings, cand_embeddings) if r is not None and c is not None]
+    similarities = [float(normalize_rows(r)[0] @ normalize_rows(c)[0]) for r, c in both]
+    ref_decisions = decisions(people, ref_embeddings)
+    cand_decisions = decisions(people, cand_embeddings)
+    compared = sorted(set(ref_decisions) & set(cand_decisions))
+    agreement = [ref_decisions[i] == cand_decisions[i] for i in compared]
+
+    def accuracy(result: Dict[int, Optional[str]]) -> Optional[float]:
+        return round(float(np.mean([result[i] == people[i] for i in result])), 4) if result else None
+
+    return {
+        "photos": len(photos),
+        "people": len(set(people)),
+        "faces_found": {
+            "reference": sum(e is not None for e in ref_embeddings),
+            "candidate": sum(e is not None for e in cand_embeddings),
+        },
+        "similarity": {
+            "mean": round(float(np.mean(similarities)), 4) if similarities else None,
+            "min": round(float(np.min(similarities)), 4) if similarities else None,
+            "p05": round(float(np.percentile(similarities, 5)), 4) if similarities else None,
+        },
+        "match_threshold": settings.match_threshold,
+        "decisions_compared": len(compared),
+        "decision_agreement": round(float(np.mean(agreement)), 4) if agreement else None,
+        "accuracy": {"reference": accuracy(ref_decisions), "candidate": accuracy(cand_decisions)},
+        "emotion_agreement": round(float(np.mean([r == c for r, c in zip(ref_emotions, cand_emotions)])), 4),
+        "seconds_per_photo": {k: round(v / len(photos), 4) for k, v in timings.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--photos", type=Path, required=True, help="directory with one subdirectory of photos per person")
+    parser.add_argument("--backend", choices=("onnx", "tflite"), default="onnx", help="backend to check")
+    parser.add_argument("--quantization", choices=("none", "int8"), default="none")
+    parser.add_argument("--min-similarity", type=float, default=0.95, help="minimum mean embedding similarity")
+    parser.add_argument("--min-agreement", type=float, default=0.98, help="minimum match decision agreement")
+    parser.add_argument("--json", metavar="PATH", help="write the report as JSON to PATH")
+    args = parser.parse_args()
+
+    photos = load_photos(args.photos)
+    report = run(photos, create_backend("deepface"), create_backend(args.backend, args.quantization))
+    report["backend"] = args.backend if args.quantization == "none" else f"{args.backend}-{args.quantization}"
+    print(json.dumps(report, indent=2))
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+
+    failures = []
+    if report["similarity"]["mean"] is None or report["similarity"]["mean"] < args.min_similarity:
+        failures.append(f"mean similarity {report['similarity']['mean']} < {args.min_similarity}")
+    if report["decision_agreement"] is None or report["decision_agreement"] < args.min_agreement:
+        failures.append(f"decision agreement {report['decision_agreement']} < {args.min_agreement}")
+    if failures:
+        print("Parity check failed: " + "; ".join(failures), file=sys.stderr)
+        sys.exit(1)
+    print("Parity check passed", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Run the API under uvicorn for load tests, optionally with stub models.
+
+Run from the server directory:
+
+    python -m benchmarks.serve --port 8000
+    python -m benchmarks.serve --stub-models --stub-embedding-ms 150 --enroll-frames frames/
+
+--enroll-frames registers one user per JPEG in the directory (named after
+the file) straight into the database, with embeddings from whichever models
+are active, so recognition works without going through /admin/upload and
+file storage. Point DATABASE_URL at a scratch database.
+"""
+import argparse
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def enroll(frames_dir: Path) -> int:
+    from db import SessionLocal, User, init_db
+    from models.face_recognition import embedding_to_bytes, extract_face_embedding
+
+    init_db()
+    db = SessionLocal()
+    try:
+        count = 0
+        for path in sorted(frames_dir.iterdir()):
+            if path.suffix.lower() not in (".jpg", ".jpeg", ".png"):
+                continue
+            embedding = extract_face_embedding(path.read_bytes())
+            db.add(User(name=path.stem, face_image_url="", face_embedding=embedding_to_bytes(embedding)))
+            count += 1
+        db.commit()
+        return count
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--stub-models", action="store_true", help="replace the inference backend and MediaPipe with benchmarks.stubs")
+    parser.add_argument("--stub-embedding-ms", type=float, default=0.0, help="simulated latency per stub embedding pass")
+    parser.add_argument("--stub-emotion-ms", type=float, default=0.0, help="simulated latency per stub emotion+gaze call")
+    parser.add_argument("--enroll-frames", type=Path, help="register one user per frame in this directory")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    import main as app_main
+
+    if args.stub_models:
+        from benchmarks import stubs
+        stubs.install(args.stub_embedding_ms, args.stub_emotion_ms)
+    if args.enroll_frames:
+        logger.info(f"Enrolled {enroll(args.enroll_frames)} users from {args.enroll_frames}")
+
+    uvicorn.run(app_main.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
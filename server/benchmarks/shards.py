@@ -0,0 +1,210 @@
+"""Sharded gallery check and benchmark with local shard processes.
+
+Starts --shards gallery shard processes (`python -m gallery_shard`) on a
+scratch SQLite database holding --users random users, then:
+- checks that the merged top-k of every query equals the in-process
+  gallery's top-k (same users, same order, same scores)
+- enrolls and removes a user through the coordinator and checks that only
+  the owning shard changes and that the user is found while enrolled
+- times searches for 1 and 8 faces, in-process vs scatter-gather
+- stops one shard and checks that searches fail instead of silently
+  matching against the remaining shards
+
+Exits with status 1 when a check fails. Run from the server directory:
+
+    python -m benchmarks.shards
+    python -m benchmarks.shards --shards 4 --users 100k --json shards.json
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+from benchmarks.suite import format_size, measure, parse_size
+from benchmarks.synthetic import random_embeddings
+
+BATCH = 10_000
+
+
+def populate(size: int) -> None:
+    from db import SessionLocal, User, init_db
+    from models.face_recognition import EMBEDDING_DIM
+
+    init_db()
+    db = SessionLocal()
+    try:
+        for start in range(0, size, BATCH):
+            embeddings = random_embeddings(min(BATCH, size - start), EMBEDDING_DIM, seed=start + 1)
+            db.execute(User.__table__.insert(), [
+                {"id": start + i + 1, "name": f"user-{start + i + 1}", "face_image_url": "", "face_embedding": e.tobytes()}
+                for i, e in enumerate(embeddings)
+            ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def queries(gallery, count: int, seed: int) -> np.ndarray:
+    """Noisy copies of enrolled embeddings (half) and unrelated ones (half)."""
+    rng = np.random.default_rng(seed)
+    enrolled = gallery.matrix[rng.integers(0, len(gallery), count // 2)]
+    noisy = enrolled + rng.standard_normal(enrolled.shape).astype(np.float32) * 0.03
+    return np.vstack([noisy, random_embeddings(count - len(noisy), gallery.matrix.shape[1], seed=seed + 1)])
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_shards(count: int, env: Dict[str, str], log_dir: Path) -> List[subprocess.Popen]:
+    processes = []
+    for index in range(count):
+        port = _free_port()
+        log_file = open(log_dir / f"shard-{index}.log", "w")
+        process = subprocess.Popen(
+            [sys.executable, "-m", "gallery_shard", "--index", str(index), "--count", str(count), "--port", str(port)],
+            env=env, stdout=log_file, stderr=subprocess.STDOUT,
+        )
+        process.url = f"http://127.0.0.1:{port}"
+        processes.append(process)
+    return processes
+
+
+def wait_ready(processes: List[subprocess.Popen], log_dir: Path, timeout: float = 120) -> None:
+    import requests
+
+    deadline = time.monotonic() + timeout
+    pending = list(enumerate(processes))
+    while pending and time.monotonic() < deadline:
+        for index, process in list(pending):
+            if process.poll() is not None:
+                log_tail = "\n".join((log_dir / f"shard-{index}.log").read_text().splitlines()[-20:])
+                raise SystemExit(f"Shard {index} exited with code {process.returncode}:\n{log_tail}")
+            try:
+                if requests.get(f"{process.url}/health", timeout=2).status_code == 200:
+                    pending.remove((index, process))
+            except requests.RequestException:
+                pass
+        time.sleep(0.2)
+    if pending:
+        raise SystemExit(f"Shards {[i for i, _ in pending]} not ready after {timeout:.0f}s")
+
+
+def run(args: argparse.Namespace, urls: List[str], processes: List[subprocess.Popen]) -> Dict[str, Any]:
+    from db import SessionLocal
+    from models.gallery import load_gallery, top_k_matches
+    from models.sharding import ShardedGallery, ShardUnavailable, shard_for
+
+    db = SessionLocal()
+    try:
+        local = load_gallery(db)
+    finally:
+        db.close()
+    sharded = ShardedGallery(urls, top_k=args.top_k, timeout=10)
+    checks: Dict[str, bool] = {}
+
+    # Same candidates as the in-process gallery
+    probe = queries(local, args.queries, seed=7)
+    expected = top_k_matches(local, probe, args.top_k)
+    merged = sharded.search(probe)
+    checks["top_k_matches_local"] = all(
+        [m.id for m in e] == [m.id for m in g] and np.allclose([m.score for m in e], [m.score for m in g], atol=1e-5)
+        for e, g in zip(expected, merged)
+    )
+
+    # Enrollment goes to the owning shard only
+    new_id = len(local) + 1
+    embedding = random_embeddings(1, local.matrix.shape[1], seed=99)[0]
+    before = [h["size"] for h in sharded.health()]
+    sharded.enroll(new_id, "enrolled", embedding)
+    after = [h["size"] for h in sharded.health()]
+    owner = shard_for(new_id, len(urls))
+    checks["enroll_routed_to_owner"] = all(a - b == (1 if i == owner else 0) for i, (a, b) in enumerate(zip(after, before)))
+    best = sharded.best_matches(embedding)[0]
+    checks["enrolled_user_found"] = best is not None and best.id == new_id and best.score > 0.999
+    sharded.remove(new_id)
+    best = sharded.best_matches(embedding)[0]
+    checks["removed_user_gone"] = best is None or best.id != new_id
+
+    timings = []
+    for faces in (1, 8):
+        batch = queries(local, faces, seed=faces)
+        for variant, fn in (
+            ("in-process", lambda: top_k_matches(local, batch, args.top_k)),
+            (f"{len(urls)} shards", lambda: sharded.search(batch)),
+        ):
+            stats = measure(fn, args.repeat, budget_seconds=30)
+            timings.append({"faces": faces, "variant": variant, **stats})
+            print(f"  search [{format_size(len(local))}] {faces} faces {variant:<12} "
+                  f"p50 {stats['p50_ms']:>8.2f}ms  p95 {stats['p95_ms']:>8.2f}ms", file=sys.stderr)
+
+    # A missing shard fails the search rather than returning partial candidates
+    processes[0].terminate()
+    processes[0].wait(timeout=10)
+    try:
+        sharded.search(probe[:1])
+        checks["down_shard_fails_search"] = False
+    except ShardUnavailable:
+        checks["down_shard_fails_search"] = True
+
+    return {
+        "shards": len(urls),
+        "users": len(local),
+        "top_k": args.top_k,
+        "queries": args.queries,
+        "checks": checks,
+        "timings": timings,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shards", type=int, default=3, help="number of shard processes")
+    parser.add_argument("--users", type=parse_size, default=parse_size("10k"), help="users in the gallery (e.g. 10k, 1M)")
+    parser.add_argument("--top-k", type=int, default=5, help="candidates per shard")
+    parser.add_argument("--queries", type=int, default=200, help="query embeddings compared with the in-process gallery")
+    parser.add_argument("--repeat", type=int, default=50, help="timed runs per search")
+    parser.add_argument("--json", metavar="PATH", help="write the report as JSON to PATH")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.TemporaryDirectory(prefix="presensense-shards-")
+    database_url = f"sqlite:///{tmp_dir.name}/shards.db"
+    # db.py reads DATABASE_URL on import
+    os.environ["DATABASE_URL"] = database_url
+    processes: List[subprocess.Popen] = []
+    try:
+        populate(args.users)
+        print(f"{format_size(args.users)} users across {args.shards} shard processes", file=sys.stderr)
+        log_dir = Path(tmp_dir.name)
+        processes = start_shards(args.shards, {**os.environ, "DATABASE_URL": database_url}, log_dir)
+        wait_ready(processes, log_dir)
+        report = run(args, [p.url for p in processes], processes)
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+                process.wait(timeout=10)
+        tmp_dir.cleanup()
+
+    print(json.dumps(report["checks"], indent=2))
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+    failed = [name for name, ok in report["checks"].items() if not ok]
+    if failed:
+        print(f"Sharded gallery checks failed: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+    print("Sharded gallery checks passed", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
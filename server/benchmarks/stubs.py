@@ -0,0 +1,115 @@
+"""Deterministic stand-ins for the DeepFace/MediaPipe models.
+
+`install()` makes a `StubBackend` the inference backend and replaces the
+emotion detector's Haar cascade and MediaPipe gaze tracking, so benchmarks
+and load tests run offline without TensorFlow or model weights. Everything
+around the models (decoding, gallery search, database, routing) stays real.
+
+Every decoded frame is treated as containing one face in its central half.
+The embedding is derived from a hash of that crop, so the same frame always
+yields the same embedding and different frames yield unrelated ones. An
+optional sleep per call approximates real model latency.
+"""
+import hashlib
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from models.backends import EMOTION_LABELS, InferenceBackend, set_backend
+
+
+def _face_box(image: np.ndarray) -> Tuple[int, int, int, int]:
+    height, width = image.shape[:2]
+    return width // 4, height // 4, width // 2, height // 2
+
+
+def _digest(array: np.ndarray) -> bytes:
+    return hashlib.sha1(np.ascontiguousarray(array).tobytes()).digest()
+
+
+def stub_embedding(face: np.ndarray, dim: int = 128) -> np.ndarray:
+    """Unit-length embedding seeded by the face pixels."""
+    rng = np.random.default_rng(int.from_bytes(_digest(face)[:8], "little"))
+    embedding = rng.standard_normal(dim).astype(np.float32)
+    return embedding / np.linalg.norm(embedding)
+
+
+class StubBackend(InferenceBackend):
+    name = "stub"
+
+    def __init__(self, embedding_ms: float = 0.0, emotion_ms: float = 0.0):
+        self.embedding_seconds = embedding_ms / 1000
+        self.emotion_seconds = emotion_ms / 1000
+
+    def detect_faces(self, image: np.ndarray) -> List[Dict[str, Any]]:
+        x, y, w, h = _face_box(image)
+        return [{
+            "face": image[y:y + h, x:x + w, ::-1].astype(np.float32) / 255,
+            "facial_area": {"x": x, "y": y, "w": w, "h": h},
+            "confidence": 1.0,
+        }]
+
+    def embed_faces(self, faces: List[np.ndarray], batch_size: int = 32) -> np.ndarray:
+        from models.face_recognition import EMBEDDING_DIM
+
+        # One sleep per forward pass, as with real batching
+        time.sleep(self.embedding_seconds * -(-len(faces) // batch_size))
+        return np.stack([stub_embedding(face, EMBEDDING_DIM) for face in faces])
+
+    def represent(self, image: np.ndarray) -> List[Dict[str, Any]]:
+        faces = self.detect_faces(image)
+        embeddings = self.embed_faces([f["face"] for f in faces])
+        return [{"embedding": e, "facial_area": f["facial_area"]} for f, e in zip(faces, embeddings)]
+
+    def analyze_emotion(self, image: np.ndarray) -> Dict[str, Any]:
+        time.sleep(self.emotion_seconds / 2)
+        scores = np.frombuffer(_digest(image)[:len(EMOTION_LABELS)], dtype=np.uint8).astype(np.float64) + 1
+        scores = scores / scores.sum() * 100
+        return {
+            "emotions": {label: float(s) for label, s in zip(EMOTION_LABELS, scores)},
+            "dominant_emotion": EMOTION_LABELS[int(np.argmax(scores))],
+        }
+
+    def warmup_recognition(self) -> Dict[str, Tuple[float, float]]:
+        return {"facenet": (0.0, 0.0)}
+
+    def warmup_emotion(self) -> Tuple[float, float]:
+        return 0.0, 0.0
+
+
+def _stub_detector(gaze_seconds: float):
+    from models.emotion_detection import EmotionDetector
+
+    class StubEmotionDetector(EmotionDetector):
+        """EmotionDetector without the Haar cascade or MediaPipe."""
+
+        def __init__(self):
+            self.load_seconds = {"haar": 0.0, "facemesh": 0.0}
+
+        def detect_faces_opencv(self, image: np.ndarray) -> list:
+            return [_face_box(image)]
+
+        def detect_gaze_direction(self, image: np.ndarray) -> Dict[str, Any]:
+            time.sleep(gaze_seconds)
+            looking = _digest(image)[-1] % 4 != 0
+            return {
+                "is_looking_at_camera": looking,
+                "confidence": 0.9 if looking else 0.3,
+                "left_ear": 0.3,
+                "right_ear": 0.3,
+                "gaze_direction": "center" if looking else "left",
+            }
+
+    return StubEmotionDetector()
+
+
+def install(embedding_ms: float = 0.0, emotion_ms: float = 0.0) -> None:
+    """Use the stubs in this process; call before the first request.
+
+    `emotion_ms` is split between the emotion model and gaze tracking.
+    """
+    import models.emotion_detection as emotion_detection
+
+    set_backend(StubBackend(embedding_ms, emotion_ms))
+    emotion_detection._emotion_detector = _stub_detector(emotion_ms / 2000)
@@ -0,0 +1,370 @@
+"""Latency benchmarks for gallery scoring, database paths and the match routes.
+
+Sections:
+- gallery scoring: one and eight query embeddings against in-memory
+  galleries of every size (default 1k, 10k, 100k, 1M)
+- per database size (users and attendance rows, up to --db-max-size):
+  gallery load, attendance dedup (hit, insert, eight users at once) and the
+  end-to-end `/match/`, `/match/stream` and `/match/with-emotion` routes
+- emotion: session stats over 100/1k/10k records and emotion record
+  ingestion (`/emotion/analyze-frame` and the `/match/with-emotion` writer)
+
+Models are replaced by the deterministic stubs in `benchmarks.stubs` unless
+--real-models is given (which uses INFERENCE_BACKEND and needs frames with
+real faces, see --frames). The database is a fresh SQLite file unless --database-url is
+given; its contents are replaced.
+
+Run from the server directory:
+
+    python -m benchmarks.suite
+    python -m benchmarks.suite --json results.json
+    python -m benchmarks.suite --sizes 1k,10k --baseline results.json
+    python -m benchmarks.suite --real-models --frames ~/kiosk-frames
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+PEOPLE = 16
+BATCH = 10_000
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * multiplier)
+
+
+def format_size(size: int) -> str:
+    if size >= 1_000_000 and size % 1_000_000 == 0:
+        return f"{size // 1_000_000}M"
+    if size >= 1_000 and size % 1_000 == 0:
+        return f"{size // 1_000}k"
+    return str(size)
+
+
+def measure(fn: Callable[[], Any], repeat: int, budget_seconds: float) -> Dict[str, float]:
+    """Time `fn` after one warm-up call: `repeat` runs, fewer (min 3) if over budget."""
+    fn()
+    samples = []
+    deadline = time.perf_counter() + budget_seconds
+    while len(samples) < repeat and (len(samples) < 3 or time.perf_counter() < deadline):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    ms = np.array(samples) * 1000
+    return {
+        "n": len(samples),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "min_ms": round(float(ms.min()), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+class Suite:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.results: List[Dict[str, Any]] = []
+
+    def run(
+        self,
+        benchmark: str,
+        size: Optional[int],
+        variant: str,
+        fn: Callable[[], Any],
+        repeat: Optional[int] = None,
+        extra: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        stats = measure(fn, repeat or self.args.repeat, self.args.budget)
+        self.results.append({"benchmark": benchmark, "size": size, "variant": variant, **stats, **(extra or {})})
+        label = f"{benchmark} [{format_size(size) if size else '-'}] {variant}"
+        notes = "".join(f"  {key} {value}" for key, value in (extra or {}).items())
+        print(f"  {label:<56} p50 {stats['p50_ms']:>10.2f}ms  p95 {stats['p95_ms']:>10.2f}ms{notes}", file=sys.stderr)
+
+    # Gallery scoring (in memory)
+
+    def gallery_scoring(self, size: int) -> None:
+        from models.face_recognition import EMBEDDING_DIM
+        from models.gallery import build_gallery, best_matches
+
+        from benchmarks.synthetic import random_embeddings
+
+        for templates in (1, 3):
+            if templates > 1 and size * templates > 1_000_000:
+                continue
+            # Every user gets `templates` rows, scored together with a segment max
+            gallery = build_gallery(
+                np.repeat(np.arange(1, size + 1, dtype=np.int64), templates),
+                random_embeddings(size * templates, EMBEDDING_DIM, seed=1),
+                dict.fromkeys(range(1, size + 1), "user"),
+            )
+            memory = {"gallery_mb": round(gallery.nbytes / 2 ** 20, 1)}
+            suffix = "" if templates == 1 else f", {templates} templates"
+            for faces in (1, 8):
+                queries = random_embeddings(faces, EMBEDDING_DIM, seed=2)
+                self.run("gallery_scoring", size, f"{faces} faces{suffix}", partial(best_matches, gallery, queries), extra=memory)
+            del gallery
+
+    # Database-backed sections
+
+    def populate(self, size: int, people: np.ndarray) -> None:
+        """Replace users and attendance with `size` rows each; the first users are `people`."""
+        from db import Attendance, EmotionRecord, EmotionSession, SessionLocal, User
+        from models.face_recognition import EMBEDDING_DIM
+        from utils.frame_cache import frame_cache
+        from utils.user_directory import user_directory
+
+        from benchmarks.synthetic import random_embeddings
+
+        db = SessionLocal()
+        try:
+            for model in (EmotionRecord, EmotionSession, Attendance, User):
+                db.query(model).delete()
+            db.commit()
+            for start in range(0, size, BATCH):
+                count = min(BATCH, size - start)
+                embeddings = random_embeddings(count, EMBEDDING_DIM, seed=start + 3)
+                if start == 0:
+                    embeddings[:len(people)] = people
+                db.execute(User.__table__.insert(), [
+                    {"id": start + i + 1, "name": f"user-{start + i + 1}", "face_image_url": "", "face_embedding": e.tobytes()}
+                    for i, e in enumerate(embeddings)
+                ])
+            # History older than the dedup window, so every user can still get a new row
+            rng = np.random.default_rng(4)
+            oldest = datetime.utcnow() - timedelta(days=1)
+            for start in range(0, size, BATCH):
+                count = min(BATCH, size - start)
+                db.execute(Attendance.__table__.insert(), [
+                    {"user_id": int(u), "timestamp": oldest - timedelta(seconds=int(s))}
+                    for u, s in zip(rng.integers(1, size + 1, count), rng.integers(0, 30 * 86400, count))
+                ])
+            db.commit()
+        finally:
+            db.close()
+        user_directory.invalidate()
+        frame_cache.clear()
+
+    def database(self, size: int, client, frames: List[bytes]) -> None:
+        from db import SessionLocal
+        from models.gallery import load_gallery
+        from routes.match import _record_attendance, _record_attendance_many
+
+        db = SessionLocal()
+        try:
+            repeat = max(3, min(self.args.repeat, 10_000_000 // size))
+            self.run("gallery_load", size, "load_gallery", lambda: load_gallery(db), repeat)
+
+            # Users 1..PEOPLE get a fresh row on warm-up and are deduplicated from then on
+            self.run("attendance_dedup", size, "hit", lambda: _record_attendance(db, 1))
+            fresh = itertools.cycle(range(PEOPLE + 1, size + 1))
+            self.run("attendance_dedup", size, "insert", lambda: _record_attendance(db, next(fresh)))
+            self.run("attendance_dedup", size, "8 users", lambda: _record_attendance_many(db, range(1, 9)))
+        finally:
+            db.close()
+
+        self.routes(size, client, frames)
+
+    def routes(self, size: int, client, frames: List[bytes]) -> None:
+        from utils.inference_cache import inference_cache
+
+        def post(path: str, frame_iter=itertools.cycle(frames)) -> Callable[[], None]:
+            camera = itertools.count()
+
+            def call() -> None:
+                # A new camera id per frame, so the frame and track caches never answer
+                response = client.post(
+                    path,
+                    files={"file": ("frame.jpg", next(frame_iter), "image/jpeg")},
+                    headers={"X-Camera-Id": f"bench-{size}-{path}-{next(camera)}"},
+                )
+                if response.status_code != 200:
+                    raise RuntimeError(f"{path} returned {response.status_code}: {response.text[:200]}")
+            return call
+
+        repeat = max(3, min(self.args.repeat, 10_000_000 // size))
+        for path in ("/match/", "/match/stream", "/match/with-emotion"):
+            self.run("match_route", size, path, post(path), repeat)
+
+        # A client re-sending the same bytes: models are skipped via the inference cache
+        enabled = inference_cache.enabled
+        inference_cache.enabled = True
+        try:
+            self.run("match_route", size, "/match/ (resent)", post("/match/", itertools.repeat(frames[0])), repeat)
+        finally:
+            inference_cache.enabled = enabled
+            inference_cache.clear()
+
+    def emotion(self, client, frames: List[bytes]) -> None:
+        from db import EmotionRecord, EmotionSession, SessionLocal
+        from routes.match import _store_emotion_record
+
+        db = SessionLocal()
+        try:
+            for records in (100, 1_000, 10_000):
+                session = EmotionSession(user_id=PEOPLE + 1)
+                db.add(session)
+                db.commit()
+                start = datetime.utcnow() - timedelta(seconds=records * 5)
+                db.execute(EmotionRecord.__table__.insert(), [
+                    {
+                        "session_id": session.id,
+                        "timestamp": start + timedelta(seconds=i * 5),
+                        "dominant_emotion": "neutral",
+                        "emotion_confidence": 90.0,
+                        "is_looking_at_camera": i % 3 != 0,
+                        "eye_contact_confidence": 0.8,
+                    }
+                    for i in range(records)
+                ])
+                db.commit()
+                url = f"/emotion/session/{session.id}/stats"
+                self.run("session_stats", records, "records", lambda: client.get(url).raise_for_status())
+
+            session = EmotionSession(user_id=PEOPLE + 2)
+            db.add(session)
+            db.commit()
+            frame_iter = itertools.cycle(frames)
+            url = f"/emotion/analyze-frame?session_id={session.id}"
+            self.run("emotion_ingest", None, "/emotion/analyze-frame", lambda: client.post(
+                url, files={"file": ("frame.jpg", next(frame_iter), "image/jpeg")}
+            ).raise_for_status())
+
+            analysis = {
+                "emotion": {"dominant_emotion": "happy", "confidence": 88.0},
+                "gaze": {"is_looking_at_camera": True, "confidence": 0.9},
+                "face_bbox": {"x": 10, "y": 10, "width": 100, "height": 100},
+            }
+            self.run("emotion_ingest", None, "store_emotion_record", lambda: _store_emotion_record(db, PEOPLE + 3, analysis))
+        finally:
+            db.close()
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _compare(results: List[Dict[str, Any]], baseline_path: Path) -> None:
+    baseline = {
+        (r["benchmark"], r["size"], r["variant"]): r
+        for r in json.loads(baseline_path.read_text())["results"]
+    }
+    print(f"\nChange in p50 vs {baseline_path}:")
+    for r in results:
+        old = baseline.get((r["benchmark"], r["size"], r["variant"]))
+        if old is None or not old["p50_ms"]:
+            continue
+        change = (r["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100
+        label = f"{r['benchmark']} [{format_size(r['size']) if r['size'] else '-'}] {r['variant']}"
+        print(f"  {label:<56} {old['p50_ms']:>10.2f}ms -> {r['p50_ms']:>10.2f}ms  {change:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1k,10k,100k,1M", help="gallery sizes, e.g. 1k,10k,100k,1M")
+    parser.add_argument("--db-max-size", default="100k", help="largest size for the database and route sections")
+    parser.add_argument("--repeat", type=int, default=50, help="timed runs per benchmark")
+    parser.add_argument("--budget", type=float, default=10.0, help="seconds per benchmark before stopping early (min 3 runs)")
+    parser.add_argument("--real-models", action="store_true", help="use INFERENCE_BACKEND and MediaPipe instead of the stubs")
+    parser.add_argument("--stub-embedding-ms", type=float, default=0.0, help="simulated latency per stub embedding pass")
+    parser.add_argument("--stub-emotion-ms", type=float, default=0.0, help="simulated latency per stub emotion+gaze call")
+    parser.add_argument("--frames", type=Path, help="directory of JPEG frames to send (needed with --real-models)")
+    parser.add_argument("--database-url", help="database to benchmark against (contents are replaced); default a temp SQLite file")
+    parser.add_argument("--json", metavar="PATH", help="write results as JSON to PATH ('-' for stdout)")
+    parser.add_argument("--baseline", type=Path, help="earlier --json output to compare p50 latencies against")
+    args = parser.parse_args()
+
+    sizes = sorted(parse_size(s) for s in args.sizes.split(","))
+    db_max_size = parse_size(args.db_max_size)
+
+    # Settings are read at import time, so the environment is set up first
+    tmp_dir = tempfile.TemporaryDirectory(prefix="presensense-bench-")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tmp_dir.name}/bench.db"
+    os.environ.setdefault("SLOW_REQUEST_MS", "0")
+    # Benchmark frames repeat, which the inference cache would answer; it is measured separately
+    os.environ.setdefault("INFERENCE_CACHE_ENABLED", "false")
+    logging.disable(logging.WARNING)
+
+    from fastapi.testclient import TestClient
+
+    import main as app_main
+    from models.face_recognition import extract_face_embedding
+    from utils.readiness import readiness
+
+    from benchmarks import stubs
+    from benchmarks.synthetic import load_frames
+
+    if args.real_models and args.frames is None:
+        print("warning: --real-models without --frames; synthetic frames contain no face", file=sys.stderr)
+    if not args.real_models:
+        stubs.install(args.stub_embedding_ms, args.stub_emotion_ms)
+
+    frames = load_frames(PEOPLE, args.frames)
+    suite = Suite(args)
+    started = time.perf_counter()
+    with TestClient(app_main.app) as client:
+        while not readiness.finished:
+            time.sleep(0.1)
+        if not readiness.ready:
+            raise SystemExit(f"model warm-up failed: {readiness.errors()}")
+        people = np.stack([extract_face_embedding(frame) for frame in frames])
+
+        for size in sizes:
+            print(f"gallery scoring, {format_size(size)} embeddings", file=sys.stderr)
+            suite.gallery_scoring(size)
+        for size in (s for s in sizes if s <= db_max_size):
+            print(f"database and routes, {format_size(size)} users", file=sys.stderr)
+            suite.populate(size, people)
+            suite.database(size, client, frames)
+        print("emotion", file=sys.stderr)
+        suite.emotion(client, frames)
+
+    output = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "models": "real" if args.real_models else "stub",
+            "stub_embedding_ms": None if args.real_models else args.stub_embedding_ms,
+            "stub_emotion_ms": None if args.real_models else args.stub_emotion_ms,
+            "frames": str(args.frames) if args.frames else "synthetic",
+            "database": "custom" if args.database_url else "sqlite-temp",
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "duration_seconds": round(time.perf_counter() - started, 1),
+        },
+        "results": suite.results,
+    }
+    if args.json == "-":
+        print(json.dumps(output, indent=2))
+    elif args.json:
+        Path(args.json).write_text(json.dumps(output, indent=2))
+        print(f"Results written to {args.json}", file=sys.stderr)
+    if args.baseline:
+        _compare(suite.results, args.baseline)
+    tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""Synthetic frames and embeddings shared by the benchmarks and the load test."""
+from pathlib import Path
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+
+def synthetic_photo(width: int, height: int, seed: int = 0) -> bytes:
+    """A JPEG with smooth gradients and some noise, roughly like a camera photo."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    image = np.stack([xx / width * 255, yy / height * 255, (xx + yy) / (width + height) * 255], axis=-1)
+    image += rng.normal(0, 8, image.shape)
+    return cv2.imencode(".jpg", np.clip(image, 0, 255).astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def load_frames(count: int, frames_dir: Optional[Path] = None, width: int = 640, height: int = 480) -> List[bytes]:
+    """`count` distinct frames: JPEGs from `frames_dir` (cycled) or synthetic ones.
+
+    Recorded kiosk frames are needed with the real models, which find no face
+    in synthetic frames.
+    """
+    if frames_dir is not None:
+        paths = sorted(p for p in Path(frames_dir).iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+        if not paths:
+            raise SystemExit(f"No .jpg/.jpeg/.png frames in {frames_dir}")
+        return [paths[i % len(paths)].read_bytes() for i in range(count)]
+    return [synthetic_photo(width, height, seed) for seed in range(count)]
+
+
+def random_embeddings(count: int, dim: int = 128, seed: int = 0) -> np.ndarray:
+    """Unit-length float32 embeddings with no structure (gallery filler)."""
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((count, dim), dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings
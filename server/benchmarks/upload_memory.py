@@ -0,0 +1,97 @@
+"""Peak memory per request for upload reading and image decoding.
+
+Compares the old path (read the whole upload, decode at full resolution)
+with `read_upload` + `decode_image` for synthetic photos of several sizes.
+Peaks are measured with tracemalloc, which sees Python and NumPy/OpenCV
+output buffers (OpenCV's internal scratch memory is not included).
+
+Run from the server directory:
+
+    python -m benchmarks.upload_memory
+    python -m benchmarks.upload_memory --json
+"""
+import argparse
+import asyncio
+import json
+import tracemalloc
+from tempfile import SpooledTemporaryFile
+
+import cv2
+import numpy as np
+from fastapi import UploadFile
+
+from config import settings
+from utils.uploads import decode_image, read_upload
+
+from benchmarks.synthetic import synthetic_photo
+
+SIZES = {"VGA": (640, 480), "1080p": (1920, 1080), "12MP": (4032, 3024)}
+
+
+def _upload(data: bytes) -> UploadFile:
+    # Same spooling as Starlette's multipart parser
+    spool = SpooledTemporaryFile(max_size=1024 * 1024)
+    spool.write(data)
+    spool.seek(0)
+    return UploadFile(spool, size=len(data), filename="photo.jpg")
+
+
+async def _peak(path, data: bytes) -> int:
+    """Peak traced memory of one request, from the spooled upload to the decoded image."""
+    upload = _upload(data)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        await path(upload)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+async def old_path(upload: UploadFile) -> None:
+    content = await upload.read()
+    cv2.imdecode(np.frombuffer(content, np.uint8), cv2.IMREAD_COLOR)
+
+
+async def new_path(upload: UploadFile) -> None:
+    content = await read_upload(upload)
+    decode_image(content)
+
+
+async def run() -> list:
+    results = []
+    for name, (width, height) in SIZES.items():
+        data = synthetic_photo(width, height)
+        # First calls pay for lazy imports and thread pool setup; keep them out of the peaks
+        await _peak(old_path, data)
+        await _peak(new_path, data)
+        image, _ = decode_image(data)
+        results.append({
+            "image": name,
+            "resolution": f"{width}x{height}",
+            "jpeg_bytes": len(data),
+            "decoded": f"{image.shape[1]}x{image.shape[0]}",
+            "old_peak_bytes": await _peak(old_path, data),
+            "new_peak_bytes": await _peak(new_path, data),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = asyncio.run(run())
+    if args.json:
+        print(json.dumps({"decode_max_side": settings.decode_max_side, "results": results}, indent=2))
+        return
+    print(f"DECODE_MAX_SIDE={settings.decode_max_side}")
+    print(f"{'image':<8}{'resolution':>12}{'jpeg':>10}{'decoded':>12}{'old peak':>12}{'new peak':>12}")
+    for r in results:
+        print(f"{r['image']:<8}{r['resolution']:>12}{r['jpeg_bytes'] / 1e6:>8.1f}MB{r['decoded']:>12}"
+              f"{r['old_peak_bytes'] / 1e6:>10.1f}MB{r['new_peak_bytes'] / 1e6:>10.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
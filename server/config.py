@@ -1,12 +1,13 @@
 import os
 from pathlib import Path
+from typing import List
 
 class Settings:
     # Base directory
     base_dir: Path = Path(__file__).resolve().parent
     
-    # Uploads directory
-    uploads_dir: Path = base_dir / "uploads"
+    # Uploads directory (local storage when no GCP bucket is configured)
+    uploads_dir: Path = Path(os.getenv("UPLOADS_DIR", str(base_dir / "uploads")))
     
     # GCP Configuration
     gcp_project_id: str = os.getenv("GCP_PROJECT_ID", "")
@@ -17,9 +18,120 @@ class Settings:
     match_threshold: float = float(os.getenv("MATCH_THRESHOLD", "0.6"))
     # Deduplicate attendance within this many seconds (e.g., 300 = 5 minutes)
     attendance_dedup_seconds: int = int(os.getenv("ATTENDANCE_DEDUP_SECONDS", "300"))
+
+    # Near-duplicate frame skipping for camera clients
+    frame_cache_enabled: bool = os.getenv("FRAME_CACHE_ENABLED", "true").lower() == "true"
+    # Mean absolute pixel difference (0-1) below which a frame counts as unchanged
+    frame_cache_threshold: float = float(os.getenv("FRAME_CACHE_THRESHOLD", "0.02"))
+    # Cached results older than this are never reused
+    frame_cache_max_age_seconds: float = float(os.getenv("FRAME_CACHE_MAX_AGE_SECONDS", "10"))
+
+    # Identity tracking for /match/stream: keep a recognized user while the face box stays put
+    track_cache_enabled: bool = os.getenv("TRACK_CACHE_ENABLED", "true").lower() == "true"
+    track_iou_threshold: float = float(os.getenv("TRACK_IOU_THRESHOLD", "0.5"))
+    # Re-check the tracked identity with a fresh embedding this often
+    track_reverify_seconds: float = float(os.getenv("TRACK_REVERIFY_SECONDS", "30"))
+    # Tracks not seen for this long expire
+    track_ttl_seconds: float = float(os.getenv("TRACK_TTL_SECONDS", "10"))
+    
+    # Uploaded files larger than this are rejected with 413
+    max_upload_bytes: int = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+    # Request bodies larger than this are rejected with 413 before they are parsed
+    # (one upload plus form fields and multipart framing)
+    max_request_bytes: int = int(os.getenv("MAX_REQUEST_BYTES", str(max_upload_bytes + 1024 * 1024)))
+    # Images are decoded no larger than this on the long side (0 = full resolution)
+    decode_max_side: int = int(os.getenv("DECODE_MAX_SIDE", "1280"))
+
+    # Face templates per user, the enrollment photo included (POST /admin/users/{id}/templates)
+    max_templates_per_user: int = int(os.getenv("MAX_TEMPLATES_PER_USER", "5"))
+
+    # Offline backlog replay (/match/batch)
+    batch_max_frames: int = int(os.getenv("BATCH_MAX_FRAMES", "200"))
+    # Request body limit of /match/batch, which carries many frames
+    batch_max_request_bytes: int = int(os.getenv("BATCH_MAX_REQUEST_BYTES", str(64 * 1024 * 1024)))
+    # Frames per inference slot and faces per Facenet forward pass when embedding many frames
+    embedding_batch_size: int = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+    # Reject capture times further than this in the future (clock skew allowance)
+    batch_max_clock_skew_seconds: int = int(os.getenv("BATCH_MAX_CLOCK_SKEW_SECONDS", "120"))
+
+    # Embedding model version that stored embeddings were produced with; edge
+    # clients posting embeddings to /match/embedding must send the same tag
+    embedding_model_version: str = os.getenv("EMBEDDING_MODEL_VERSION", "deepface-0.0.95")
+
+    # Re-embedding jobs (POST /admin/reembed): users whose images are embedded and
+    # checkpointed together, and images read and queued for inference in parallel
+    reembed_batch_size: int = int(os.getenv("REEMBED_BATCH_SIZE", "32"))
+    reembed_workers: int = int(os.getenv("REEMBED_WORKERS", "2"))
+    # API server processes (uvicorn and gunicorn read WEB_CONCURRENCY as their
+    # worker count). A switch only moves the process that runs it to the new
+    # model, so switching is refused with more than one
+    web_concurrency: int = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+    # Model runtime: deepface (Keras/TensorFlow), or onnx / tflite running weights
+    # converted with `python -m models.backends.convert`
+    inference_backend: str = os.getenv("INFERENCE_BACKEND", "deepface").lower()
+    model_dir: Path = Path(os.getenv("MODEL_DIR", str(base_dir / "model_weights")))
+    # none or int8 (the quantized files written by the converter)
+    model_quantization: str = os.getenv("MODEL_QUANTIZATION", "none").lower()
+
+    # Gallery sharding: comma-separated base URLs of shard processes (`python -m gallery_shard`),
+    # users are assigned to shard `user_id % shard count`; empty keeps the gallery in-process
+    gallery_shards: List[str] = [url.strip() for url in os.getenv("GALLERY_SHARDS", "").split(",") if url.strip()]
+    # Candidates each shard returns per query embedding
+    gallery_shard_top_k: int = int(os.getenv("GALLERY_SHARD_TOP_K", "5"))
+    gallery_shard_timeout_seconds: float = float(os.getenv("GALLERY_SHARD_TIMEOUT_SECONDS", "2"))
+
+    # Results of identical image bytes (retries, re-sends, the same frame sent to
+    # several endpoints) are reused instead of running the models again
+    inference_cache_enabled: bool = os.getenv("INFERENCE_CACHE_ENABLED", "true").lower() == "true"
+    inference_cache_max_bytes: int = int(os.getenv("INFERENCE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+    inference_cache_ttl_seconds: float = float(os.getenv("INFERENCE_CACHE_TTL_SECONDS", "300"))
+
+    # Threads running model inference. One of them is kept for live check-ins,
+    # so with a single worker background work can still hold it
+    inference_workers: int = int(os.getenv("INFERENCE_WORKERS", "2"))
+
+    # Admission to the inference pool by request class. Live check-ins
+    # (/match/*) go first, then emotion analysis, enrollments, /match/batch
+    # replays and re-embedding jobs; each background class may hold at most
+    # this many workers at once (emotion analysis uses MediaPipe FaceMesh,
+    # which is not thread-safe, so keep its concurrency at 1). A request still queued at its class deadline gets a 503
+    # with Retry-After instead of running late (milliseconds)
+    inference_live_deadline_ms: int = int(os.getenv("INFERENCE_LIVE_DEADLINE_MS", "2000"))
+    inference_emotion_deadline_ms: int = int(os.getenv("INFERENCE_EMOTION_DEADLINE_MS", "5000"))
+    inference_emotion_concurrency: int = int(os.getenv("INFERENCE_EMOTION_CONCURRENCY", "1"))
+    inference_enroll_deadline_ms: int = int(os.getenv("INFERENCE_ENROLL_DEADLINE_MS", "30000"))
+    inference_enroll_concurrency: int = int(os.getenv("INFERENCE_ENROLL_CONCURRENCY", "1"))
+    inference_batch_deadline_ms: int = int(os.getenv("INFERENCE_BATCH_DEADLINE_MS", "120000"))
+    inference_batch_concurrency: int = int(os.getenv("INFERENCE_BATCH_CONCURRENCY", "1"))
+    inference_reembed_deadline_ms: int = int(os.getenv("INFERENCE_REEMBED_DEADLINE_MS", "600000"))
+    inference_reembed_concurrency: int = int(os.getenv("INFERENCE_REEMBED_CONCURRENCY", "1"))
+
+    # Emotion/gaze analysis of /match/with-emotion and /match/ws frames runs
+    # after the check-in is answered, from a queue of at most this many frames
+    # (further frames are not analyzed, nor are frames still queued at the
+    # emotion deadline above); finished results can be polled for this many seconds
+    emotion_queue_size: int = int(os.getenv("EMOTION_QUEUE_SIZE", "256"))
+    emotion_result_ttl_seconds: float = float(os.getenv("EMOTION_RESULT_TTL_SECONDS", "60"))
+
+    # Next-frame interval recommended to camera clients (milliseconds)
+    client_interval_ms: int = int(os.getenv("CLIENT_INTERVAL_MS", "3000"))
+    client_interval_min_ms: int = int(os.getenv("CLIENT_INTERVAL_MIN_MS", "1000"))
+    client_interval_max_ms: int = int(os.getenv("CLIENT_INTERVAL_MAX_MS", "15000"))
     
+    # Requests slower than this are logged with their stage breakdown (milliseconds, 0 disables)
+    slow_request_ms: int = int(os.getenv("SLOW_REQUEST_MS", "2000"))
+    server_timing_enabled: bool = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true"
+
+    # Debug only: sample requests sent with ?profile=1 using pyinstrument
+    profiling_enabled: bool = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+    profile_dir: Path = Path(os.getenv("PROFILE_DIR", "logs/profiles"))
+
     # Database configuration
     database_url: str = os.getenv("DATABASE_URL", "sqlite:///./backend.db")
+    # Async driver URL for the routes; derived from DATABASE_URL when empty
+    # (sqlite -> sqlite+aiosqlite, postgresql -> postgresql+asyncpg)
+    async_database_url: str = os.getenv("ASYNC_DATABASE_URL", "")
 
 # Create settings instance
 settings = Settings()
@@ -1,13 +1,57 @@
-from sqlalchemy import create_engine, Column, Integer, String, LargeBinary, DateTime, ForeignKey, Float, Boolean, Text
+from sqlalchemy import event, create_engine, inspect, text, select, update, bindparam, Column, Integer, String, LargeBinary, DateTime, ForeignKey, Float, Boolean, Text, Index
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, deferred
+import time
 from datetime import datetime
+from typing import AsyncIterator, Optional
 from config import settings
+from utils import tracing
+
+# Async drivers for the DATABASE_URL backends the routes run on
+_ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def async_database_url(url: str) -> str:
+    """DATABASE_URL with its driver replaced by the async one (aiosqlite, asyncpg)."""
+    parsed = make_url(url)
+    driver = _ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver for {parsed.get_backend_name()}; set ASYNC_DATABASE_URL")
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
 
 # Add SQLite-specific connect args
 engine_kwargs = {"connect_args": {"check_same_thread": False}} if settings.database_url.startswith("sqlite") else {}
+# Blocking engine for startup, migrations, background jobs and scripts
 engine = create_engine(settings.database_url, **engine_kwargs)
+# The routes' engine: queries wait on the event loop instead of blocking it
+async_engine = create_async_engine(settings.async_database_url or async_database_url(settings.database_url))
+
+# Every statement's execution time goes into the request trace as `sql`,
+# including queries the routes do not wrap in a db_read/db_write stage. The
+# start lives on the statement's execution context, so a failed statement
+# leaves nothing behind on the connection
+def _start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    context._statement_start = time.perf_counter()
+
+def _record_statement_time(conn, cursor, statement, parameters, context, executemany):
+    tracing.record("sql", time.perf_counter() - context._statement_start)
+
+for _engine in (engine, async_engine.sync_engine):
+    event.listen(_engine, "before_cursor_execute", _start_statement_timer)
+    event.listen(_engine, "after_cursor_execute", _record_statement_time)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Loaded attributes stay readable after commit; lazy loads cannot run on an AsyncSession
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+async def get_db() -> AsyncIterator[AsyncSession]:
+    """Request-scoped session dependency shared by all routers."""
+    async with AsyncSessionLocal() as db:
+        yield db
+
 Base = declarative_base()
 
 # User Table
@@ -16,7 +60,66 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
     face_image_url = Column(String, nullable=False)
-    face_embedding = Column(LargeBinary, nullable=False)
+    # Only loaded when accessed; listings never need the embedding blob
+    face_embedding = deferred(Column(LargeBinary, nullable=False))
+
+# Additional face templates (embeddings) of a user, next to the primary
+# face_embedding; matching takes the best score over all of them
+class FaceTemplate(Base):
+    __tablename__ = "face_templates"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    embedding = Column(LargeBinary, nullable=False)
+    face_image_url = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# Background re-embedding of every stored face image with a new model
+# (models/reembed.py); `user_cursor` is the last user id whose images are
+# staged, so an interrupted job resumes after it
+class ReembedJob(Base):
+    __tablename__ = "reembed_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    version = Column(String, nullable=False)  # EMBEDDING_MODEL_VERSION of the new embeddings
+    backend = Column(String, nullable=False)
+    quantization = Column(String, nullable=False, default="none")
+    status = Column(String, nullable=False, default="running")  # running, paused, failed, ready, completed, cancelled
+    user_cursor = Column(Integer, nullable=False, default=0)
+    users_done = Column(Integer, nullable=False, default=0)
+    images_done = Column(Integer, nullable=False, default=0)
+    images_failed = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    switched_at = Column(DateTime, nullable=True)
+
+# Embeddings computed by a re-embedding job, one row per stored image
+# (template_id is None for the user's enrollment photo); copied over
+# users.face_embedding / face_templates.embedding when the job switches
+class EmbeddingVersion(Base):
+    __tablename__ = "embedding_versions"
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("reembed_jobs.id"), nullable=False, index=True)
+    version = Column(String, nullable=False)
+    user_id = Column(Integer, nullable=False, index=True)
+    template_id = Column(Integer, nullable=True)
+    # The image the embedding was computed from; a row only applies while the
+    # user or template still points at it
+    face_image_url = Column(String, nullable=False)
+    embedding = Column(LargeBinary, nullable=True)  # None when the image could not be embedded
+    error = Column(String, nullable=True)
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def dedup_bucket(timestamp: datetime) -> Optional[int]:
+    """Index of the ATTENDANCE_DEDUP_SECONDS-wide time slot holding a (UTC) timestamp.
+
+    None when deduplication is off (ATTENDANCE_DEDUP_SECONDS=0).
+    """
+    window = settings.attendance_dedup_seconds
+    if window <= 0:
+        return None
+    return int((timestamp - _EPOCH).total_seconds() // window)
 
 # Attendance Table
 class Attendance(Base):
@@ -24,6 +127,11 @@ class Attendance(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
+    # dedup_bucket(timestamp); the unique index makes a second row for the same
+    # user and slot impossible however many requests insert at once. NULL for
+    # rows from before the column existed that shared a slot
+    dedup_bucket = Column(Integer, nullable=True)
+    __table_args__ = (Index("ux_attendance_user_bucket", "user_id", "dedup_bucket", unique=True),)
 
 # Emotion Detection Session Table
 class EmotionSession(Base):
@@ -51,6 +159,35 @@ class EmotionRecord(Base):
     face_bbox_width = Column(Float, nullable=True)
     face_bbox_height = Column(Float, nullable=True)
 
+def _add_attendance_dedup_bucket():
+    """Add attendance.dedup_bucket and its unique index to databases created without them.
+
+    Existing rows get the bucket of their timestamp; when a user has several
+    rows in one bucket only the earliest keeps it.
+    """
+    if "dedup_bucket" in {column["name"] for column in inspect(engine).get_columns("attendance")}:
+        return
+    table = Attendance.__table__
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE attendance ADD COLUMN dedup_bucket INTEGER"))
+        taken, buckets = set(), []
+        for row in conn.execute(select(table.c.id, table.c.user_id, table.c.timestamp).order_by(table.c.timestamp)):
+            key = (row.user_id, dedup_bucket(row.timestamp)) if row.timestamp else None
+            if key is not None and key[1] is not None and key not in taken:
+                taken.add(key)
+                buckets.append({"row_id": row.id, "bucket": key[1]})
+        if buckets:
+            conn.execute(update(table).where(table.c.id == bindparam("row_id")).values(dedup_bucket=bindparam("bucket")), buckets)
+        for index in table.indexes:
+            if index.name == "ux_attendance_user_bucket":
+                index.create(conn)
+
+# Attendance is written with ON CONFLICT DO NOTHING and per-user locks (routes/match.py)
+_SUPPORTED_DIALECTS = ("sqlite", "postgresql")
+
 # Create tables
 def init_db():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    if engine.dialect.name not in _SUPPORTED_DIALECTS:
+        raise RuntimeError(f"DATABASE_URL must be SQLite or PostgreSQL, not {engine.dialect.name}")
+    Base.metadata.create_all(bind=engine)
+    _add_attendance_dedup_bucket()
\ No newline at end of file
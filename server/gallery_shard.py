@@ -0,0 +1,102 @@
+"""Gallery shard process: one partition of the registered embeddings.
+
+Holds the users with `user_id % count == index` in memory and answers
+top-k searches for the API server (see `models/sharding.py`). Shards read
+the same DATABASE_URL as the API server; no model is loaded here.
+
+Run from the server directory, one process per shard:
+
+    python -m gallery_shard --index 0 --count 2 --port 8101
+    python -m gallery_shard --index 1 --count 2 --port 8102
+    GALLERY_SHARDS=http://127.0.0.1:8101,http://127.0.0.1:8102 python main.py
+"""
+import argparse
+import logging
+from typing import Any, Dict
+
+import numpy as np
+import uvicorn
+from fastapi import Body, FastAPI, HTTPException, Response
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from db import SessionLocal, init_db
+from models.sharding import ShardState, shard_for
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _embeddings(values) -> np.ndarray:
+    try:
+        embeddings = np.asarray(values, dtype=np.float32)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Embeddings must be numbers")
+    if embeddings.ndim not in (1, 2) or embeddings.size == 0:
+        raise HTTPException(status_code=400, detail="Expected one embedding or a list of embeddings")
+    return embeddings
+
+
+def create_app(index: int, count: int) -> FastAPI:
+    state = ShardState(index, count)
+    app = FastAPI(title=f"Gallery shard {index}/{count}")
+
+    def reload() -> int:
+        db = SessionLocal()
+        try:
+            return state.reload(db)
+        finally:
+            db.close()
+
+    @app.on_event("startup")
+    def load_partition():
+        init_db()
+        logger.info(f"Gallery shard {index}/{count} loaded {reload()} users")
+
+    @app.get("/health")
+    def health():
+        return {"index": index, "count": count, "size": len(state), "templates": state.templates}
+
+    @app.post("/reload")
+    def reload_partition():
+        return {"size": reload()}
+
+    # Plain def: FastAPI runs them in its thread pool, so the numpy work
+    # does not block the event loop
+    @app.post("/search")
+    def search(body: Dict[str, Any] = Body(...)):
+        embeddings = _embeddings(body.get("embeddings"))
+        matches = state.search(embeddings, int(body.get("k", 1)))
+        return {
+            "size": len(state),
+            "matches": [[{"id": m.id, "name": m.name, "score": m.score} for m in query] for query in matches],
+        }
+
+    @app.put("/users/{user_id}")
+    def enroll(user_id: int, body: Dict[str, Any] = Body(...)):
+        if not state.owns(user_id):
+            raise HTTPException(status_code=409, detail=f"User {user_id} belongs to shard {shard_for(user_id, count)}")
+        # All of the user's templates, replacing the ones the shard had
+        embeddings = np.atleast_2d(_embeddings(body.get("embeddings")))
+        return {"size": state.upsert(user_id, str(body.get("name", "")), embeddings), "templates": state.templates}
+
+    @app.get("/metrics")
+    def prometheus_metrics():
+        return Response(content=metrics.render(), media_type=CONTENT_TYPE_LATEST)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--index", type=int, required=True, help="this shard's index, 0 to count-1")
+    parser.add_argument("--count", type=int, required=True, help="number of shards")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8101)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    uvicorn.run(create_app(args.index, args.count), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,25 @@
+import time
+_import_start = time.perf_counter()
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response
+# Route modules only import the model code lazily, so this does not load
+# TensorFlow, DeepFace, MediaPipe or OpenCV
 from routes import admin, match, emotion
 import uvicorn
-from db import init_db
 from pathlib import Path
 import os
+import asyncio
 import logging
 from fastapi import HTTPException
-from models.face_recognition import preload_models
-from models.emotion_detection import preload_emotion_models
+from sqlalchemy import text
+from prometheus_client import CONTENT_TYPE_LATEST
+from utils.readiness import readiness
+from utils import inference, metrics
+from utils.tracing import RequestTracingMiddleware
+from utils.uploads import RequestSizeLimitMiddleware
 
 # Configure logging for Cloud Run
 logging.basicConfig(
@@ -25,37 +34,17 @@ logger.info(f"PORT environment variable: {os.getenv('PORT', '8000')}")
 logger.info(f"PYTHONUNBUFFERED: {os.getenv('PYTHONUNBUFFERED', 'Not set')}")
 logger.info(f"Working directory: {os.getcwd()}")
 
-# Run startup tasks
-try:
-    from startup import main as startup_main
-    startup_main()
-except Exception as e:
-    logger.warning(f"Startup script failed, continuing with basic initialization: {e}")
-    # Fallback to basic initialization
-    init_db()
-
 app = FastAPI()
 
 @app.on_event("startup")
 async def startup_event():
     logger.info("FastAPI application starting up...")
+    # Background jobs submit their inference to the scheduler on this loop
+    inference.bind_event_loop(asyncio.get_running_loop())
     try:
-        # Ensure database is ready
-        init_db()
-        logger.info("Database connection established")
-        
-        # Ensure uploads directory exists
-        uploads_dir = Path("uploads")
-        uploads_dir.mkdir(exist_ok=True)
-        logger.info("Uploads directory ready")
-        # Preload face model to reduce first-request latency
-        preload_models()
-        logger.info("Face model preloaded")
-        
-        # Preload emotion detection models
-        preload_emotion_models()
-        logger.info("Emotion detection models preloaded")
-        
+        # Directories and database only; models load in the background
+        from startup import main as startup_main
+        startup_main()
     except Exception as e:
         logger.error(f"Startup error: {e}")
         raise
@@ -63,6 +52,13 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("FastAPI application shutting down...")
+    await match.emotion_stage.stop()
+    from db import async_engine
+    await async_engine.dispose()
+
+# Oversized request bodies are rejected before they are spooled (inside CORS,
+# so browsers can read the 413)
+app.add_middleware(RequestSizeLimitMiddleware)
 
 # CORS
 app.add_middleware(
@@ -77,8 +73,8 @@ app.add_middleware(
 	allow_headers=["*"],
 )
 
-# Initialize DB
-autostart = init_db()
+# Server-Timing headers and slow-request log for the API routes
+app.add_middleware(RequestTracingMiddleware)
 
 # Static serving for local uploads
 from config import settings
@@ -91,6 +87,8 @@ app.include_router(admin.router, prefix="/admin", tags=["Admin"])
 app.include_router(match.router, prefix="/match", tags=["Match"])
 app.include_router(emotion.router, prefix="/emotion", tags=["Emotion"])
 
+readiness.record_phase("imports", time.perf_counter() - _import_start)
+
 @app.get("/", response_class=HTMLResponse)
 def root():
 	return """
@@ -110,25 +108,45 @@ def health_check():
 def readiness_probe():
 	"""
 	Readiness probe endpoint for Cloud Run
-	Returns 200 only when the service is fully ready to handle requests
+	Returns 200 only when the service is fully ready to handle requests,
+	i.e. after every model has been loaded and warmed up. If a model failed,
+	it keeps returning 503 with the error of each failed model
 	"""
+	report = readiness.report()
+	if not report["ready"]:
+		if report["finished"]:
+			return JSONResponse(status_code=503, content={"status": "warmup_failed", "errors": readiness.errors(), **report})
+		return JSONResponse(status_code=503, content={"status": "warming_up", **report})
 	try:
 		# Check if database is accessible
 		from db import SessionLocal
 		db = SessionLocal()
-		db.execute("SELECT 1")
+		db.execute(text("SELECT 1"))
 		db.close()
+
+		# With a sharded gallery, every shard must answer or matches could miss users
+		from models.sharding import sharded_gallery
+		shards = sharded_gallery()
+		if shards is not None:
+			report["gallery_shards"] = shards.health()
+			if any("error" in shard for shard in report["gallery_shards"]):
+				return JSONResponse(status_code=503, content={"status": "gallery_shard_unavailable", **report})
 		
 		# Check if uploads directory is writable
 		uploads_dir = Path("uploads")
 		if not uploads_dir.exists():
 			uploads_dir.mkdir(exist_ok=True)
 		
-		return {"status": "ready", "message": "Service is ready to handle requests"}
+		return {"status": "ready", "message": "Service is ready to handle requests", **report}
 	except Exception as e:
 		logger.error(f"Readiness check failed: {e}")
 		raise HTTPException(status_code=503, detail="Service not ready")
 
+@app.get("/metrics")
+def metrics_endpoint():
+	"""Prometheus metrics: per-stage latency histograms, frame outcomes, gallery size and queue depth"""
+	return Response(content=metrics.render(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/admin/ui", response_class=HTMLResponse)
 async def admin_ui():
 	return """
@@ -242,11 +260,17 @@ async def attendance_ui():
 	return """
 	<h3>Attendance</h3>
 	<script>
+	const row = r => `<tr><td>${r.timestamp}</td><td>${r.user_id}</td><td>${r.user_name}</td></tr>`;
 	async function loadData() {
 		const res = await fetch('/admin/attendance');
 		const data = await res.json();
-		const rows = data.map(r => `<tr><td>${r.timestamp}</td><td>${r.user_id}</td><td>${r.user_name}</td></tr>`).join('');
-		document.getElementById('rows').innerHTML = rows;
+		document.getElementById('rows').innerHTML = data.map(row).join('');
+		// New check-ins are pushed by the server instead of re-fetching the list
+		const lastId = data.reduce((max, r) => Math.max(max, r.attendance_id), 0);
+		const feed = new EventSource('/admin/attendance/stream?last_event_id=' + lastId);
+		feed.addEventListener('attendance', e => {
+			document.getElementById('rows').insertAdjacentHTML('afterbegin', row(JSON.parse(e.data)));
+		});
 	}
 	loadData();
 	</script>
@@ -0,0 +1,48 @@
+"""Inference backends for face recognition and emotion models.
+
+`get_backend()` returns the backend selected by INFERENCE_BACKEND:
+- `deepface`: DeepFace on Keras/TensorFlow (default)
+- `onnx` / `tflite`: converted Facenet and emotion weights on onnxruntime or
+  a TFLite interpreter (see `models/backends/convert.py`), optionally int8
+  quantized (MODEL_QUANTIZATION=int8)
+"""
+import threading
+from typing import Optional
+
+from config import settings
+from models.backends.base import EMOTION_LABELS, InferenceBackend
+
+__all__ = ["BACKENDS", "EMOTION_LABELS", "InferenceBackend", "create_backend", "get_backend", "set_backend"]
+
+BACKENDS = ("deepface", "onnx", "tflite")
+
+_lock = threading.Lock()
+_backend: Optional[InferenceBackend] = None
+
+
+def create_backend(name: str, quantization: Optional[str] = None) -> InferenceBackend:
+    if name == "deepface":
+        from models.backends.deepface_backend import DeepFaceBackend
+        return DeepFaceBackend()
+    if name in ("onnx", "tflite"):
+        from models.backends.lite_backend import LiteBackend
+        return LiteBackend(name, settings.model_dir, quantization or settings.model_quantization)
+    raise ValueError(f"Unknown inference backend {name!r}; expected one of {', '.join(BACKENDS)}")
+
+
+def get_backend() -> InferenceBackend:
+    """The process-wide backend, created on first use."""
+    global _backend
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                _backend = create_backend(settings.inference_backend)
+    return _backend
+
+
+def set_backend(backend: InferenceBackend) -> None:
+    """Replace the process-wide backend (re-embedding switch-over, benchmarks and parity checks)."""
+    global _backend
+    with _lock:
+        _backend = backend
+
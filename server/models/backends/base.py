@@ -0,0 +1,50 @@
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+# Output order of the DeepFace emotion model
+EMOTION_LABELS = ["angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"]
+
+
+class InferenceBackend:
+    """Model calls used by `models.face_recognition` and `models.emotion_detection`.
+
+    Images are decoded BGR uint8 arrays. Facial areas are {"x", "y", "w", "h"}
+    in the coordinates of the image passed in. Implementations must be safe to
+    call from several inference threads.
+    """
+
+    name = "base"
+
+    def represent(self, image: np.ndarray) -> List[Dict[str, Any]]:
+        """Detect and embed every face: [{"embedding", "facial_area"}].
+
+        Raises ValueError when no face is found.
+        """
+        raise NotImplementedError
+
+    def detect_faces(self, image: np.ndarray) -> List[Dict[str, Any]]:
+        """Detected faces as [{"face" (RGB, 0-1 floats), "facial_area", "confidence"}].
+
+        Raises ValueError when no face is found.
+        """
+        raise NotImplementedError
+
+    def embed_faces(self, faces: List[np.ndarray], batch_size: int = 32) -> np.ndarray:
+        """Embed faces returned by `detect_faces`, `batch_size` per forward pass."""
+        raise NotImplementedError
+
+    def analyze_emotion(self, image: np.ndarray) -> Dict[str, Any]:
+        """{"emotions": {label: percent}, "dominant_emotion": label} for the main face.
+
+        Falls back to the whole image when no face is detected.
+        """
+        raise NotImplementedError
+
+    def warmup_recognition(self) -> Dict[str, Tuple[float, float]]:
+        """Load the recognition model and run one frame: {model: (load_seconds, warmup_seconds)}."""
+        raise NotImplementedError
+
+    def warmup_emotion(self) -> Tuple[float, float]:
+        """Load the emotion model and run one frame: (load_seconds, warmup_seconds)."""
+        raise NotImplementedError
@@ -0,0 +1,125 @@
+"""Convert DeepFace's Facenet and emotion models for the onnx/tflite backends.
+
+Needs the full DeepFace/TensorFlow stack, plus tf2onnx for ONNX, so run it
+once at build time; the server then only needs the small runtime. Writes
+`facenet.<runtime>` and `emotion.<runtime>` to MODEL_DIR (or --output), and
+with --quantize int8 also `facenet.int8.<runtime>` and `emotion.int8.<runtime>`.
+
+Without --calibration-frames, int8 quantizes weights only (dynamic range).
+With a directory of face photos, activations are calibrated on them as well
+(static quantization), which is faster but needs representative frames.
+
+Run from the server directory:
+
+    python -m models.backends.convert --runtime onnx
+    python -m models.backends.convert --runtime onnx --quantize int8
+    python -m models.backends.convert --runtime tflite --quantize int8 --calibration-frames ~/kiosk-frames
+"""
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import settings
+from models.backends.lite_backend import EMOTION_FACE_INPUT, EMOTION_INPUT, FACENET_INPUT, fit_to, model_path
+
+INPUT_SHAPES = {"facenet": (*FACENET_INPUT, 3), "emotion": (*EMOTION_INPUT, 1)}
+
+
+def keras_models() -> Dict[str, object]:
+    from deepface import DeepFace
+
+    return {
+        "facenet": DeepFace.build_model("Facenet").model,
+        "emotion": DeepFace.build_model(model_name="Emotion", task="facial_attribute").model,
+    }
+
+
+def calibration_inputs(frames_dir: Path, limit: int = 200) -> Dict[str, List[np.ndarray]]:
+    """Preprocessed model inputs for the faces in `frames_dir`, one batch of 1 per face."""
+    import cv2
+    from deepface import DeepFace
+
+    inputs: Dict[str, List[np.ndarray]] = {"facenet": [], "emotion": []}
+    for path in sorted(frames_dir.iterdir())[:limit]:
+        image = cv2.imread(str(path))
+        if image is None:
+            continue
+        for obj in DeepFace.extract_faces(img_path=image, enforce_detection=False, align=True):
+            face_bgr = obj["face"][:, :, ::-1].astype(np.float32)
+            inputs["facenet"].append(fit_to(face_bgr, FACENET_INPUT)[np.newaxis])
+            gray = cv2.cvtColor(fit_to(face_bgr, EMOTION_FACE_INPUT), cv2.COLOR_BGR2GRAY)
+            inputs["emotion"].append(cv2.resize(gray, EMOTION_INPUT)[np.newaxis, :, :, np.newaxis])
+    if not inputs["facenet"]:
+        raise SystemExit(f"No faces found in {frames_dir}")
+    return inputs
+
+
+def to_onnx(model, name: str, path: Path) -> None:
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = (tf.TensorSpec((None, *INPUT_SHAPES[name]), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=13, output_path=str(path))
+
+
+def quantize_onnx(source: Path, target: Path, calibration: Optional[List[np.ndarray]] = None) -> None:
+    from onnxruntime.quantization import CalibrationDataReader, QuantType, quantize_dynamic, quantize_static
+
+    if not calibration:
+        quantize_dynamic(str(source), str(target), weight_type=QuantType.QInt8)
+        return
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self._batches = iter(calibration)
+
+        def get_next(self):
+            batch = next(self._batches, None)
+            return None if batch is None else {"input": batch.astype(np.float32)}
+
+    quantize_static(str(source), str(target), Reader(), activation_type=QuantType.QInt8, weight_type=QuantType.QInt8)
+
+
+def to_tflite(model, path: Path, quantize: bool = False, calibration: Optional[List[np.ndarray]] = None) -> None:
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if calibration:
+            converter.representative_dataset = lambda: ([batch.astype(np.float32)] for batch in calibration)
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    path.write_bytes(converter.convert())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runtime", choices=("onnx", "tflite"), required=True)
+    parser.add_argument("--quantize", choices=("none", "int8"), default="none", help="also write int8 models")
+    parser.add_argument("--calibration-frames", type=Path, help="face photos for static int8 calibration")
+    parser.add_argument("--output", type=Path, default=settings.model_dir, help="directory to write models to (default MODEL_DIR)")
+    args = parser.parse_args()
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    calibration = calibration_inputs(args.calibration_frames) if args.calibration_frames else {}
+    for name, model in keras_models().items():
+        float_path = model_path(args.output, name, args.runtime)
+        if args.runtime == "onnx":
+            to_onnx(model, name, float_path)
+        else:
+            to_tflite(model, float_path)
+        print(f"Wrote {float_path}")
+        if args.quantize == "int8":
+            int8_path = model_path(args.output, name, args.runtime, "int8")
+            if args.runtime == "onnx":
+                quantize_onnx(float_path, int8_path, calibration.get(name))
+            else:
+                to_tflite(model, int8_path, quantize=True, calibration=calibration.get(name))
+            print(f"Wrote {int8_path}")
+    print("Check the converted models against DeepFace with `python -m benchmarks.parity`")
+
+
+if __name__ == "__main__":
+    main()
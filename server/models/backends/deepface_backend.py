@@ -0,0 +1,89 @@
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from models.backends.base import InferenceBackend
+from utils.readiness import synthetic_frame
+
+
+class DeepFaceBackend(InferenceBackend):
+    """DeepFace on Keras/TensorFlow (the reference implementation).
+
+    DeepFace, and with it TensorFlow, is imported on first use.
+    """
+
+    name = "deepface"
+
+    def __init__(self):
+        # DeepFace shares one OpenCV face detector between calls, and
+        # CascadeClassifier is not safe to use from two threads at once
+        self._detector_lock = threading.Lock()
+
+    def represent(self, image: np.ndarray) -> List[Dict[str, Any]]:
+        from deepface import DeepFace
+
+        with self._detector_lock:
+            analysis = DeepFace.represent(img_path=image, model_name="Facenet", enforce_detection=True)
+        if not isinstance(analysis, list):
+            raise ValueError("Unexpected DeepFace output")
+        return analysis
+
+    def detect_faces(self, image: np.ndarray) -> List[Dict[str, Any]]:
+        from deepface import DeepFace
+
+        with self._detector_lock:
+            return DeepFace.extract_faces(img_path=image, enforce_detection=True, align=True) or []
+
+    def embed_faces(self, faces: List[np.ndarray], batch_size: int = 32) -> np.ndarray:
+        from deepface import DeepFace
+        from deepface.modules import preprocessing
+
+        model = DeepFace.build_model("Facenet")
+        target_h, target_w = model.input_shape
+        outputs = []
+        for start in range(0, len(faces), batch_size):
+            # Same preprocessing as DeepFace.represent, stacked into a single batch
+            batch = np.concatenate([
+                preprocessing.resize_image(img=face[:, :, ::-1], target_size=(target_w, target_h))
+                for face in faces[start:start + batch_size]
+            ], axis=0)
+            try:
+                outputs.append(np.asarray(model.model(batch, training=False), dtype=np.float32))
+            except Exception:
+                # Fall back to per-face inference if the model cannot take a batch
+                outputs.append(np.asarray([model.forward(face[np.newaxis]) for face in batch], dtype=np.float32))
+        return np.concatenate(outputs, axis=0)
+
+    def analyze_emotion(self, image: np.ndarray) -> Dict[str, Any]:
+        from deepface import DeepFace
+
+        # Less strict detection: analyze the whole frame when no face is found
+        with self._detector_lock:
+            analysis = DeepFace.analyze(img_path=image, actions=['emotion'], enforce_detection=False, silent=True)
+        if isinstance(analysis, list):
+            analysis = analysis[0]
+        return {
+            "emotions": analysis.get("emotion", {}),
+            "dominant_emotion": analysis.get("dominant_emotion", "neutral"),
+        }
+
+    def warmup_recognition(self) -> Dict[str, Tuple[float, float]]:
+        from deepface import DeepFace
+
+        start = time.perf_counter()
+        DeepFace.build_model("Facenet")
+        loaded = time.perf_counter()
+        # Building the model alone still leaves graph tracing and detector setup to the first request
+        DeepFace.represent(img_path=synthetic_frame(), model_name="Facenet", enforce_detection=False)
+        return {"facenet": (loaded - start, time.perf_counter() - loaded)}
+
+    def warmup_emotion(self) -> Tuple[float, float]:
+        from deepface import DeepFace
+
+        start = time.perf_counter()
+        DeepFace.build_model(model_name="Emotion", task="facial_attribute")
+        loaded = time.perf_counter()
+        DeepFace.analyze(img_path=synthetic_frame(), actions=['emotion'], enforce_detection=False, silent=True)
+        return loaded - start, time.perf_counter() - loaded
@@ -0,0 +1,193 @@
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from models.backends.base import EMOTION_LABELS, InferenceBackend
+from utils.readiness import synthetic_frame
+
+# Input sizes of the converted models (same as DeepFace's)
+FACENET_INPUT = (160, 160)
+EMOTION_FACE_INPUT = (224, 224)
+EMOTION_INPUT = (48, 48)
+
+
+def model_path(model_dir: Path, model: str, runtime: str, quantization: str = "none") -> Path:
+    """File name the converter writes for a model, e.g. `facenet.int8.onnx`."""
+    suffix = ".int8" if quantization == "int8" else ""
+    return Path(model_dir) / f"{model}{suffix}.{runtime}"
+
+
+def fit_to(image: np.ndarray, target: Tuple[int, int]) -> np.ndarray:
+    """Resize keeping the aspect ratio and zero-pad to `target` (h, w), like DeepFace's resize_image."""
+    import cv2
+
+    target_h, target_w = target
+    factor = min(target_h / image.shape[0], target_w / image.shape[1])
+    resized = cv2.resize(image, (max(1, int(image.shape[1] * factor)), max(1, int(image.shape[0] * factor))))
+    pad_h, pad_w = target_h - resized.shape[0], target_w - resized.shape[1]
+    padding = [(pad_h // 2, pad_h - pad_h // 2), (pad_w // 2, pad_w - pad_w // 2)] + [(0, 0)] * (resized.ndim - 2)
+    padded = np.pad(resized, padding, "constant")
+    if padded.shape[:2] != (target_h, target_w):
+        padded = cv2.resize(padded, (target_w, target_h))
+    return padded.astype(np.float32)
+
+
+class _OnnxModel:
+    def __init__(self, path: Path):
+        import onnxruntime
+
+        self._session = onnxruntime.InferenceSession(str(path), providers=["CPUExecutionProvider"])
+        self._input = self._session.get_inputs()[0].name
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        # InferenceSession.run is thread-safe
+        return np.asarray(self._session.run(None, {self._input: batch.astype(np.float32)})[0], dtype=np.float32)
+
+
+def _tflite_interpreter():
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            raise RuntimeError("INFERENCE_BACKEND=tflite needs ai-edge-litert or tflite-runtime installed")
+    return Interpreter
+
+
+class _TFLiteModel:
+    def __init__(self, path: Path):
+        self._interpreter = _tflite_interpreter()(model_path=str(path))
+        self._interpreter.allocate_tensors()
+        # One interpreter holds one set of tensors; calls are serialized
+        self._lock = threading.Lock()
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        with self._lock:
+            details = self._interpreter.get_input_details()[0]
+            if details["shape"][0] != len(batch):
+                self._interpreter.resize_tensor_input(details["index"], [len(batch), *batch.shape[1:]])
+                self._interpreter.allocate_tensors()
+                details = self._interpreter.get_input_details()[0]
+            data = batch.astype(np.float32)
+            if details["dtype"] in (np.int8, np.uint8):
+                # Fully quantized model: quantize the input with its scale and zero point
+                scale, zero_point = details["quantization"]
+                limits = np.iinfo(details["dtype"])
+                data = np.clip(np.round(data / scale + zero_point), limits.min, limits.max).astype(details["dtype"])
+            self._interpreter.set_tensor(details["index"], data)
+            self._interpreter.invoke()
+            output = self._interpreter.get_output_details()[0]
+            result = self._interpreter.get_tensor(output["index"])
+            if output["dtype"] in (np.int8, np.uint8):
+                scale, zero_point = output["quantization"]
+                result = (result.astype(np.float32) - zero_point) * scale
+            return np.array(result, dtype=np.float32)
+
+
+class LiteBackend(InferenceBackend):
+    """Facenet and the emotion model converted to ONNX or TFLite.
+
+    Only the small runtime (onnxruntime, or ai-edge-litert / tflite-runtime)
+    and OpenCV are needed, not TensorFlow. Faces are found with OpenCV's Haar
+    cascade, DeepFace's default detector, but without its eye-based
+    alignment, so embeddings differ slightly from the DeepFace backend;
+    `benchmarks/parity.py` measures by how much.
+    """
+
+    def __init__(self, runtime: str, model_dir: Path, quantization: str = "none"):
+        if runtime not in ("onnx", "tflite"):
+            raise ValueError(f"Unsupported runtime {runtime!r}")
+        self.name = runtime if quantization == "none" else f"{runtime}-{quantization}"
+        self.runtime = runtime
+        self.paths = {model: model_path(model_dir, model, runtime, quantization) for model in ("facenet", "emotion")}
+        self._models: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _model(self, name: str):
+        model = self._models.get(name)
+        if model is None:
+            with self._lock:
+                model = self._models.get(name)
+                if model is None:
+                    path = self.paths[name]
+                    if not path.exists():
+                        raise RuntimeError(
+                            f"{path} not found; convert the models with "
+                            f"`python -m models.backends.convert --runtime {self.runtime}`"
+                        )
+                    model = self._models[name] = (_OnnxModel if self.runtime == "onnx" else _TFLiteModel)(path)
+        return model
+
+    def _boxes(self, image: np.ndarray) -> List[Tuple[int, int, int, int]]:
+        import cv2
+
+        # CascadeClassifier is not safe to share between threads
+        cascade = getattr(self._local, "cascade", None)
+        if cascade is None:
+            cascade = self._local.cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        # Same parameters as DeepFace's OpenCV detector
+        return [tuple(int(v) for v in box) for box in cascade.detectMultiScale(gray, 1.1, 10)]
+
+    def detect_faces(self, image: np.ndarray) -> List[Dict[str, Any]]:
+        boxes = self._boxes(image)
+        if not boxes:
+            raise ValueError("Face could not be detected in the image")
+        rgb = image[:, :, ::-1]
+        return [
+            {
+                "face": rgb[y:y + h, x:x + w].astype(np.float32) / 255,
+                "facial_area": {"x": x, "y": y, "w": w, "h": h},
+                "confidence": 1.0,
+            }
+            for x, y, w, h in boxes
+        ]
+
+    def embed_faces(self, faces: List[np.ndarray], batch_size: int = 32) -> np.ndarray:
+        model = self._model("facenet")
+        outputs = []
+        for start in range(0, len(faces), batch_size):
+            # Facenet takes BGR in 0-1, as DeepFace.represent feeds it
+            batch = np.stack([fit_to(face[:, :, ::-1], FACENET_INPUT) for face in faces[start:start + batch_size]])
+            outputs.append(model(batch))
+        return np.concatenate(outputs, axis=0)
+
+    def represent(self, image: np.ndarray) -> List[Dict[str, Any]]:
+        faces = self.detect_faces(image)
+        embeddings = self.embed_faces([f["face"] for f in faces])
+        return [{"embedding": e, "facial_area": f["facial_area"]} for f, e in zip(faces, embeddings)]
+
+    def analyze_emotion(self, image: np.ndarray) -> Dict[str, Any]:
+        import cv2
+
+        boxes = self._boxes(image)
+        if boxes:
+            x, y, w, h = max(boxes, key=lambda b: b[2] * b[3])
+            image = image[y:y + h, x:x + w]
+        # DeepFace pads the face to 224x224, then the model takes 48x48 grayscale
+        face = fit_to(image.astype(np.float32) / 255, EMOTION_FACE_INPUT)
+        gray = cv2.resize(cv2.cvtColor(face, cv2.COLOR_BGR2GRAY), EMOTION_INPUT)
+        predictions = self._model("emotion")(gray[np.newaxis, :, :, np.newaxis])[0]
+        emotions = {label: float(100 * p / predictions.sum()) for label, p in zip(EMOTION_LABELS, predictions)}
+        return {"emotions": emotions, "dominant_emotion": max(emotions, key=emotions.get)}
+
+    def warmup_recognition(self) -> Dict[str, Tuple[float, float]]:
+        start = time.perf_counter()
+        self._model("facenet")
+        loaded = time.perf_counter()
+        frame = synthetic_frame()
+        self._boxes(frame)
+        self.embed_faces([frame[:, :, ::-1].astype(np.float32) / 255])
+        return {"facenet": (loaded - start, time.perf_counter() - loaded)}
+
+    def warmup_emotion(self) -> Tuple[float, float]:
+        start = time.perf_counter()
+        self._model("emotion")
+        loaded = time.perf_counter()
+        self.analyze_emotion(synthetic_frame())
+        return loaded - start, time.perf_counter() - loaded
@@ -1,17 +1,29 @@
-import cv2
+# OpenCV, MediaPipe and the inference backend's runtime are imported lazily (see
+# EmotionDetector and models/backends) so importing this module does not pull in TensorFlow.
 import numpy as np
-from deepface import DeepFace
-import tempfile
-import os
 from typing import Tuple, Dict, Any, Optional
-import mediapipe as mp
+from models.backends import get_backend
+from utils.readiness import synthetic_frame
+from utils.uploads import decode_image
+from utils.metrics import stage
+from utils.inference_cache import inference_cache
 import logging
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
 class EmotionDetector:
     def __init__(self):
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        import cv2
+        import mediapipe as mp
+
+        start = time.perf_counter()
+        # CascadeClassifier is not safe to share between threads, and live
+        # check-ins detect faces while emotion analysis runs on another worker
+        self._local = threading.local()
+        self._local.cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        haar_loaded = time.perf_counter()
         
         # Initialize MediaPipe Face Mesh for eye tracking
         self.mp_face_mesh = mp.solutions.face_mesh
@@ -22,6 +34,8 @@ class EmotionDetector:
             min_detection_confidence=0.5,
             min_tracking_confidence=0.5
         )
+        # Seconds spent constructing each model, reported by the readiness probe
+        self.load_seconds = {'haar': haar_loaded - start, 'facemesh': time.perf_counter() - haar_loaded}
         
         # Eye landmarks indices from MediaPipe Face Mesh
         self.left_eye_landmarks = [33, 7, 163, 144, 145, 153, 154, 155, 133, 173, 157, 158, 159, 160, 161, 246]
@@ -31,36 +45,34 @@ class EmotionDetector:
         self.left_iris = [474, 475, 476, 477]
         self.right_iris = [469, 470, 471, 472]
 
+    def face_cascade(self):
+        """This thread's Haar cascade"""
+        cascade = getattr(self._local, "cascade", None)
+        if cascade is None:
+            import cv2
+
+            cascade = self._local.cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        return cascade
+
     def detect_faces_opencv(self, image: np.ndarray) -> list:
         """Detect faces using OpenCV Haar Cascades"""
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        faces = self.face_cascade.detectMultiScale(
-            gray, 
-            scaleFactor=1.1, 
-            minNeighbors=5, 
-            minSize=(30, 30)
-        )
+        import cv2
+
+        with stage("face_detection"):
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            faces = self.face_cascade().detectMultiScale(
+                gray, 
+                scaleFactor=1.1, 
+                minNeighbors=5, 
+                minSize=(30, 30)
+            )
         return faces
 
-    def analyze_emotion_deepface(self, image_bytes: bytes) -> Dict[str, Any]:
-        """Analyze emotion using DeepFace"""
-        fd, path = tempfile.mkstemp(suffix=".jpg")
+    def analyze_emotion(self, image: np.ndarray) -> Dict[str, Any]:
+        """Analyze emotion on a decoded BGR image with the inference backend"""
         try:
-            with os.fdopen(fd, "wb") as f:
-                f.write(image_bytes)
-            
-            # Analyze emotions with less strict detection
-            analysis = DeepFace.analyze(
-                img_path=path,
-                actions=['emotion'],
-                enforce_detection=False,  # Allow analysis even with low confidence face detection
-                silent=True
-            )
-            
-            if isinstance(analysis, list):
-                analysis = analysis[0]
-            
-            emotions = analysis.get('emotion', {})
+            analysis = get_backend().analyze_emotion(image)
+            emotions = analysis.get('emotions', {})
             dominant_emotion = analysis.get('dominant_emotion', 'neutral')
             
             # Ensure confidence is properly calculated
@@ -74,17 +86,12 @@ class EmotionDetector:
                 'confidence': confidence
             }
         except Exception as e:
-            logger.warning(f"DeepFace emotion analysis failed: {e}")
+            logger.warning(f"Emotion analysis failed: {e}")
             return {
                 'emotions': {'neutral': 100.0},
                 'dominant_emotion': 'neutral',
                 'confidence': 0.0
             }
-        finally:
-            try:
-                os.remove(path)
-            except Exception:
-                pass
 
     def calculate_eye_aspect_ratio(self, eye_landmarks: list, landmarks) -> float:
         """Calculate Eye Aspect Ratio (EAR) to detect blinks and eye state"""
@@ -110,6 +117,8 @@ class EmotionDetector:
 
     def detect_gaze_direction(self, image: np.ndarray) -> Dict[str, Any]:
         """Detect gaze direction using MediaPipe Face Mesh"""
+        import cv2
+
         try:
             rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
             results = self.face_mesh.process(rgb_image)
@@ -205,14 +214,20 @@ class EmotionDetector:
         """
         Process a single frame for emotion detection and eye tracking
         Returns combined results with face bounding box, emotion, and gaze data
+        Successful results for identical bytes come from the inference cache
         """
+        result = inference_cache.get_or_compute(
+            "emotion", image_bytes, lambda: self._process_frame(image_bytes), cacheable=lambda r: r["success"]
+        )
+        if result['success']:
+            # A cached result is from an earlier request
+            result['timestamp'] = np.datetime64('now').astype(str)
+        return result
+
+    def _process_frame(self, image_bytes: bytes) -> Dict[str, Any]:
         try:
-            # Convert bytes to numpy array
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            if image is None:
-                raise ValueError("Could not decode image")
+            # Decode, downscaled when the frame is larger than the models need
+            image, scale = decode_image(image_bytes)
             
             # Detect faces
             faces = self.detect_faces_opencv(image)
@@ -235,18 +250,20 @@ class EmotionDetector:
             x, y, w, h = faces[0]
             
             # Analyze emotion
-            emotion_result = self.analyze_emotion_deepface(image_bytes)
+            with stage("emotion"):
+                emotion_result = self.analyze_emotion(image)
             
             # Analyze gaze
-            gaze_result = self.detect_gaze_direction(image)
+            with stage("gaze"):
+                gaze_result = self.detect_gaze_direction(image)
             
             return {
                 'success': True,
                 'face_bbox': {
-                    'x': int(x),
-                    'y': int(y),
-                    'width': int(w),
-                    'height': int(h)
+                    'x': int(round(x / scale)),
+                    'y': int(round(y / scale)),
+                    'width': int(round(w / scale)),
+                    'height': int(round(h / scale))
                 },
                 'emotion': {
                     'dominant_emotion': emotion_result['dominant_emotion'],
@@ -275,10 +292,24 @@ def get_emotion_detector() -> EmotionDetector:
         _emotion_detector = EmotionDetector()
     return _emotion_detector
 
-def preload_emotion_models():
-    """Preload emotion detection models"""
-    try:
-        detector = get_emotion_detector()
-        logger.info("Emotion detection models preloaded successfully")
-    except Exception as e:
-        logger.warning(f"Failed to preload emotion detection models: {e}")
\ No newline at end of file
+def warmup_emotion_models() -> Dict[str, Tuple[float, float]]:
+    """Load every emotion/gaze model and run one synthetic frame through each.
+
+    Returns {model: (load_seconds, warmup_seconds)} for the backend's emotion
+    model, the Haar cascade and MediaPipe FaceMesh.
+    """
+    frame = synthetic_frame()
+    timings = {'emotion': get_backend().warmup_emotion()}
+
+    detector = get_emotion_detector()
+
+    start = time.perf_counter()
+    detector.detect_faces_opencv(frame)
+    timings['haar'] = (detector.load_seconds['haar'], time.perf_counter() - start)
+
+    start = time.perf_counter()
+    detector.detect_gaze_direction(frame)
+    timings['facemesh'] = (detector.load_seconds['facemesh'], time.perf_counter() - start)
+
+    logger.info("Emotion detection models warmed up")
+    return timings
@@ -1,48 +1,134 @@
-from deepface import DeepFace
+# Model calls go through the inference backend (see models/backends), which
+# imports its runtime on first use, so importing this module stays cheap.
+from typing import Any, Dict, List, Optional, Tuple
+from models.backends import InferenceBackend, get_backend
+from utils.uploads import decode_image
+from utils.inference_cache import inference_cache
+from utils.metrics import stage
 import numpy as np
-import tempfile
-import os
 
+# Embeddings produced by this module; edge clients must send the same kind
+EMBEDDING_MODEL = "Facenet"
+EMBEDDING_DIM = 128
 
-def extract_face_embedding(image_bytes: bytes) -> np.ndarray:
-    """Extract a single-face embedding from raw image bytes using DeepFace (Facenet).
+
+def extract_face_embedding(image_bytes: bytes, backend: Optional[InferenceBackend] = None) -> np.ndarray:
+    """Extract a single-face embedding from raw image bytes (Facenet).
 
     - Requires exactly one detected face.
     - Raises ValueError with clear messages for 0 or multiple faces.
-    - Uses a Windows-safe temp file pattern (mkstemp) so the file can be read by OpenCV.
+    - Large photos are decoded at reduced resolution (see `decode_image`).
+    - Identical bytes seen recently are answered from the inference cache.
+    - `backend` runs another model than the serving one (re-embedding jobs);
+      its results bypass the cache, which holds serving-model results only.
     """
-    fd, path = tempfile.mkstemp(suffix=".jpg")
+    if backend is not None:
+        return _extract_face_embedding(image_bytes, backend)
+    return inference_cache.get_or_compute("embedding", image_bytes, lambda: _extract_face_embedding(image_bytes))
+
+
+def _extract_face_embedding(image_bytes: bytes, backend: Optional[InferenceBackend] = None) -> np.ndarray:
+    image, _ = decode_image(image_bytes)
+    # The backend detects and embeds in one call; timed as embedding
+    with stage("embedding"):
+        analysis = (backend or get_backend()).represent(image)
+    if len(analysis) == 0:
+        raise ValueError("No face detected")
+    if len(analysis) > 1:
+        raise ValueError("Multiple faces detected; provide a single-face image")
+    if "embedding" not in analysis[0]:
+        raise ValueError("No embedding found in the analysis output")
+    return np.asarray(analysis[0]["embedding"], dtype=np.float32)
+
+
+def _embed_face_batch(faces: List[np.ndarray], batch_size: int = 32) -> np.ndarray:
+    """Run Facenet over detected faces (RGB, 0-1 floats), `batch_size` faces per forward pass."""
+    with stage("embedding"):
+        return get_backend().embed_faces(faces, batch_size)
+
+
+def _detect_faces(image_bytes: bytes) -> List[Dict[str, Any]]:
+    """Detect and align every face in an image (empty list when there is none).
+
+    Facial areas are returned in original image coordinates.
+    """
+    image, scale = decode_image(image_bytes)
     try:
-        with os.fdopen(fd, "wb") as f:
-            f.write(image_bytes)
-        analysis = DeepFace.represent(
-            img_path=path,
-            model_name="Facenet",
-            enforce_detection=True,
-        )
-        if not isinstance(analysis, list):
-            raise ValueError("Unexpected DeepFace output")
-        if len(analysis) == 0:
-            raise ValueError("No face detected")
-        if len(analysis) > 1:
-            raise ValueError("Multiple faces detected; provide a single-face image")
-        if "embedding" not in analysis[0]:
-            raise ValueError("No embedding found in the analysis output")
-        return np.asarray(analysis[0]["embedding"], dtype=np.float32)
-    finally:
+        with stage("face_detection"):
+            face_objs = get_backend().detect_faces(image)
+    except ValueError:
+        return []
+    for obj in face_objs:
+        obj["facial_area"] = {k: int(round(obj["facial_area"][k] / scale)) for k in ("x", "y", "w", "h")}
+    return face_objs
+
+
+def _face_results(face_objs: List[Dict[str, Any]], embeddings: np.ndarray) -> List[Dict[str, Any]]:
+    return [
+        {
+            "embedding": embedding,
+            "facial_area": {k: int(obj["facial_area"][k]) for k in ("x", "y", "w", "h")},
+        }
+        for obj, embedding in zip(face_objs, embeddings)
+    ]
+
+
+def extract_face_embeddings(image_bytes: bytes) -> List[Dict[str, Any]]:
+    """Embed every face in an image with a single batched Facenet pass.
+
+    Returns a list of {"embedding", "facial_area"} dicts, one per detected face
+    (empty when no face is found).
+    """
+    return inference_cache.get_or_compute("faces", image_bytes, lambda: _extract_face_embeddings(image_bytes))
+
+
+def _extract_face_embeddings(image_bytes: bytes) -> List[Dict[str, Any]]:
+    face_objs = _detect_faces(image_bytes)
+    if not face_objs:
+        return []
+    return _face_results(face_objs, _embed_face_batch([obj["face"] for obj in face_objs]))
+
+
+def extract_face_embeddings_many(images: List[bytes], batch_size: int = 32) -> List[Dict[str, Any]]:
+    """Embed the faces of many images, batching faces across images.
+
+    Returns one {"faces": [...], "error": str | None} entry per image, where
+    faces has the same shape as `extract_face_embeddings` output. Images in
+    the inference cache are not run through the models again.
+    """
+    cached: Dict[int, Dict[str, Any]] = {}
+    detected, pending = [], []
+    for i, image_bytes in enumerate(images):
         try:
-            os.remove(path)
-        except Exception:
-            pass
+            faces = inference_cache.lookup("faces", image_bytes)
+            if faces is None:
+                detected.append({"faces": _detect_faces(image_bytes), "error": None})
+                pending.append(i)
+            else:
+                cached[i] = {"faces": faces, "error": None}
+        except ValueError as ve:
+            cached[i] = {"faces": [], "error": str(ve)}
 
+    all_faces = [obj["face"] for entry in detected for obj in entry["faces"]]
+    embeddings = _embed_face_batch(all_faces, batch_size) if all_faces else np.empty((0, 0), dtype=np.float32)
+
+    offset = 0
+    for i, entry in zip(pending, detected):
+        count = len(entry["faces"])
+        faces = _face_results(entry["faces"], embeddings[offset:offset + count])
+        inference_cache.store("faces", images[i], faces)
+        cached[i] = {"faces": faces, "error": None}
+        offset += count
+    return [cached[i] for i in range(len(images))]
 
-def preload_models() -> None:
-    """Preload the Facenet model to avoid first-request latency."""
-    try:
-        _ = DeepFace.build_model("Facenet")
-    except Exception:
-        # Best-effort preload; actual requests will still try to load if needed
-        pass
+
+def warmup_models() -> Dict[str, Tuple[float, float]]:
+    """Load Facenet and push one synthetic frame through it.
+
+    Building the model alone still leaves graph tracing and detector setup to
+    the first real request. Returns {model: (load_seconds, warmup_seconds)}.
+    """
+    return get_backend().warmup_recognition()
 
 
 def embedding_to_bytes(embedding: np.ndarray) -> bytes:
@@ -53,6 +139,21 @@ def bytes_to_embedding(blob: bytes) -> np.ndarray:
     return np.frombuffer(blob, dtype=np.float32)
 
 
+def embeddings_from_bytes(blob: bytes) -> np.ndarray:
+    """Parse concatenated little-endian float32 embeddings into an (N x EMBEDDING_DIM) array.
+
+    Raises ValueError when the size is not a whole number of embeddings or a
+    value is not finite.
+    """
+    row_bytes = EMBEDDING_DIM * 4
+    if not blob or len(blob) % row_bytes:
+        raise ValueError(f"Expected a multiple of {row_bytes} bytes ({EMBEDDING_DIM} float32 values per embedding)")
+    embeddings = np.frombuffer(blob, dtype="<f4").astype(np.float32).reshape(-1, EMBEDDING_DIM)
+    if not np.isfinite(embeddings).all():
+        raise ValueError("Embeddings contain non-finite values")
+    return embeddings
+
+
 def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     a = a.astype(np.float32)
     b = b.astype(np.float32)
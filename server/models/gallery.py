@@ -0,0 +1,186 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from db import FaceTemplate, User
+from models.face_recognition import bytes_to_embedding
+from utils.metrics import GALLERY_BYTES, GALLERY_SIZE, GALLERY_TEMPLATES, stage
+
+
+@dataclass
+class GalleryMatch:
+    id: int
+    name: str
+    score: float
+
+
+@dataclass
+class Gallery:
+    """Registered embeddings stacked into one L2-normalized matrix.
+
+    A user enrolled with several templates has consecutive rows; `segments`
+    holds the first row of every user, or is None when each user has exactly
+    one row (row i is then user i).
+    """
+    user_ids: np.ndarray
+    names: List[str]
+    matrix: np.ndarray
+    segments: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    @property
+    def templates(self) -> int:
+        return len(self.matrix) if len(self.user_ids) else 0
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the arrays (names excluded)."""
+        segments = self.segments.nbytes if self.segments is not None else 0
+        return self.matrix.nbytes + self.user_ids.nbytes + segments
+
+    def row_user_ids(self) -> np.ndarray:
+        """User id of every matrix row."""
+        if self.segments is None:
+            return self.user_ids
+        return np.repeat(self.user_ids, np.diff(np.append(self.segments, len(self.matrix))))
+
+
+def empty_gallery() -> Gallery:
+    return Gallery(user_ids=np.empty(0, dtype=np.int64), names=[], matrix=np.empty((0, 0), dtype=np.float32))
+
+
+def normalize_rows(embeddings: np.ndarray) -> np.ndarray:
+    """L2-normalize each row; all-zero rows stay zero (cosine similarity 0)."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if embeddings.ndim == 1:
+        embeddings = embeddings[np.newaxis, :]
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return np.divide(embeddings, norms, out=np.zeros_like(embeddings), where=norms > 0)
+
+
+def build_gallery(row_user_ids: np.ndarray, embeddings: np.ndarray, names: Dict[int, str]) -> Gallery:
+    """Gallery from one row per template, grouping each user's rows together.
+
+    The sort is stable, so a user's templates keep their order (primary first).
+    """
+    if len(row_user_ids) == 0:
+        return empty_gallery()
+    row_user_ids = np.asarray(row_user_ids, dtype=np.int64)
+    order = np.argsort(row_user_ids, kind="stable")
+    row_user_ids = row_user_ids[order]
+    user_ids, segments = np.unique(row_user_ids, return_index=True)
+    return Gallery(
+        user_ids=user_ids,
+        names=[names[int(u)] for u in user_ids],
+        matrix=normalize_rows(np.asarray(embeddings)[order]),
+        segments=None if len(user_ids) == len(row_user_ids) else segments,
+    )
+
+
+def gallery_from_rows(users, templates) -> Gallery:
+    """Gallery from (id, name, face_embedding) user rows and (user_id, embedding) template rows."""
+    names = {r.id: r.name for r in users}
+    # Templates of a user deleted since the query are dropped
+    templates = [t for t in templates if t.user_id in names]
+    if not names:
+        return empty_gallery()
+    if not templates:
+        # One row per user, nothing to group
+        return Gallery(
+            user_ids=np.array([r.id for r in users], dtype=np.int64),
+            names=[r.name for r in users],
+            matrix=normalize_rows(np.stack([bytes_to_embedding(r.face_embedding) for r in users])),
+        )
+    row_user_ids = np.array([r.id for r in users] + [t.user_id for t in templates], dtype=np.int64)
+    embeddings = np.stack(
+        [bytes_to_embedding(r.face_embedding) for r in users] + [bytes_to_embedding(t.embedding) for t in templates]
+    )
+    return build_gallery(row_user_ids, embeddings, names)
+
+
+def _gallery_loaded(gallery: Gallery) -> Gallery:
+    GALLERY_SIZE.set(len(gallery))
+    GALLERY_TEMPLATES.set(gallery.templates)
+    GALLERY_BYTES.set(gallery.nbytes)
+    return gallery
+
+
+def load_gallery(db: Session) -> Gallery:
+    with stage("db_read"):
+        users = db.query(User.id, User.name, User.face_embedding).all()
+        templates = db.query(FaceTemplate.user_id, FaceTemplate.embedding).order_by(FaceTemplate.id).all()
+    return _gallery_loaded(gallery_from_rows(users, templates))
+
+
+async def load_gallery_async(db: AsyncSession) -> Gallery:
+    """`load_gallery` for the routes: the matrix is built on a worker thread, off the event loop."""
+    with stage("db_read"):
+        users = (await db.execute(select(User.id, User.name, User.face_embedding))).all()
+        templates = (await db.execute(select(FaceTemplate.user_id, FaceTemplate.embedding).order_by(FaceTemplate.id))).all()
+    return _gallery_loaded(await asyncio.to_thread(gallery_from_rows, users, templates))
+
+
+def user_scores(gallery: Gallery, embeddings: np.ndarray) -> np.ndarray:
+    """Cosine score of each query embedding against each user (M x users).
+
+    All templates are scored with one (M x D) @ (D x rows) product; a user's
+    score is the best of their templates, taken over their consecutive rows
+    with a single `np.maximum.reduceat` (a vectorized segment max).
+    """
+    scores = normalize_rows(embeddings) @ gallery.matrix.T
+    if gallery.segments is not None:
+        scores = np.maximum.reduceat(scores, gallery.segments, axis=1)
+    return scores
+
+
+def score_embeddings(gallery: Gallery, embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Best gallery user and cosine score for each query embedding.
+
+    The best user is the owner of the best row, so only the winning rows are
+    mapped to users (a binary search in `segments`) instead of reducing every
+    user's templates.
+    """
+    scores = normalize_rows(embeddings) @ gallery.matrix.T
+    best_rows = np.argmax(scores, axis=1)
+    best_scores = scores[np.arange(len(best_rows)), best_rows]
+    if gallery.segments is None:
+        return best_rows, best_scores
+    return np.searchsorted(gallery.segments, best_rows, side="right") - 1, best_scores
+
+
+def best_matches(gallery: Gallery, embeddings: np.ndarray) -> List[Optional[GalleryMatch]]:
+    if len(gallery) == 0:
+        return [None] * len(np.atleast_2d(embeddings))
+    with stage("gallery_search"):
+        best, scores = score_embeddings(gallery, embeddings)
+    return [
+        GalleryMatch(id=int(gallery.user_ids[i]), name=gallery.names[i], score=float(s))
+        for i, s in zip(best, scores)
+    ]
+
+
+def top_k_matches(gallery: Gallery, embeddings: np.ndarray, k: int) -> List[List[GalleryMatch]]:
+    """The `k` best gallery users for each query embedding, best first."""
+    queries = len(np.atleast_2d(embeddings))
+    if len(gallery) == 0:
+        return [[] for _ in range(queries)]
+    k = min(k, len(gallery))
+    with stage("gallery_search"):
+        scores = user_scores(gallery, embeddings)
+        # argpartition finds the k best in O(N); only those k are sorted
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+    return [
+        [GalleryMatch(id=int(gallery.user_ids[i]), name=gallery.names[i], score=float(s)) for i, s in zip(row, row_scores)]
+        for row, row_scores in zip(top, top_scores)
+    ]
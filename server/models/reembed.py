@@ -0,0 +1,551 @@
+"""Background re-embedding of every stored face image with a new model.
+
+Changing the recognition model or detector makes the stored embeddings
+incompatible with the ones the new model produces. A re-embedding job
+(`POST /admin/reembed`) reads each user's enrollment photo and added
+templates back from `face_image_url`, embeds them with the target backend,
+REEMBED_WORKERS images in parallel, and stages the results in
+`embedding_versions` under the new EMBEDDING_MODEL_VERSION. Matching keeps
+using the current model and embeddings while it runs. The embeddings go
+through the inference scheduler in the lowest-priority `reembed` class, so
+the job only gets inference workers that requests leave free.
+
+Users are processed in id order, REEMBED_BATCH_SIZE at a time. A batch's
+embeddings and the job's cursor (last user id done) are committed in one
+transaction, so a paused, failed or interrupted job resumes after the last
+committed batch. Once every image is staged the job is `ready`; switching
+holds off enrollments, embeds the images enrolled since, copies the staged
+embeddings over the live ones and marks the job completed in a single
+transaction, and moves this process to the new backend and version before
+enrollments resume. Every cached result of the old model is then dropped.
+Other API processes would keep embedding with the old model, so the switch
+is refused unless the server runs a single process (WEB_CONCURRENCY).
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import and_, exists, func, select
+from sqlalchemy.orm import Session
+
+from config import settings
+from db import EmbeddingVersion, FaceTemplate, ReembedJob, SessionLocal, User
+from models.backends import BACKENDS, InferenceBackend, create_backend, get_backend, set_backend
+from models.face_recognition import EMBEDDING_DIM, embedding_to_bytes, extract_face_embedding
+from models.sharding import sharded_gallery
+from utils.frame_cache import frame_cache
+from utils.inference import REEMBED, run_inference_blocking
+from utils.inference_cache import inference_cache
+from utils.metrics import REEMBED_IMAGES
+from utils.storage import read_stored_image
+from utils.track_cache import track_cache
+
+logger = logging.getLogger(__name__)
+
+# Jobs that are not finished; only one may exist at a time. All of them can
+# be resumed (`ready` to retry the images that failed)
+OPEN_STATUSES = ("running", "paused", "failed", "ready")
+
+# (user_id, template_id or None for the enrollment photo, face_image_url)
+Image = Tuple[int, Optional[int], str]
+
+
+class ReembedConflict(Exception):
+    """The request does not fit the job's state (another job open, not ready, images failed, switching)."""
+
+
+def _embed_image(backend: InferenceBackend, image: Image) -> Dict[str, Any]:
+    user_id, template_id, url = image
+    row = {"user_id": user_id, "template_id": template_id, "face_image_url": url, "embedding": None, "error": None}
+    try:
+        content = read_stored_image(url)
+        row["embedding"] = embedding_to_bytes(run_inference_blocking(extract_face_embedding, content, backend, request_class=REEMBED))
+    except Exception as e:
+        # Missing or unreadable file, no face... recorded, retried when the job is resumed
+        row["error"] = f"{type(e).__name__}: {e}"[:500]
+    REEMBED_IMAGES.labels(result="failed" if row["error"] else "embedded").inc()
+    return row
+
+
+def _missing_images(db: Session, job: ReembedJob, retry_failed: bool) -> List[Image]:
+    """Images of users the job has passed that have no staged embedding.
+
+    These are templates added while the job ran, users whose id was reused
+    after a deletion and, with `retry_failed`, images that failed before.
+    """
+    def staged(matches_image, url):
+        conditions = [EmbeddingVersion.job_id == job.id, EmbeddingVersion.face_image_url == url, matches_image]
+        if retry_failed:
+            conditions.append(EmbeddingVersion.embedding.isnot(None))
+        return exists().where(and_(*conditions))
+
+    users = (
+        db.query(User.id, User.face_image_url)
+        .filter(
+            User.id <= job.user_cursor,
+            ~staged(and_(EmbeddingVersion.user_id == User.id, EmbeddingVersion.template_id.is_(None)), User.face_image_url),
+        )
+        .order_by(User.id)
+        .all()
+    )
+    templates = (
+        db.query(FaceTemplate.user_id, FaceTemplate.id, FaceTemplate.face_image_url)
+        .filter(
+            FaceTemplate.user_id <= job.user_cursor,
+            ~staged(EmbeddingVersion.template_id == FaceTemplate.id, FaceTemplate.face_image_url),
+        )
+        .order_by(FaceTemplate.id)
+        .all()
+    )
+    return [(u.id, None, u.face_image_url) for u in users] + [(t.user_id, t.id, t.face_image_url) for t in templates]
+
+
+def _recount(db: Session, job: ReembedJob) -> None:
+    counts = dict(
+        db.query(EmbeddingVersion.embedding.isnot(None), func.count(EmbeddingVersion.id))
+        .filter(EmbeddingVersion.job_id == job.id)
+        .group_by(EmbeddingVersion.embedding.isnot(None))
+        .all()
+    )
+    job.images_done = counts.get(True, 0)
+    job.images_failed = counts.get(False, 0)
+
+
+def _staged_embedding(job: ReembedJob, user_id, template_condition, face_image_url):
+    """Condition matching the job's staged embedding of a live user or template row."""
+    return and_(
+        EmbeddingVersion.job_id == job.id,
+        EmbeddingVersion.user_id == user_id,
+        template_condition,
+        EmbeddingVersion.face_image_url == face_image_url,
+        EmbeddingVersion.embedding.isnot(None),
+    )
+
+
+def apply_switched_version(db: Session) -> None:
+    """Serve with the model of the last switched job, whatever the environment says.
+
+    Called on startup: the stored embeddings were produced by that job's
+    backend, so a process started with the old INFERENCE_BACKEND or
+    EMBEDDING_MODEL_VERSION would match against incompatible embeddings.
+    """
+    job = (
+        db.query(ReembedJob)
+        .filter(ReembedJob.status == "completed")
+        .order_by(ReembedJob.switched_at.desc(), ReembedJob.id.desc())
+        .first()
+    )
+    if job is None:
+        return
+    configured = (settings.inference_backend, settings.model_quantization, settings.embedding_model_version)
+    if configured == (job.backend, job.quantization, job.version):
+        return
+    logger.warning(
+        f"Stored embeddings are version {job.version!r} ({job.backend}, quantization {job.quantization}) since "
+        f"re-embedding job {job.id}; using that instead of the configured {configured}. Update "
+        f"INFERENCE_BACKEND, MODEL_QUANTIZATION and EMBEDDING_MODEL_VERSION to match."
+    )
+    settings.inference_backend = job.backend
+    settings.model_quantization = job.quantization
+    settings.embedding_model_version = job.version
+
+
+_MULTI_PROCESS = (
+    "the server runs several processes (WEB_CONCURRENCY={}) and only this one would move to the new model; "
+    "run a single process to switch, the others pick up the new model when they restart"
+)
+
+
+def _check_single_process() -> None:
+    if settings.web_concurrency > 1:
+        raise ReembedConflict("Cannot switch: " + _MULTI_PROCESS.format(settings.web_concurrency))
+
+
+class ReembedRunner:
+    """Runs at most one re-embedding job at a time on a background thread.
+
+    Job state lives in the database; the runner only tracks the thread of
+    this process. Run jobs from a single API process.
+
+    Enrollments embed with the current backend, so the runner also keeps
+    them from overlapping a switch: each one runs between
+    `begin_enrollment` and `end_enrollment`, and a switch waits for those in
+    progress and turns new ones away until the new backend is in place.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._enrollments = threading.Condition()
+        self._enrolling = 0
+        self._switching = False
+        self._thread: Optional[threading.Thread] = None
+        self._job_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._backends: Dict[Tuple[str, str], InferenceBackend] = {}
+        # Users done and time when the current run started, for the ETA
+        self._run_started: Tuple[int, float] = (0, 0.0)
+
+    def begin_enrollment(self) -> None:
+        """Register an enrollment about to embed and store an image; ReembedConflict during a switch."""
+        with self._enrollments:
+            if self._switching:
+                raise ReembedConflict("Switching to re-embedded faces; retry the enrollment shortly")
+            self._enrolling += 1
+
+    def end_enrollment(self) -> None:
+        with self._enrollments:
+            self._enrolling -= 1
+            self._enrollments.notify_all()
+
+    @contextmanager
+    def _enrollments_held(self):
+        """Wait for enrollments in progress and keep new ones out until the block ends."""
+        with self._enrollments:
+            self._switching = True
+            self._enrollments.wait_for(lambda: self._enrolling == 0)
+        try:
+            yield
+        finally:
+            with self._enrollments:
+                self._switching = False
+
+    @property
+    def active_job_id(self) -> Optional[int]:
+        thread = self._thread
+        return self._job_id if thread is not None and thread.is_alive() else None
+
+    def _backend_for(self, name: str, quantization: str) -> InferenceBackend:
+        if (name, quantization) == (settings.inference_backend, settings.model_quantization):
+            return get_backend()
+        key = (name, quantization)
+        if key not in self._backends:
+            self._backends[key] = create_backend(name, quantization)
+        return self._backends[key]
+
+    def _launch(self, job: ReembedJob, auto_switch: bool) -> None:
+        self._stop.clear()
+        self._job_id = job.id
+        self._run_started = (job.users_done, time.monotonic())
+        self._thread = threading.Thread(
+            target=self._run, args=(job.id, auto_switch), name=f"reembed-{job.id}", daemon=True
+        )
+        self._thread.start()
+
+    def start(self, version: str, backend: str, quantization: str = "none", auto_switch: bool = False) -> int:
+        """Create a job re-embedding every stored image with `backend` and start it."""
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown inference backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+        if quantization not in ("none", "int8"):
+            raise ValueError("Quantization must be none or int8")
+        if version == settings.embedding_model_version:
+            raise ValueError(f"Stored embeddings already are version {version!r}; tag the new model with a new version")
+        with self._lock:
+            db = SessionLocal()
+            try:
+                open_job = db.query(ReembedJob).filter(ReembedJob.status.in_(OPEN_STATUSES)).first()
+                if open_job is not None:
+                    raise ReembedConflict(f"Job {open_job.id} is {open_job.status}; resume, switch or cancel it first")
+                job = ReembedJob(version=version, backend=backend, quantization=quantization, status="running")
+                db.add(job)
+                db.commit()
+                db.refresh(job)
+                self._launch(job, auto_switch)
+                return job.id
+            finally:
+                db.close()
+
+    def resume(self, job_id: int, auto_switch: bool = False) -> None:
+        """Continue a job after its last committed batch."""
+        with self._lock:
+            if self.active_job_id is not None:
+                raise ReembedConflict(f"Job {self.active_job_id} is running")
+            db = SessionLocal()
+            try:
+                job = self._get(db, job_id)
+                if job.status not in OPEN_STATUSES:
+                    raise ReembedConflict(f"Job {job_id} is {job.status}")
+                job.status = "running"
+                job.error = None
+                db.commit()
+                self._launch(job, auto_switch)
+            finally:
+                db.close()
+
+    def pause(self, job_id: int) -> None:
+        """Stop the running job after its current batch; it stays resumable."""
+        if self.active_job_id != job_id:
+            raise ReembedConflict(f"Job {job_id} is not running")
+        self._stop.set()
+
+    def cancel(self, job_id: int) -> None:
+        """Abandon a job that is not running and discard what it staged."""
+        with self._lock:
+            if self.active_job_id == job_id:
+                raise ReembedConflict(f"Job {job_id} is running; pause it first")
+            db = SessionLocal()
+            try:
+                job = self._get(db, job_id)
+                if job.status not in OPEN_STATUSES:
+                    raise ReembedConflict(f"Job {job_id} is {job.status}")
+                db.query(EmbeddingVersion).filter(EmbeddingVersion.job_id == job_id).delete(synchronize_session=False)
+                job.status = "cancelled"
+                job.updated_at = datetime.utcnow()
+                db.commit()
+            finally:
+                db.close()
+
+    def switch(self, job_id: int, force: bool = False) -> Dict[str, Any]:
+        """Make a ready job's embeddings and model the live ones."""
+        with self._lock:
+            if self.active_job_id == job_id:
+                raise ReembedConflict(f"Job {job_id} is still running")
+            db = SessionLocal()
+            try:
+                job = self._get(db, job_id)
+                if job.status != "ready":
+                    raise ReembedConflict(f"Job {job_id} is {job.status}, not ready")
+                _check_single_process()
+                backend = self._backend_for(job.backend, job.quantization)
+                with ThreadPoolExecutor(max_workers=max(1, settings.reembed_workers), thread_name_prefix="reembed") as pool:
+                    return self._switch(db, job, backend, pool, force)
+            finally:
+                db.close()
+
+    @staticmethod
+    def _get(db: Session, job_id: int) -> ReembedJob:
+        job = db.get(ReembedJob, job_id)
+        if job is None:
+            raise LookupError(f"Re-embedding job {job_id} not found")
+        return job
+
+    def _embed(self, backend: InferenceBackend, pool: ThreadPoolExecutor, images: List[Image]) -> List[Dict[str, Any]]:
+        return list(pool.map(lambda image: _embed_image(backend, image), images))
+
+    def _stage_next_batch(self, db: Session, job: ReembedJob, backend: InferenceBackend, pool: ThreadPoolExecutor) -> bool:
+        """Embed the next REEMBED_BATCH_SIZE users and commit them with the cursor; False when none are left."""
+        users = (
+            db.query(User.id, User.face_image_url)
+            .filter(User.id > job.user_cursor)
+            .order_by(User.id)
+            .limit(max(1, settings.reembed_batch_size))
+            .all()
+        )
+        if not users:
+            return False
+        user_ids = [u.id for u in users]
+        templates = (
+            db.query(FaceTemplate.user_id, FaceTemplate.id, FaceTemplate.face_image_url)
+            .filter(FaceTemplate.user_id.in_(user_ids))
+            .order_by(FaceTemplate.id)
+            .all()
+        )
+        images = [(u.id, None, u.face_image_url) for u in users] + [(t.user_id, t.id, t.face_image_url) for t in templates]
+        rows = self._embed(backend, pool, images)
+
+        db.execute(EmbeddingVersion.__table__.insert(), [{**row, "job_id": job.id, "version": job.version} for row in rows])
+        job.user_cursor = user_ids[-1]
+        job.users_done += len(user_ids)
+        failed = sum(1 for row in rows if row["error"])
+        job.images_done += len(rows) - failed
+        job.images_failed += failed
+        job.updated_at = datetime.utcnow()
+        db.commit()
+        return True
+
+    def _stage_missing(
+        self, db: Session, job: ReembedJob, backend: InferenceBackend, pool: ThreadPoolExecutor, retry_failed: bool
+    ) -> int:
+        """Embed the images `_missing_images` finds, replacing earlier attempts at them."""
+        images = _missing_images(db, job, retry_failed)
+        batch_size = max(1, settings.reembed_batch_size)
+        for start in range(0, len(images), batch_size):
+            rows = self._embed(backend, pool, images[start:start + batch_size])
+            for row in rows:
+                db.query(EmbeddingVersion).filter(
+                    EmbeddingVersion.job_id == job.id,
+                    EmbeddingVersion.user_id == row["user_id"],
+                    EmbeddingVersion.template_id.is_(None) if row["template_id"] is None
+                    else EmbeddingVersion.template_id == row["template_id"],
+                ).delete(synchronize_session=False)
+            db.execute(EmbeddingVersion.__table__.insert(), [{**row, "job_id": job.id, "version": job.version} for row in rows])
+            _recount(db, job)
+            job.updated_at = datetime.utcnow()
+            db.commit()
+        return len(images)
+
+    def _run(self, job_id: int, auto_switch: bool) -> None:
+        db = SessionLocal()
+        job = None
+        try:
+            job = self._get(db, job_id)
+            backend = self._backend_for(job.backend, job.quantization)
+            # Fails the job up front when the model cannot load, instead of failing every image
+            backend.warmup_recognition()
+            logger.info(f"Re-embedding job {job_id} ({job.backend} -> version {job.version}) running after user {job.user_cursor}")
+            with ThreadPoolExecutor(max_workers=max(1, settings.reembed_workers), thread_name_prefix="reembed") as pool:
+                while not self._stop.is_set() and self._stage_next_batch(db, job, backend, pool):
+                    pass
+                if self._stop.is_set():
+                    job.status = "paused"
+                    job.updated_at = datetime.utcnow()
+                    db.commit()
+                    logger.info(f"Re-embedding job {job_id} paused after user {job.user_cursor}")
+                    return
+                self._stage_missing(db, job, backend, pool, retry_failed=True)
+                job.status = "ready"
+                job.updated_at = datetime.utcnow()
+                db.commit()
+                logger.info(
+                    f"Re-embedding job {job_id} ready: {job.images_done} images embedded, {job.images_failed} failed"
+                )
+                if auto_switch:
+                    if job.images_failed:
+                        logger.warning(f"Re-embedding job {job_id} not switched automatically: {job.images_failed} images failed")
+                    elif settings.web_concurrency > 1:
+                        logger.warning(
+                            f"Re-embedding job {job_id} not switched automatically: "
+                            + _MULTI_PROCESS.format(settings.web_concurrency)
+                        )
+                    else:
+                        self._switch(db, job, backend, pool, force=False)
+        except Exception as e:
+            logger.exception(f"Re-embedding job {job_id} failed")
+            db.rollback()
+            if job is not None:
+                job.status = "failed"
+                job.error = str(e)[:2000]
+                job.updated_at = datetime.utcnow()
+                db.commit()
+        finally:
+            db.close()
+
+    def _switch(
+        self, db: Session, job: ReembedJob, backend: InferenceBackend, pool: ThreadPoolExecutor, force: bool
+    ) -> Dict[str, Any]:
+        with self._enrollments_held():
+            result = self._switch_embeddings(db, job, backend, pool, force)
+            # Before enrollments resume, so none embeds with the old model
+            set_backend(backend)
+            settings.inference_backend = job.backend
+            settings.model_quantization = job.quantization
+            settings.embedding_model_version = job.version
+        # Every cached result came from the old model
+        inference_cache.clear()
+        frame_cache.clear()
+        track_cache.clear()
+        shards = sharded_gallery()
+        for status in shards.reload() if shards is not None else []:
+            if "error" in status:
+                logger.error(f"Gallery shard {status['url']} did not reload after re-embedding; reload it: {status['error']}")
+        logger.info(f"Re-embedding job {job.id} switched: serving {job.backend} embeddings version {job.version}")
+        return result
+
+    def _switch_embeddings(
+        self, db: Session, job: ReembedJob, backend: InferenceBackend, pool: ThreadPoolExecutor, force: bool
+    ) -> Dict[str, Any]:
+        """Replace the live embeddings with the staged ones; enrollments are held off meanwhile."""
+        # Images enrolled since the job got ready still need the new model;
+        # none can be added until the switch is done
+        self._stage_missing(db, job, backend, pool, retry_failed=False)
+        if job.images_failed and not force:
+            raise ReembedConflict(
+                f"{job.images_failed} images could not be re-embedded; fix or remove them and resume the job, "
+                f"or switch with force=true"
+            )
+
+        # One transaction: the matcher sees either every old embedding or every new one
+        user_row = _staged_embedding(job, User.id, EmbeddingVersion.template_id.is_(None), User.face_image_url)
+        users = db.query(User).filter(exists().where(user_row)).update(
+            {User.face_embedding: select(EmbeddingVersion.embedding).where(user_row).limit(1).scalar_subquery()},
+            synchronize_session=False,
+        )
+        template_row = _staged_embedding(
+            job, FaceTemplate.user_id, EmbeddingVersion.template_id == FaceTemplate.id, FaceTemplate.face_image_url
+        )
+        templates = db.query(FaceTemplate).filter(exists().where(template_row)).update(
+            {FaceTemplate.embedding: select(EmbeddingVersion.embedding).where(template_row).limit(1).scalar_subquery()},
+            synchronize_session=False,
+        )
+        # Old-model embeddings must not stay comparable with new ones (forced past
+        # failures): the users and templates whose image failed keep their rows but
+        # get a zero embedding, which never matches (a new template for the user
+        # restores matching).
+        # Their staged failures are kept, so the job's failure list still names them
+        zero = embedding_to_bytes(np.zeros(EMBEDDING_DIM, dtype=np.float32))
+        users_disabled = db.query(User).filter(~exists().where(user_row)).update(
+            {User.face_embedding: zero}, synchronize_session=False
+        )
+        templates_disabled = db.query(FaceTemplate).filter(~exists().where(template_row)).update(
+            {FaceTemplate.embedding: zero}, synchronize_session=False
+        )
+        db.query(EmbeddingVersion).filter(
+            EmbeddingVersion.job_id == job.id, EmbeddingVersion.embedding.isnot(None)
+        ).delete(synchronize_session=False)
+        job.status = "completed"
+        job.switched_at = job.updated_at = datetime.utcnow()
+        db.commit()
+        if users_disabled or templates_disabled:
+            logger.warning(
+                f"Re-embedding job {job.id} switched past {job.images_failed} failed images: {users_disabled} users and "
+                f"{templates_disabled} templates no longer match; add new templates for them "
+                f"(GET /admin/reembed/{job.id}/failures)"
+            )
+        return {
+            "users_updated": users,
+            "templates_updated": templates,
+            "users_disabled": users_disabled,
+            "templates_disabled": templates_disabled,
+            "failures": self.failures(db, job.id),
+        }
+
+    def progress(self, db: Session, job: ReembedJob) -> Dict[str, Any]:
+        active = self.active_job_id == job.id
+        remaining = 0
+        if job.status in OPEN_STATUSES:
+            remaining = db.query(func.count(User.id)).filter(User.id > job.user_cursor).scalar()
+        total = job.users_done + remaining
+        eta = None
+        if active and remaining:
+            users_at_start, started = self._run_started
+            elapsed, done = time.monotonic() - started, job.users_done - users_at_start
+            if done > 0:
+                eta = round(remaining * elapsed / done, 1)
+        return {
+            "id": job.id,
+            "version": job.version,
+            "backend": job.backend,
+            "quantization": job.quantization,
+            "status": job.status,
+            "active": active,
+            "users_total": total,
+            "users_done": job.users_done,
+            "percent": round(100.0 * job.users_done / total, 1) if total else 100.0,
+            "images_embedded": job.images_done,
+            "images_failed": job.images_failed,
+            "eta_seconds": eta,
+            "error": job.error,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+            "switched_at": job.switched_at.isoformat() if job.switched_at else None,
+        }
+
+    def failures(self, db: Session, job_id: int, limit: int = 100) -> List[Dict[str, Any]]:
+        rows = (
+            db.query(EmbeddingVersion.user_id, EmbeddingVersion.template_id, EmbeddingVersion.face_image_url, EmbeddingVersion.error)
+            .filter(EmbeddingVersion.job_id == job_id, EmbeddingVersion.embedding.is_(None))
+            .order_by(EmbeddingVersion.user_id)
+            .limit(limit)
+            .all()
+        )
+        return [
+            {"user_id": r.user_id, "template_id": r.template_id, "face_image_url": r.face_image_url, "error": r.error}
+            for r in rows
+        ]
+
+
+reembed_runner = ReembedRunner()
@@ -0,0 +1,218 @@
+"""Gallery sharded across processes, matched by scatter-gather.
+
+With GALLERY_SHARDS set, registered embeddings are partitioned by user id
+(`user_id % shard count`) across shard processes (`python -m gallery_shard`),
+each holding only its partition in memory. To match, the coordinator (the
+API server) sends the query embeddings to every shard at once, each shard
+returns its top-k candidates, and the coordinator merges them into the
+global ranking; the routes then apply MATCH_THRESHOLD to the best candidate
+as for the in-process gallery. Enrollment and template changes go to the
+owning shard only. The database stays the source of truth: a shard loads its partition
+from it on startup and on `POST /reload`.
+"""
+import heapq
+import itertools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from config import settings
+from db import FaceTemplate, User
+from models.gallery import (
+    Gallery, GalleryMatch, build_gallery, empty_gallery, gallery_from_rows, normalize_rows, top_k_matches,
+)
+from utils.metrics import GALLERY_SIZE, GALLERY_TEMPLATES, stage
+
+logger = logging.getLogger(__name__)
+
+
+def shard_for(user_id: int, shard_count: int) -> int:
+    """Index of the shard that owns a user."""
+    return user_id % shard_count
+
+
+def load_partition(db: Session, index: int, count: int) -> Gallery:
+    """The users owned by shard `index` of `count`, with their templates."""
+    users = db.query(User.id, User.name, User.face_embedding).filter(User.id % count == index).all()
+    templates = (
+        db.query(FaceTemplate.user_id, FaceTemplate.embedding)
+        .filter(FaceTemplate.user_id % count == index)
+        .order_by(FaceTemplate.id)
+        .all()
+    )
+    return gallery_from_rows(users, templates)
+
+
+def merge_top_k(per_shard: List[List[List[GalleryMatch]]], k: int) -> List[List[GalleryMatch]]:
+    """Merge each shard's candidate lists into the global top k per query, best first."""
+    return [
+        heapq.nlargest(k, itertools.chain.from_iterable(candidates), key=lambda m: m.score)
+        for candidates in zip(*per_shard)
+    ]
+
+
+class ShardState:
+    """The partition held by one shard process.
+
+    Searches read an immutable Gallery snapshot; enrollment builds a new one
+    under the lock and swaps it in, so searches never block.
+    """
+
+    def __init__(self, index: int, count: int):
+        if not 0 <= index < count:
+            raise ValueError(f"Shard index {index} out of range for {count} shards")
+        self.index = index
+        self.count = count
+        self._lock = threading.Lock()
+        self._gallery = empty_gallery()
+
+    def __len__(self) -> int:
+        return len(self._gallery)
+
+    @property
+    def templates(self) -> int:
+        return self._gallery.templates
+
+    def owns(self, user_id: int) -> bool:
+        return shard_for(user_id, self.count) == self.index
+
+    def _swap(self, gallery: Gallery) -> None:
+        self._gallery = gallery
+        GALLERY_SIZE.set(len(gallery))
+        GALLERY_TEMPLATES.set(gallery.templates)
+
+    def reload(self, db: Session) -> int:
+        gallery = load_partition(db, self.index, self.count)
+        with self._lock:
+            self._swap(gallery)
+        return len(gallery)
+
+    def _without(self, user_id: int) -> Tuple[np.ndarray, np.ndarray, Dict[int, str]]:
+        """Rows, row user ids and names of the current gallery minus one user."""
+        gallery = self._gallery
+        if len(gallery) == 0:
+            return np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.int64), {}
+        row_user_ids = gallery.row_user_ids()
+        keep = row_user_ids != user_id
+        names = {int(u): n for u, n in zip(gallery.user_ids, gallery.names) if u != user_id}
+        return gallery.matrix[keep], row_user_ids[keep], names
+
+    def upsert(self, user_id: int, name: str, embeddings: np.ndarray) -> int:
+        """Set a user's templates (one embedding per row), replacing any they had."""
+        rows = normalize_rows(embeddings)
+        with self._lock:
+            matrix, row_user_ids, names = self._without(user_id)
+            names[user_id] = name
+            self._swap(build_gallery(
+                np.append(row_user_ids, np.full(len(rows), user_id, dtype=np.int64)),
+                np.vstack([matrix, rows]) if len(matrix) else rows,
+                names,
+            ))
+            return len(self._gallery)
+
+    def search(self, embeddings: np.ndarray, k: int) -> List[List[GalleryMatch]]:
+        return top_k_matches(self._gallery, embeddings, k)
+
+
+class ShardUnavailable(Exception):
+    """A shard did not answer; matching against the other shards alone could pick the wrong user."""
+
+
+class ShardedGallery:
+    """Coordinator side: scatters searches to every shard and routes enrollment."""
+
+    def __init__(self, urls: List[str], top_k: int = 5, timeout: float = 2.0):
+        if not urls:
+            raise ValueError("ShardedGallery needs at least one shard URL")
+        self.urls = [url.rstrip("/") for url in urls]
+        self.top_k = max(1, top_k)
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=len(self.urls), thread_name_prefix="gallery-shard")
+        # requests.Session keeps connections alive but is not meant to be shared across threads
+        self._local = threading.local()
+
+    def owner(self, user_id: int) -> str:
+        return self.urls[shard_for(user_id, len(self.urls))]
+
+    def _session(self):
+        import requests
+
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _call(
+        self, method: str, url: str, payload: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        import requests
+
+        try:
+            response = self._session().request(method, url, json=payload, timeout=timeout or self.timeout)
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise ShardUnavailable(f"{method} {url} failed: {e}") from e
+
+    def search(self, embeddings: np.ndarray, k: Optional[int] = None) -> List[List[GalleryMatch]]:
+        """Global top-k candidates per query embedding, merged from every shard."""
+        k = k or self.top_k
+        payload = {"embeddings": normalize_rows(embeddings).tolist(), "k": k}
+        with stage("gallery_search"):
+            futures = [self._pool.submit(self._call, "POST", f"{url}/search", payload) for url in self.urls]
+            replies = [f.result() for f in futures]
+        GALLERY_SIZE.set(sum(r["size"] for r in replies))
+        per_shard = [[[GalleryMatch(**m) for m in query] for query in r["matches"]] for r in replies]
+        return merge_top_k(per_shard, k)
+
+    def best_matches(self, embeddings: np.ndarray) -> List[Optional[GalleryMatch]]:
+        """Best user per query embedding, None when no shard holds any user."""
+        return [candidates[0] if candidates else None for candidates in self.search(embeddings)]
+
+    def enroll(self, user_id: int, name: str, embeddings: np.ndarray) -> None:
+        """Set a user's templates on the owning shard (one embedding or one per row)."""
+        payload = {"name": name, "embeddings": np.atleast_2d(np.asarray(embeddings, dtype=np.float32)).tolist()}
+        self._call("PUT", f"{self.owner(user_id)}/users/{user_id}", payload)
+
+    def reload(self) -> List[Dict[str, Any]]:
+        """Have every shard reload its partition from the database."""
+        status = []
+        for url in self.urls:
+            try:
+                # Loading a partition takes far longer than a search
+                status.append({"url": url, **self._call("POST", f"{url}/reload", timeout=max(self.timeout, 60))})
+            except ShardUnavailable as e:
+                status.append({"url": url, "error": str(e)})
+        return status
+
+    def health(self) -> List[Dict[str, Any]]:
+        """Per-shard status for the readiness probe."""
+        status = []
+        for url in self.urls:
+            try:
+                status.append({"url": url, **self._call("GET", f"{url}/health")})
+            except ShardUnavailable as e:
+                status.append({"url": url, "error": str(e)})
+        return status
+
+
+_lock = threading.Lock()
+_sharded: Optional[ShardedGallery] = None
+
+
+def sharded_gallery() -> Optional[ShardedGallery]:
+    """The coordinator for GALLERY_SHARDS, or None when the gallery is in-process."""
+    global _sharded
+    if not settings.gallery_shards:
+        return None
+    if _sharded is None:
+        with _lock:
+            if _sharded is None:
+                _sharded = ShardedGallery(
+                    settings.gallery_shards, settings.gallery_shard_top_k, settings.gallery_shard_timeout_seconds
+                )
+    return _sharded
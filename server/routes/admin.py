@@ -1,44 +1,92 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, Form, File, Query
-from sqlalchemy.orm import Session
-from db import SessionLocal, User, Attendance
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, Form, File, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
+from starlette.concurrency import run_in_threadpool
+from db import AsyncSessionLocal, User, FaceTemplate, Attendance, ReembedJob, get_db
 from utils.storage import upload_bytes_to_gcp
-from models.face_recognition import extract_face_embedding, embedding_to_bytes
+from models.face_recognition import extract_face_embedding, embedding_to_bytes, bytes_to_embedding
+from models.gallery import normalize_rows
+from models.sharding import ShardUnavailable, sharded_gallery
+from models.reembed import ReembedConflict, reembed_runner
 from fastapi import status
+from utils.inference import ENROLL, run_inference
+from utils.uploads import read_upload
+from utils.metrics import stage
+from utils.user_directory import user_directory
+from utils.frame_cache import frame_cache
+from utils.attendance_feed import AttendanceEvent, attendance_feed
+from config import settings
+from contextlib import contextmanager
+from typing import Optional
+import asyncio
+import json
+import logging
+import re
+import numpy as np
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Dependency for DB session
-def get_db():
-    db = SessionLocal()
+
+async def _index_on_shard(user_id: int, name: str, embeddings) -> None:
+    """Send a user's templates to the gallery shard that owns them (no-op without GALLERY_SHARDS).
+
+    The shard request blocks, so it runs in the thread pool. The database row
+    is already committed, so a shard that is down only misses the user until
+    it is reloaded; enrollment itself does not fail.
+    """
+    shards = sharded_gallery()
+    if shards is None:
+        return
+    try:
+        await run_in_threadpool(shards.enroll, user_id, name, embeddings)
+    except ShardUnavailable as e:
+        logger.error(f"User {user_id} not updated on gallery shard {shards.owner(user_id)}; reload it: {e}")
+
+
+@contextmanager
+def _enrollment():
+    """Embed and store a new face image without overlapping a re-embedding switch (503 during one)."""
+    try:
+        reembed_runner.begin_enrollment()
+    except ReembedConflict as rc:
+        raise HTTPException(status_code=503, detail=str(rc), headers={"Retry-After": "5"})
     try:
-        yield db
+        yield
     finally:
-        db.close()
+        reembed_runner.end_enrollment()
 
 
 @router.post("/upload")
 async def upload_face(
     name: str = Form(...),
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     if not file.filename.lower().endswith((".jpg", ".jpeg", ".png")):
         raise HTTPException(status_code=400, detail="Invalid file format")
 
     try:
-        content: bytes = await file.read()
+        content: bytes = await read_upload(file)
 
         # Upload image to Google Cloud Storage or local fallback
         file_url = await upload_bytes_to_gcp(file.filename, content)
 
-        # Generate face embedding
-        embedding = extract_face_embedding(content)
+        with _enrollment():
+            # Generate face embedding
+            embedding = await run_inference(extract_face_embedding, content, request_class=ENROLL)
 
-        # Save user data to DB
-        new_user = User(name=name, face_image_url=file_url, face_embedding=embedding_to_bytes(embedding))
-        db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+            # Save user data to DB
+            new_user = User(name=name, face_image_url=file_url, face_embedding=embedding_to_bytes(embedding))
+            with stage("db_write"):
+                db.add(new_user)
+                await db.commit()
+        # Cached frame results were scored against the gallery without this user
+        frame_cache.clear()
+        await _index_on_shard(new_user.id, name, embedding)
 
         return {"message": "User added successfully", "user_id": new_user.id}
     except HTTPException:
@@ -51,24 +99,232 @@ async def upload_face(
         raise HTTPException(status_code=500, detail="Upload failed")
 
 
+# One entity-tag of an If-None-Match list; the opaque tag may contain commas
+_ENTITY_TAG = re.compile(r'\s*(?:W/)?"([^"]*)"\s*(?:,|$)')
+
+
+def _none_match(if_none_match: str, etag: str) -> bool:
+    """Whether an If-None-Match field matches `etag` (RFC 9110 13.1.2).
+
+    `*` matches any current representation; otherwise the field is a
+    comma-separated list of entity-tags compared weakly, so `W/"x"` and `"x"`
+    are equal.
+    """
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    return any(match.group(1) == opaque.strip('"') for match in _ENTITY_TAG.finditer(if_none_match))
+
+
 @router.get("/users")
-async def list_users(db: Session = Depends(get_db)):
-    users = db.query(User).all()
-    return [
-        {"id": u.id, "name": u.name, "face_image_url": u.face_image_url}
-        for u in users
-    ]
+async def list_users(request: Request, db: AsyncSession = Depends(get_db)):
+    """Registered users, served from a cache keyed by the users table state.
+
+    Clients revalidating with `If-None-Match` get 304 after a single
+    count/max(id) query while nobody was enrolled.
+    """
+    etag, users = await db.run_sync(user_directory.get)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _none_match(", ".join(request.headers.getlist("if-none-match")), etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(users, headers=headers)
+
+
+async def _user_templates(db: AsyncSession, user_id: int):
+    """(user, extra templates) with embeddings, or 404."""
+    # Deferred columns cannot lazy-load on an AsyncSession
+    user = await db.scalar(select(User).options(undefer(User.face_embedding)).where(User.id == user_id))
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    templates = (await db.scalars(select(FaceTemplate).where(FaceTemplate.user_id == user_id).order_by(FaceTemplate.id))).all()
+    return user, list(templates)
+
+
+def _template_embeddings(user: User, templates) -> np.ndarray:
+    return np.stack([bytes_to_embedding(user.face_embedding)] + [bytes_to_embedding(t.embedding) for t in templates])
+
+
+async def _templates_changed(user: User, templates) -> None:
+    # Cached frame results were scored against the old templates
+    frame_cache.clear()
+    await _index_on_shard(user.id, user.name, _template_embeddings(user, templates))
+
+
+@router.get("/users/{user_id}/templates")
+async def list_templates(user_id: int, db: AsyncSession = Depends(get_db)):
+    """The user's face templates: the enrollment photo first, then added ones."""
+    user, templates = await _user_templates(db, user_id)
+    return {
+        "user_id": user.id,
+        "count": 1 + len(templates),
+        "max_templates": settings.max_templates_per_user,
+        "templates": [{"id": None, "primary": True, "face_image_url": user.face_image_url, "created_at": None}] + [
+            {"id": t.id, "primary": False, "face_image_url": t.face_image_url, "created_at": t.created_at.isoformat()}
+            for t in templates
+        ],
+    }
+
+
+@router.post("/users/{user_id}/templates")
+async def add_template(user_id: int, file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
+    """Add another photo of a registered user (other lighting, pose, glasses...).
+
+    Matching scores every template and keeps the best per user. The response
+    includes how similar the new face is to the user's existing templates, so
+    a photo of the wrong person stands out.
+    """
+    if not file.filename.lower().endswith((".jpg", ".jpeg", ".png")):
+        raise HTTPException(status_code=400, detail="Invalid file format")
+    user, templates = await _user_templates(db, user_id)
+    if 1 + len(templates) >= settings.max_templates_per_user:
+        raise HTTPException(
+            status_code=409,
+            detail=f"User already has {1 + len(templates)} templates (MAX_TEMPLATES_PER_USER={settings.max_templates_per_user})",
+        )
+
+    content: bytes = await read_upload(file)
+    with _enrollment():
+        try:
+            embedding = await run_inference(extract_face_embedding, content, request_class=ENROLL)
+        except ValueError as ve:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
+        file_url = await upload_bytes_to_gcp(file.filename, content)
+
+        similarity = float(np.max(normalize_rows(_template_embeddings(user, templates)) @ normalize_rows(embedding)[0]))
+        template = FaceTemplate(user_id=user.id, embedding=embedding_to_bytes(embedding), face_image_url=file_url)
+        with stage("db_write"):
+            db.add(template)
+            await db.commit()
+    templates.append(template)
+    await _templates_changed(user, templates)
+    return {
+        "message": "Template added",
+        "user_id": user.id,
+        "template_id": template.id,
+        "count": 1 + len(templates),
+        "similarity": round(similarity, 4),
+    }
+
+
+@router.delete("/users/{user_id}/templates/{template_id}")
+async def delete_template(user_id: int, template_id: int, db: AsyncSession = Depends(get_db)):
+    """Remove an added template; the enrollment photo itself stays."""
+    user, templates = await _user_templates(db, user_id)
+    remaining = [t for t in templates if t.id != template_id]
+    if len(remaining) == len(templates):
+        raise HTTPException(status_code=404, detail="Template not found")
+    await db.execute(delete(FaceTemplate).where(FaceTemplate.id == template_id))
+    await db.commit()
+    await _templates_changed(user, remaining)
+    return {"deleted": 1, "user_id": user.id, "template_id": template_id, "count": 1 + len(remaining)}
+
+
+async def _reembed_job(db: AsyncSession, job_id: int) -> ReembedJob:
+    job = await db.get(ReembedJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Re-embedding job not found")
+    return job
+
+
+async def _reembed_progress(db: AsyncSession, job_id: int):
+    return await db.run_sync(reembed_runner.progress, await _reembed_job(db, job_id))
+
+
+async def _reembed_call(action, *args):
+    """Run a runner action in the thread pool (it uses the blocking engine), mapping its errors to 400/404/409."""
+    try:
+        return await run_in_threadpool(action, *args)
+    except ValueError as ve:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
+    except LookupError as le:
+        raise HTTPException(status_code=404, detail=str(le))
+    except ReembedConflict as rc:
+        raise HTTPException(status_code=409, detail=str(rc))
+
+
+@router.post("/reembed", status_code=202)
+async def start_reembed(
+    version: str = Query(..., description="EMBEDDING_MODEL_VERSION tag of the new model"),
+    backend: Optional[str] = Query(None, description="deepface, onnx or tflite (default: INFERENCE_BACKEND)"),
+    quantization: str = Query("none", description="none or int8 (onnx and tflite)"),
+    auto_switch: bool = Query(False, description="Switch over as soon as every image is re-embedded"),
+    db: AsyncSession = Depends(get_db),
+):
+    """Re-embed every stored face image with a new model in the background.
+
+    Matching keeps using the current model until the job is switched over.
+    """
+    job_id = await _reembed_call(
+        reembed_runner.start, version, (backend or settings.inference_backend).lower(), quantization.lower(), auto_switch
+    )
+    return await _reembed_progress(db, job_id)
+
+
+@router.get("/reembed")
+async def list_reembed_jobs(db: AsyncSession = Depends(get_db)):
+    """Re-embedding jobs with their progress, newest first."""
+    jobs = (await db.scalars(select(ReembedJob).order_by(ReembedJob.id.desc()).limit(20))).all()
+    return [await db.run_sync(reembed_runner.progress, job) for job in jobs]
+
+
+@router.get("/reembed/{job_id}")
+async def reembed_progress(job_id: int, db: AsyncSession = Depends(get_db)):
+    return await _reembed_progress(db, job_id)
+
+
+@router.get("/reembed/{job_id}/failures")
+async def reembed_failures(job_id: int, limit: int = Query(100, ge=1, le=1000), db: AsyncSession = Depends(get_db)):
+    """Stored images the job could not embed, with the reason."""
+    await _reembed_job(db, job_id)
+    return await db.run_sync(reembed_runner.failures, job_id, limit)
+
+
+@router.post("/reembed/{job_id}/pause")
+async def pause_reembed(job_id: int, db: AsyncSession = Depends(get_db)):
+    """Stop after the current batch; the job resumes from there."""
+    await _reembed_call(reembed_runner.pause, job_id)
+    return await _reembed_progress(db, job_id)
+
+
+@router.post("/reembed/{job_id}/resume", status_code=202)
+async def resume_reembed(job_id: int, auto_switch: bool = Query(False), db: AsyncSession = Depends(get_db)):
+    """Continue a paused, failed or interrupted job (or retry the failed images of a ready one)."""
+    await _reembed_call(reembed_runner.resume, job_id, auto_switch)
+    return await _reembed_progress(db, job_id)
+
+
+@router.post("/reembed/{job_id}/cancel")
+async def cancel_reembed(job_id: int, db: AsyncSession = Depends(get_db)):
+    await _reembed_call(reembed_runner.cancel, job_id)
+    return await _reembed_progress(db, job_id)
+
+
+@router.post("/reembed/{job_id}/switch")
+async def switch_reembed(
+    job_id: int,
+    force: bool = Query(False, description="Switch although some images failed; those images stop matching"),
+):
+    """Replace the stored embeddings with the job's and serve the new model.
+
+    Runs in the thread pool: images enrolled since the job got ready are
+    embedded first, then every embedding is replaced in one transaction.
+    Images that could not be embedded are listed in `failures`. Refused (409)
+    while the server runs more than one process.
+    """
+    result = await _reembed_call(reembed_runner.switch, job_id, force)
+    return {"job_id": job_id, "version": settings.embedding_model_version, **result}
 
 
 @router.get("/attendance")
-async def list_attendance(db: Session = Depends(get_db)):
+async def list_attendance(db: AsyncSession = Depends(get_db)):
     # Simple join to attach user name
     rows = (
-        db.query(Attendance, User)
-        .join(User, Attendance.user_id == User.id)
-        .order_by(Attendance.timestamp.desc())
-        .all()
-    )
+        await db.execute(
+            select(Attendance, User)
+            .join(User, Attendance.user_id == User.id)
+            .order_by(Attendance.timestamp.desc())
+        )
+    ).all()
     return [
         {
             "attendance_id": a.id,
@@ -80,27 +336,111 @@ async def list_attendance(db: Session = Depends(get_db)):
     ]
 
 
+# Comment line sent when the feed is idle, so proxies keep the connection open
+_SSE_KEEPALIVE_SECONDS = 15
+# Rows per query when replaying what a resuming dashboard missed
+_SSE_RESUME_PAGE = 1000
+
+
+def _sse(event: AttendanceEvent) -> str:
+    return f"id: {event.attendance_id}\nevent: attendance\ndata: {json.dumps(event.to_dict())}\n\n"
+
+
+async def _attendance_since(db: AsyncSession, last_id: int):
+    rows = (
+        await db.execute(
+            select(Attendance.id, Attendance.user_id, Attendance.timestamp, User.name)
+            .join(User, Attendance.user_id == User.id)
+            .where(Attendance.id > last_id)
+            .order_by(Attendance.id)
+            .limit(_SSE_RESUME_PAGE)
+        )
+    ).all()
+    return [AttendanceEvent(attendance_id=r.id, user_id=r.user_id, user_name=r.name, timestamp=r.timestamp) for r in rows]
+
+
+@router.get("/attendance/stream")
+async def stream_attendance(
+    request: Request,
+    last_event_id: Optional[int] = Query(None, description="Resume after this attendance id"),
+    db: AsyncSession = Depends(get_db),
+):
+    """Server-Sent Events feed of new attendance rows.
+
+    Each event carries the attendance id as its SSE id, so a reconnecting
+    `EventSource` (which sends `Last-Event-ID`) or a client passing
+    `last_event_id` first receives all the rows it missed, read in pages of
+    `_SSE_RESUME_PAGE`, then live inserts.
+    """
+    header_id = request.headers.get("last-event-id")
+    if header_id and header_id.isdigit():
+        last_event_id = int(header_id)
+
+    # Subscribe before reading the backlog so no insert falls in between
+    queue = attendance_feed.subscribe()
+    backlog = await _attendance_since(db, last_event_id) if last_event_id is not None else []
+    # Hand the connection back before the response streams for minutes
+    await db.close()
+
+    async def events():
+        # Live events the client already has (from before or from the backlog)
+        seen_up_to = last_event_id or 0
+        try:
+            yield "retry: 3000\n\n"
+            page = backlog
+            while page:
+                for event in page:
+                    yield _sse(event)
+                seen_up_to = page[-1].attendance_id
+                if len(page) < _SSE_RESUME_PAGE:
+                    break
+                # A connection per page, so a slow client does not hold one
+                async with AsyncSessionLocal() as page_db:
+                    page = await _attendance_since(page_db, seen_up_to)
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=_SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    # Fell too far behind; the client reconnects and resumes
+                    break
+                if event.attendance_id > seen_up_to:
+                    yield _sse(event)
+        finally:
+            attendance_feed.unsubscribe(queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.delete("/attendance/{attendance_id}")
-async def delete_attendance_item(attendance_id: int, db: Session = Depends(get_db)):
-    row = db.query(Attendance).filter(Attendance.id == attendance_id).first()
+async def delete_attendance_item(attendance_id: int, db: AsyncSession = Depends(get_db)):
+    row = await db.get(Attendance, attendance_id)
     if not row:
         raise HTTPException(status_code=404, detail="Attendance not found")
-    db.delete(row)
-    db.commit()
+    await db.delete(row)
+    await db.commit()
     return {"deleted": 1, "attendance_id": attendance_id}
 
 
 @router.delete("/attendance")
 async def delete_attendance(
     user_id: int | None = Query(None, description="If provided, delete only this user's attendance"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    q = db.query(Attendance)
+    count_query = select(func.count()).select_from(Attendance)
+    delete_query = delete(Attendance)
     if user_id is not None:
-        q = q.filter(Attendance.user_id == user_id)
-    count = q.count()
+        count_query = count_query.where(Attendance.user_id == user_id)
+        delete_query = delete_query.where(Attendance.user_id == user_id)
+    count = await db.scalar(count_query)
     if count == 0:
         return {"deleted": 0}
-    q.delete(synchronize_session=False)
-    db.commit()
+    await db.execute(delete_query)
+    await db.commit()
     return {"deleted": count, "user_id": user_id}
\ No newline at end of file
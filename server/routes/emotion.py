@@ -1,7 +1,12 @@
 from fastapi import APIRouter, UploadFile, Depends, HTTPException, File, status
-from sqlalchemy.orm import Session
-from db import SessionLocal, User, EmotionSession, EmotionRecord
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from db import User, EmotionSession, EmotionRecord, get_db
 from models.emotion_detection import get_emotion_detector
+from utils.inference import EMOTION, run_inference
+from utils.uploads import read_upload
+from utils.metrics import count_outcome, stage
+from utils.pacing import recommend_interval_ms
 from config import settings
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
@@ -11,28 +16,20 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Dependency for DB session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @router.post("/start-session")
-async def start_emotion_session(user_id: int, db: Session = Depends(get_db)):
+async def start_emotion_session(user_id: int, db: AsyncSession = Depends(get_db)):
     """Start a new emotion detection session for a user"""
     try:
         # Check if user exists
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await db.get(User, user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
         # Check if there's already an active session for this user
-        active_session = db.query(EmotionSession).filter(
+        active_session = (await db.scalars(select(EmotionSession).where(
             EmotionSession.user_id == user_id,
             EmotionSession.session_end.is_(None)
-        ).first()
+        ))).first()
         
         if active_session:
             return {
@@ -45,8 +42,7 @@ async def start_emotion_session(user_id: int, db: Session = Depends(get_db)):
         # Create new session
         new_session = EmotionSession(user_id=user_id)
         db.add(new_session)
-        db.commit()
-        db.refresh(new_session)
+        await db.commit()
         
         return {
             "success": True,
@@ -60,11 +56,11 @@ async def start_emotion_session(user_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="Failed to start emotion session")
 
 @router.post("/end-session/{session_id}")
-async def end_emotion_session(session_id: int, db: Session = Depends(get_db)):
+async def end_emotion_session(session_id: int, db: AsyncSession = Depends(get_db)):
     """End an emotion detection session and calculate final statistics"""
     try:
         # Get the session
-        session = db.query(EmotionSession).filter(EmotionSession.id == session_id).first()
+        session = await db.get(EmotionSession, session_id)
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
         
@@ -79,9 +75,9 @@ async def end_emotion_session(session_id: int, db: Session = Depends(get_db)):
         session.total_session_duration = session_duration
         
         # Get all emotion records for this session
-        emotion_records = db.query(EmotionRecord).filter(
+        emotion_records = (await db.scalars(select(EmotionRecord).where(
             EmotionRecord.session_id == session_id
-        ).all()
+        ))).all()
         
         # Calculate attention duration (time when user was looking at camera)
         attention_duration = 0.0
@@ -92,7 +88,7 @@ async def end_emotion_session(session_id: int, db: Session = Depends(get_db)):
         session.total_attention_duration = attention_duration
         session.attention_percentage = (attention_duration / session_duration * 100) if session_duration > 0 else 0.0
         
-        db.commit()
+        await db.commit()
         
         return {
             "success": True,
@@ -111,7 +107,7 @@ async def end_emotion_session(session_id: int, db: Session = Depends(get_db)):
 async def analyze_emotion_frame(
     session_id: int,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Analyze a single frame for emotion and eye contact"""
     try:
@@ -120,7 +116,7 @@ async def analyze_emotion_frame(
             raise HTTPException(status_code=400, detail="Invalid file format")
         
         # Check if session exists and is active
-        session = db.query(EmotionSession).filter(EmotionSession.id == session_id).first()
+        session = await db.get(EmotionSession, session_id)
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
         
@@ -128,17 +124,19 @@ async def analyze_emotion_frame(
             raise HTTPException(status_code=400, detail="Session has ended")
         
         # Read file content
-        content: bytes = await file.read()
+        content: bytes = await read_upload(file)
         
         # Process frame with emotion detector
         detector = get_emotion_detector()
-        analysis_result = detector.process_frame(content)
+        analysis_result = await run_inference(detector.process_frame, content, request_class=EMOTION)
         
         if not analysis_result['success']:
+            count_outcome("emotion", "no_face" if analysis_result.get('face_count') == 0 else "invalid")
             return {
                 "success": False,
                 "error": analysis_result['error'],
-                "session_id": session_id
+                "session_id": session_id,
+                "next_frame_ms": recommend_interval_ms()
             }
         
         # Extract results
@@ -159,9 +157,10 @@ async def analyze_emotion_frame(
             face_bbox_height=face_bbox['height']
         )
         
-        db.add(emotion_record)
-        db.commit()
-        db.refresh(emotion_record)
+        with stage("db_write"):
+            db.add(emotion_record)
+            await db.commit()
+        count_outcome("emotion", "analyzed")
         
         # Return analysis results
         return {
@@ -173,25 +172,29 @@ async def analyze_emotion_frame(
                 "emotion": emotion_data,
                 "gaze": gaze_data,
                 "timestamp": emotion_record.timestamp.isoformat()
-            }
+            },
+            "next_frame_ms": recommend_interval_ms()
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Frame analysis failed: {e}")
+        count_outcome("emotion", "error")
         raise HTTPException(status_code=500, detail="Frame analysis failed")
 
 @router.get("/session/{session_id}/stats")
-async def get_session_stats(session_id: int, db: Session = Depends(get_db)):
+async def get_session_stats(session_id: int, db: AsyncSession = Depends(get_db)):
     """Get real-time statistics for an active session"""
     try:
-        session = db.query(EmotionSession).filter(EmotionSession.id == session_id).first()
+        session = await db.get(EmotionSession, session_id)
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
         
         # Get emotion records
-        emotion_records = db.query(EmotionRecord).filter(
+        emotion_records = (await db.scalars(select(EmotionRecord).where(
             EmotionRecord.session_id == session_id
-        ).order_by(EmotionRecord.timestamp.desc()).all()
+        ).order_by(EmotionRecord.timestamp.desc()))).all()
         
         # Calculate current session duration
         current_time = datetime.utcnow()
@@ -237,19 +240,19 @@ async def get_session_stats(session_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="Failed to get session stats")
 
 @router.get("/sessions")
-async def get_user_sessions(user_id: Optional[int] = None, db: Session = Depends(get_db)):
+async def get_user_sessions(user_id: Optional[int] = None, db: AsyncSession = Depends(get_db)):
     """Get emotion sessions for a user or all sessions"""
     try:
-        query = db.query(EmotionSession)
+        query = select(EmotionSession)
         if user_id:
-            query = query.filter(EmotionSession.user_id == user_id)
+            query = query.where(EmotionSession.user_id == user_id)
         
-        sessions = query.order_by(EmotionSession.session_start.desc()).limit(50).all()
+        sessions = (await db.scalars(query.order_by(EmotionSession.session_start.desc()).limit(50))).all()
         
         session_data = []
         for session in sessions:
             # Get user name
-            user = db.query(User).filter(User.id == session.user_id).first()
+            user = await db.get(User, session.user_id)
             user_name = user.name if user else "Unknown"
             
             session_data.append({
@@ -1,67 +1,364 @@
-from fastapi import APIRouter, UploadFile, Depends, HTTPException, File, status
+from fastapi import APIRouter, UploadFile, Depends, HTTPException, File, Form, Header, Query, Request, WebSocket, WebSocketDisconnect, status
+from sqlalchemy import DateTime, Integer, bindparam, exists, func, select, text, true, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from db import SessionLocal, User, Attendance, EmotionSession, EmotionRecord
-from models.face_recognition import extract_face_embedding, bytes_to_embedding, cosine_similarity
+from db import AsyncSessionLocal, User, FaceTemplate, Attendance, EmotionSession, EmotionRecord, dedup_bucket, engine, get_db
+from models.face_recognition import (
+    EMBEDDING_MODEL, extract_face_embedding, extract_face_embeddings, extract_face_embeddings_many,
+    embeddings_from_bytes,
+)
+from models.gallery import GalleryMatch, load_gallery_async, best_matches, gallery_from_rows, user_scores
+from models.sharding import ShardUnavailable, sharded_gallery
 from models.emotion_detection import get_emotion_detector
+from utils.frame_cache import frame_cache, frame_signature
+from utils.inference_cache import inference_cache
+from utils.track_cache import Box, Track, track_cache, detect_face_boxes
+from utils.inference import BATCH, EMOTION, run_inference
+from utils.emotion_stage import PENDING, EmotionJob, EmotionStage
+from utils.uploads import read_upload
+from utils.pacing import recommend_interval_ms
+from utils.attendance_feed import AttendanceEvent, attendance_feed
+from utils.user_directory import user_directory
+from utils.metrics import count_outcome, error_outcome, stage
+from utils import tracing
+from contextlib import contextmanager
+from functools import lru_cache
 from config import settings
-from datetime import datetime, timedelta
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+import asyncio
+import base64
+import json
 import logging
+import uuid
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Dependency for DB session
-def get_db():
-    db = SessionLocal()
+
+def _camera_key(camera_id: Optional[str]) -> Optional[str]:
+    """Identify the sending camera by its X-Camera-Id header.
+
+    Without one there is no camera key: clients behind the same address
+    (NAT, a proxy) must not share cached results or identity tracks.
+    """
+    return (camera_id or "").strip() or None
+
+
+def _frame_signature(camera_key: Optional[str], content: bytes):
+    return frame_signature(content) if settings.frame_cache_enabled and camera_key else None
+
+
+async def _gallery_matches(db: AsyncSession, embeddings) -> List[GalleryMatch]:
+    """Best gallery user for each embedding, from the in-process gallery or the shards.
+
+    Scoring and the shard requests run on a worker thread, off the event loop.
+    """
+    shards = sharded_gallery()
+    if shards is None:
+        gallery = await load_gallery_async(db)
+        if len(gallery) == 0:
+            raise HTTPException(status_code=404, detail="No registered users to match against")
+        return await asyncio.to_thread(best_matches, gallery, embeddings)
     try:
-        yield db
-    finally:
-        db.close()
+        matches = await asyncio.to_thread(shards.best_matches, embeddings)
+    except ShardUnavailable as e:
+        logger.error(f"Gallery search failed: {e}")
+        raise HTTPException(status_code=503, detail="Gallery shard unavailable")
+    if matches[0] is None:
+        raise HTTPException(status_code=404, detail="No registered users to match against")
+    return matches
+
+
+async def _best_match(db: AsyncSession, embedding) -> Tuple[Optional[GalleryMatch], float]:
+    """Score the embedding against the whole gallery and return the best user."""
+    best = (await _gallery_matches(db, embedding))[0]
+    return best, best.score
+
+
+def _dialect_insert():
+    """`insert` of the database dialect, which supports ON CONFLICT ... DO NOTHING.
+
+    `init_db` refuses to start on any other dialect.
+    """
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+# Namespace of the per-user attendance advisory locks on PostgreSQL
+_ATTENDANCE_LOCK = 0x617474
+
+
+def _lock_attendance(db: Session, user_ids: Iterable[int]) -> None:
+    """Serialize attendance writes of these users until the transaction ends.
+
+    Under READ COMMITTED two transactions can both find no row in the dedup
+    window and both insert, each in a different bucket. On PostgreSQL this
+    takes a transaction-scoped advisory lock per user, in id order so
+    concurrent batches cannot deadlock; the insert that follows then sees
+    rows committed by the previous holder. SQLite has a single writer, so
+    the transaction starts with BEGIN IMMEDIATE to take the write lock
+    before reading.
+    """
+    if engine.dialect.name == "postgresql":
+        for user_id in sorted(set(user_ids)):
+            db.execute(select(func.pg_advisory_xact_lock(_ATTENDANCE_LOCK, user_id)))
+    elif not db.connection().connection.driver_connection.in_transaction:
+        db.execute(text("BEGIN IMMEDIATE"))
+
+
+@lru_cache(maxsize=64)
+def _attendance_insert(count: int, dedup: bool):
+    """One INSERT ... SELECT ... ON CONFLICT DO NOTHING statement for `count` attendance rows.
+
+    Row i is bound as u{i} (user id), t{i} (timestamp), b{i} (dedup bucket),
+    and s{i}/e{i} (start/end of its dedup window). With `dedup`, a row is
+    only selected when the user has no row less than the window before or
+    after its timestamp; those rows lie in its bucket or a neighbouring one,
+    so the check stays on the unique index. Built once per row count, so
+    SQLAlchemy reuses the compiled SQL.
+    """
+    def row(i: int):
+        selected = select(
+            bindparam(f"u{i}", type_=Integer).label("user_id"),
+            bindparam(f"t{i}", type_=DateTime).label("timestamp"),
+            bindparam(f"b{i}", type_=Integer).label("dedup_bucket"),
+        )
+        if not dedup:
+            return selected
+        bucket = bindparam(f"b{i}", type_=Integer)
+        return selected.where(~exists().where(
+            Attendance.user_id == bindparam(f"u{i}", type_=Integer),
+            Attendance.dedup_bucket.between(bucket - 1, bucket + 1),
+            Attendance.timestamp > bindparam(f"s{i}", type_=DateTime),
+            Attendance.timestamp < bindparam(f"e{i}", type_=DateTime),
+        ))
+
+    candidates = union_all(*[row(i) for i in range(count)]).subquery()
+    table = Attendance.__table__
+    # On the table: an ORM insert with parameters would be run as a bulk insert
+    return (
+        _dialect_insert()(table)
+        # SQLite needs a WHERE on the SELECT to parse ON CONFLICT after it
+        .from_select(["user_id", "timestamp", "dedup_bucket"], select(candidates).where(true()))
+        .on_conflict_do_nothing(index_elements=["user_id", "dedup_bucket"])
+        .returning(table.c.id, table.c.user_id, table.c.timestamp)
+    )
+
+
+def _insert_attendance(db: Session, rows: List[Tuple[int, datetime]]) -> List[Tuple[int, int, datetime]]:
+    """Insert (user_id, timestamp) attendance rows and push the new ones to the live feed.
+
+    Like the other attendance and emotion writers below, this takes a sync
+    Session: routes call them through `AsyncSession.run_sync`, which runs
+    them on the async connection without blocking the event loop.
+
+    A single statement skips a row when the user already has one within the
+    dedup window of its timestamp, before or after it. The users' attendance
+    lock (`_lock_attendance`) keeps concurrent requests and workers from
+    both passing that check, and the unique (user_id, dedup_bucket) index
+    backs it up. Rows of one call must not be within the window of each
+    other. Returns (id, user_id, timestamp) of the inserted rows.
+    """
+    if not rows:
+        return []
+    window = timedelta(seconds=settings.attendance_dedup_seconds)
+    dedup = settings.attendance_dedup_seconds > 0
+    params = {}
+    for i, (user_id, timestamp) in enumerate(rows):
+        params.update({
+            f"u{i}": user_id, f"t{i}": timestamp, f"b{i}": dedup_bucket(timestamp),
+            f"s{i}": timestamp - window, f"e{i}": timestamp + window,
+        })
+    with stage("db_write"):
+        if dedup:
+            _lock_attendance(db, [user_id for user_id, _ in rows])
+        result = db.execute(_attendance_insert(len(rows), dedup), params)
+        events = [(r.id, r.user_id, r.timestamp) for r in result]
+        db.commit()
+    if events and attendance_feed.subscriber_count():
+        names = user_directory.names(db)
+        attendance_feed.publish([
+            AttendanceEvent(attendance_id=i, user_id=u, user_name=names.get(u), timestamp=t) for i, u, t in events
+        ])
+    return events
+
+
+def _record_attendance(db: Session, user_id: int) -> bool:
+    """Insert an attendance row unless one exists within the dedup window."""
+    return bool(_insert_attendance(db, [(user_id, datetime.utcnow())]))
+
+
+def _record_attendance_many(db: Session, user_ids: Iterable[int]) -> Set[int]:
+    """Record attendance for several users in one statement.
+
+    Returns the ids that got a new row (the rest were within the dedup window).
+    """
+    now = datetime.utcnow()
+    return {user_id for _, user_id, _ in _insert_attendance(db, [(user_id, now) for user_id in set(user_ids)])}
+
+
+def _record_attendance_at(db: Session, events: List[Tuple[int, datetime]]) -> Set[int]:
+    """Record attendance at past capture times, deduplicating by those times.
+
+    `events` are (user_id, captured_at) pairs. An event is skipped when it is
+    within the dedup window of an earlier event of the same user in the
+    batch, or when the user has a stored row within the window of its
+    capture time. Returns the indexes of the events that created a row; the
+    rows are written by one insert.
+    """
+    if not events:
+        return set()
+    window = timedelta(seconds=settings.attendance_dedup_seconds)
+    kept: Dict[int, datetime] = {}
+    candidates = []
+    for idx in sorted(range(len(events)), key=lambda i: events[i][1]):
+        user_id, captured_at = events[idx]
+        if user_id in kept and captured_at - kept[user_id] < window:
+            continue
+        kept[user_id] = captured_at
+        candidates.append(idx)
+    inserted = {(user_id, timestamp) for _, user_id, timestamp in _insert_attendance(db, [events[i] for i in candidates])}
+    return {i for i in candidates if events[i] in inserted}
+
+
+def _outcome(recognized: bool, deduped: bool) -> str:
+    return "deduped" if deduped else "matched" if recognized else "no_match"
+
+
+@contextmanager
+def _count_errors(pipeline: str):
+    """Count a failed frame under its pipeline before the exception propagates."""
+    try:
+        yield
+    except Exception as e:
+        count_outcome(pipeline, error_outcome(e))
+        raise
+
+
+def _pace(result: Dict[str, Any], pipeline: str) -> Dict[str, Any]:
+    """Attach the recommended next-frame interval (`next_frame_ms`) to a frame result and count its outcome."""
+    if "face_recognition" in result:
+        recognition = result["face_recognition"]
+        recognized = bool(recognition.get("threshold_met"))
+        deduped = recognized and not recognition.get("attendance_created")
+    elif "faces" in result:
+        recognized = bool(result["recognized"])
+        deduped = recognized and not any(face["created"] for face in result["faces"])
+    else:
+        recognized = result.get("user_id") is not None
+        deduped = recognized and not result.get("created")
+    stable = bool(result.get("cached") or result.get("tracked"))
+    count_outcome(pipeline, _outcome(recognized, deduped))
+    result["next_frame_ms"] = recommend_interval_ms(recognized, deduped, stable)
+    return result
+
+
+def _store_emotion_record(db: Session, user_id: int, emotion_result: Dict[str, Any]) -> int:
+    """Append an emotion record to the user's active session, creating one if needed."""
+    with stage("db_write"):
+        active_session = db.query(EmotionSession).filter(
+            EmotionSession.user_id == user_id,
+            EmotionSession.session_end.is_(None)
+        ).first()
+
+        if not active_session:
+            active_session = EmotionSession(user_id=user_id)
+            db.add(active_session)
+            db.commit()
+            db.refresh(active_session)
+
+        emotion_data = emotion_result.get('emotion', {})
+        gaze_data = emotion_result.get('gaze', {})
+        face_bbox = emotion_result.get('face_bbox', {})
+
+        emotion_record = EmotionRecord(
+            session_id=active_session.id,
+            dominant_emotion=emotion_data.get('dominant_emotion', 'neutral'),
+            emotion_confidence=emotion_data.get('confidence', 0.0),
+            is_looking_at_camera=gaze_data.get('is_looking_at_camera', False),
+            eye_contact_confidence=gaze_data.get('confidence', 0.0),
+            face_bbox_x=face_bbox.get('x'),
+            face_bbox_y=face_bbox.get('y'),
+            face_bbox_width=face_bbox.get('width'),
+            face_bbox_height=face_bbox.get('height')
+        )
+
+        db.add(emotion_record)
+        db.commit()
+        return active_session.id
+
+
+async def _analyze_emotion(content: bytes) -> Dict[str, Any]:
+    return await run_inference(get_emotion_detector().process_frame, content, request_class=EMOTION)
+
+
+async def _save_emotion(user_id: int, emotion_result: Dict[str, Any]) -> int:
+    async with AsyncSessionLocal() as db:
+        return await db.run_sync(_store_emotion_record, user_id, emotion_result)
+
+
+emotion_stage = EmotionStage(
+    _analyze_emotion,
+    _save_emotion,
+    workers=settings.inference_emotion_concurrency,
+    max_queue=settings.emotion_queue_size,
+    max_wait=settings.inference_emotion_deadline_ms / 1000,
+    ttl=settings.emotion_result_ttl_seconds,
+)
+
+
+@router.get("/frame-cache/stats")
+async def frame_cache_stats():
+    """Hit rate of the near-duplicate frame cache."""
+    return frame_cache.stats()
+
+
+@router.get("/inference-cache/stats")
+async def inference_cache_stats():
+    """Hit rate and memory of the content-hash inference cache."""
+    return inference_cache.stats()
+
+
+@router.get("/track-cache/stats")
+async def track_cache_stats():
+    """How often /match/stream confirmed an identity without a new embedding."""
+    return track_cache.stats()
 
 
 @router.post("/")
-async def match_face(file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def match_face(file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
     if not file.filename.lower().endswith((".jpg", ".jpeg", ".png")):
         raise HTTPException(status_code=400, detail="Invalid file format")
 
     try:
-        content: bytes = await file.read()
+        with _count_errors("match"):
+            content: bytes = await read_upload(file)
 
-        # Extract embedding from uploaded image
-        new_embedding = extract_face_embedding(content)
+            # Extract embedding from uploaded image
+            new_embedding = await run_inference(extract_face_embedding, content)
 
-        # Compare with stored embeddings and pick the best cosine similarity
-        users = db.query(User).all()
-        if not users:
-            raise HTTPException(status_code=404, detail="No registered users to match against")
+            # Compare with stored embeddings and pick the best cosine similarity
+            best_user, best_score = await _best_match(db, new_embedding)
 
-        best_user = None
-        best_score = -1.0
-        for user in users:
-            stored_embedding = bytes_to_embedding(user.face_embedding)
-            score = cosine_similarity(new_embedding, stored_embedding)
-            if score > best_score:
-                best_score = score
-                best_user = user
-
-        if best_user and best_score >= settings.match_threshold:
-            # Deduplicate attendance within configured window
-            window_start = datetime.utcnow() - timedelta(seconds=settings.attendance_dedup_seconds)
-            recent = (
-                db.query(Attendance)
-                .filter(Attendance.user_id == best_user.id, Attendance.timestamp >= window_start)
-                .first()
-            )
-            if recent is None:
-                attendance = Attendance(user_id=best_user.id)
-                db.add(attendance)
-                db.commit()
-                return {"message": "Face matched", "user_id": best_user.id, "score": best_score, "dedup": False}
-            else:
-                return {"message": "Face matched (deduped)", "user_id": best_user.id, "score": best_score, "dedup": True}
-
-        raise HTTPException(status_code=404, detail=f"No match found (best score={best_score:.3f}, threshold={settings.match_threshold})")
+            if best_user and best_score >= settings.match_threshold:
+                # Deduplicate attendance within configured window
+                created = await db.run_sync(_record_attendance, best_user.id)
+                count_outcome("match", _outcome(True, not created))
+                if created:
+                    return {"message": "Face matched", "user_id": best_user.id, "score": best_score, "dedup": False,
+                            "next_frame_ms": recommend_interval_ms(recognized=True)}
+                else:
+                    return {"message": "Face matched (deduped)", "user_id": best_user.id, "score": best_score, "dedup": True,
+                            "next_frame_ms": recommend_interval_ms(recognized=True, deduped=True)}
+
+            raise HTTPException(status_code=404, detail=f"No match found (best score={best_score:.3f}, threshold={settings.match_threshold})")
     except HTTPException:
         raise
     except ValueError as ve:
@@ -71,49 +368,220 @@ async def match_face(file: UploadFile = File(...), db: Session = Depends(get_db)
         raise HTTPException(status_code=500, detail="Match failed") 
 
 
+def _track_frame(camera_key: Optional[str], content: bytes) -> Tuple[Optional[Track], Optional[Box], Optional[np.ndarray]]:
+    """Inference side of a stream frame; runs on the inference pool.
+
+    Returns (track, box, embedding): the camera's identity track if the face
+    stayed in place, the single face box, and the frame's embedding unless
+    the track is confirmed without one. Frames without a camera key are
+    never tracked.
+    """
+    boxes = detect_face_boxes(content) if settings.track_cache_enabled and camera_key else []
+    box = boxes[0] if len(boxes) == 1 else None
+    track = track_cache.follow(camera_key, box) if box else None
+    if box is None and camera_key:
+        track_cache.drop(camera_key)
+
+    if track is not None and not track_cache.needs_reverify(track):
+        return track, box, None
+    return track, box, extract_face_embedding(content)
+
+
+async def _tracked_user_score(db: AsyncSession, user_id: int, embedding: np.ndarray) -> float:
+    """Best score of `embedding` over the tracked user's templates (-1 if the user is gone)."""
+    with stage("db_read"):
+        users = (await db.execute(select(User.id, User.name, User.face_embedding).where(User.id == user_id))).all()
+        templates = (await db.execute(
+            select(FaceTemplate.user_id, FaceTemplate.embedding).where(FaceTemplate.user_id == user_id).order_by(FaceTemplate.id)
+        )).all()
+    gallery = gallery_from_rows(users, templates)
+    if len(gallery) == 0:
+        return -1.0
+    return float(user_scores(gallery, embedding)[0, 0])
+
+
+async def _match_tracked_frame(db: AsyncSession, camera_key: Optional[str], content: bytes) -> Dict[str, Any]:
+    """Recognize a stream frame, reusing the camera's identity track when possible.
+
+    Frames that only continue a track (face box overlap, no embedding) keep
+    the identity but never record attendance; attendance is only written for
+    a full match or a re-verification against the user's templates.
+    """
+    track, box, new_embedding = await run_inference(_track_frame, camera_key, content)
+
+    if new_embedding is None:
+        track_cache.confirm()
+        return {"user_id": track.user_id, "score": track.score, "created": False, "cached": False, "tracked": True}
+
+    if track is not None:
+        # Cheap re-verification: compare against the tracked user's templates only
+        score = await _tracked_user_score(db, track.user_id, new_embedding)
+        if score >= settings.match_threshold:
+            track_cache.reverify(track, score)
+            created = await db.run_sync(_record_attendance, track.user_id)
+            return {"user_id": track.user_id, "score": score, "created": created, "cached": False, "tracked": True}
+        track_cache.drop(camera_key)
+
+    best_user, best_score = await _best_match(db, new_embedding)
+    if best_user and best_score >= settings.match_threshold:
+        created = await db.run_sync(_record_attendance, best_user.id)
+        if box is not None:
+            track_cache.start(camera_key, best_user.id, best_score, box)
+        return {"user_id": best_user.id, "score": best_score, "created": created, "cached": False, "tracked": False}
+
+    return {"user_id": None, "score": best_score, "cached": False, "tracked": False}
+
+
+async def _recognize_embeddings(db: AsyncSession, embeddings: np.ndarray) -> List[Dict[str, Any]]:
+    """Match several face embeddings at once and record attendance for everyone recognized.
+
+    All embeddings are scored with one gallery product and attendance is written
+    in a single transaction.
+    """
+    matches = await _gallery_matches(db, embeddings)
+
+    # The same person can only be matched once per frame; keep their best face
+    winners: Dict[int, int] = {}
+    for idx, match in enumerate(matches):
+        if match.score < settings.match_threshold:
+            continue
+        current = winners.get(match.id)
+        if current is None or match.score > matches[current].score:
+            winners[match.id] = idx
+    created = await db.run_sync(_record_attendance_many, winners)
+
+    results = []
+    for idx, match in enumerate(matches):
+        recognized = winners.get(match.id) == idx
+        results.append({
+            "user_id": match.id if recognized else None,
+            "user_name": match.name if recognized else None,
+            "score": match.score,
+            "created": recognized and match.id in created,
+        })
+    return results
+
+
+async def _match_all_faces(db: AsyncSession, content: bytes) -> Dict[str, Any]:
+    """Recognize every face in a frame and record attendance for all of them."""
+    faces = await run_inference(extract_face_embeddings, content)
+    if not faces:
+        raise ValueError("No face detected")
+
+    results = await _recognize_embeddings(db, np.stack([f["embedding"] for f in faces]))
+    for face, result in zip(faces, results):
+        result["facial_area"] = face["facial_area"]
+
+    return {
+        "face_count": len(faces),
+        "recognized": sorted(r["user_id"] for r in results if r["user_id"] is not None),
+        "faces": results,
+        "cached": False,
+    }
+
+
+async def _stream_frame(db: AsyncSession, camera_key: Optional[str], content: bytes, multi: bool = False) -> Dict[str, Any]:
+    """Recognize one camera frame (the `/match/stream` pipeline).
+
+    Cache hits are answered right away; everything else queues for the
+    inference pool, and the database work waits on the event loop.
+    """
+    namespace = "stream-multi" if multi else "stream"
+    signature = _frame_signature(camera_key, content)
+    cached = frame_cache.lookup(namespace, camera_key, signature)
+    if cached is not None:
+        # Attendance was already handled when the frame was first analyzed
+        if multi:
+            cached["faces"] = [dict(face, created=False) for face in cached["faces"]]
+        elif cached.get("user_id") is not None:
+            cached["created"] = False
+        return _pace(cached, namespace)
+
+    if multi:
+        result = await _match_all_faces(db, content)
+    else:
+        result = await _match_tracked_frame(db, camera_key, content)
+    frame_cache.store(namespace, camera_key, signature, result)
+    return _pace(result, namespace)
+
+
+async def _analyze_with_emotion(db: AsyncSession, camera_key: Optional[str], content: bytes) -> Dict[str, Any]:
+    """Recognize a frame and queue its emotion and gaze analysis (the `/match/with-emotion` pipeline)."""
+    signature = _frame_signature(camera_key, content)
+    cached = frame_cache.lookup("with-emotion", camera_key, signature)
+    if cached is not None:
+        recognition = dict(cached["face_recognition"])
+        if recognition.get("threshold_met"):
+            recognition["attendance_created"] = False
+        # The emotion of the first analysis is recorded again, so session
+        # attention statistics keep counting while the user stays in place
+        first = emotion_stage.get(cached.pop("emotion_job_id", None))
+        job = emotion_stage.submit(camera_key, recognition["user_id"], content, follows=first)
+        cached["face_recognition"] = recognition
+        cached["emotion_detection"] = job.summary()
+        cached["timestamp"] = datetime.utcnow().isoformat()
+        return _pace(cached, "with-emotion")
+
+    result = await _match_with_emotion(db, content)
+    job = emotion_stage.submit(camera_key, result["face_recognition"]["user_id"], content)
+    result["emotion_detection"] = job.summary()
+    # Cache hits look up the first frame's analysis by its job
+    frame_cache.store("with-emotion", camera_key, signature, dict(result, emotion_job_id=job.id))
+    return _pace(result, "with-emotion")
+
+
+async def _match_with_emotion(db: AsyncSession, content: bytes) -> Dict[str, Any]:
+    """Recognition and attendance of one frame; emotion and gaze are analyzed later by `emotion_stage`."""
+    new_embedding = await run_inference(extract_face_embedding, content)
+    best_user, best_score = await _best_match(db, new_embedding)
+
+    result = {
+        "face_recognition": {
+            "user_id": best_user.id if best_user and best_score >= settings.match_threshold else None,
+            "user_name": best_user.name if best_user and best_score >= settings.match_threshold else None,
+            "score": best_score,
+            "threshold_met": best_score >= settings.match_threshold if best_user else False
+        },
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+    # If face is recognized, create attendance
+    if best_user and best_score >= settings.match_threshold:
+        created = await db.run_sync(_record_attendance, best_user.id)
+        result["face_recognition"]["attendance_created"] = created
+
+    result["cached"] = False
+    return result
+
+
 @router.post("/stream")
-async def match_stream_frame(file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def match_stream_frame(
+    file: UploadFile = File(...),
+    multi: bool = Query(False, description="Recognize every face in the frame (classroom cameras)"),
+    x_camera_id: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
+):
     """Endpoint for camera agents to send individual JPEG frames.
 
     Behavior: same as `/match/` but optimized for continuous frames and returns
-    a compact payload for lower bandwidth and latency.
+    a compact payload for lower bandwidth and latency. Frames that are nearly
+    identical to the last analyzed frame from the same camera (`X-Camera-Id`
+    header) are answered from cache with `cached: true`. While the recognized
+    face stays in place, its identity is carried over from the previous frame
+    (`tracked: true`) without a new embedding. Frames without a camera id are
+    always analyzed in full.
+
+    With `multi=true` every face in the frame is embedded in one batch and
+    matched against the gallery at once, and attendance is recorded for all
+    recognized users in a single transaction.
     """
     if not file.filename.lower().endswith((".jpg", ".jpeg", ".png")):
         raise HTTPException(status_code=400, detail="Invalid file format")
 
     try:
-        content: bytes = await file.read()
-        new_embedding = extract_face_embedding(content)
-
-        users = db.query(User).all()
-        if not users:
-            raise HTTPException(status_code=404, detail="No registered users to match against")
-
-        best_user = None
-        best_score = -1.0
-        for user in users:
-            stored_embedding = bytes_to_embedding(user.face_embedding)
-            score = cosine_similarity(new_embedding, stored_embedding)
-            if score > best_score:
-                best_score = score
-                best_user = user
-
-        if best_user and best_score >= settings.match_threshold:
-            window_start = datetime.utcnow() - timedelta(seconds=settings.attendance_dedup_seconds)
-            recent = (
-                db.query(Attendance)
-                .filter(Attendance.user_id == best_user.id, Attendance.timestamp >= window_start)
-                .first()
-            )
-            created = False
-            if recent is None:
-                attendance = Attendance(user_id=best_user.id)
-                db.add(attendance)
-                db.commit()
-                created = True
-            return {"user_id": best_user.id, "score": best_score, "created": created}
-
-        return {"user_id": None, "score": best_score}
+        with _count_errors("stream-multi" if multi else "stream"):
+            content: bytes = await read_upload(file)
+            return await _stream_frame(db, _camera_key(x_camera_id), content, multi)
     except HTTPException:
         raise
     except ValueError as ve:
@@ -123,105 +591,367 @@ async def match_stream_frame(file: UploadFile = File(...), db: Session = Depends
 
 
 @router.post("/with-emotion")
-async def match_face_with_emotion(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    """Enhanced face matching with emotion detection and eye tracking"""
+async def match_face_with_emotion(
+    file: UploadFile = File(...),
+    x_camera_id: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
+):
+    """Enhanced face matching with emotion detection and eye tracking.
+
+    Recognition and attendance are answered right away; emotion and gaze are
+    analyzed afterwards on a background queue, so `emotion_detection` only
+    holds the analysis' `job_id` and `status` (`pending`, or `dropped` when
+    the queue is full). Fetch the result from `/match/emotion/{job_id}`; it
+    is stored as an emotion record once done, for a recognized user.
+
+    Unchanged frames from the same camera reuse the previous analysis (flagged
+    `cached: true`); the cached emotion is still recorded so session attention
+    statistics keep counting while the user stays in front of the camera.
+    """
     if not file.filename.lower().endswith((".jpg", ".jpeg", ".png")):
         raise HTTPException(status_code=400, detail="Invalid file format")
 
     try:
-        content: bytes = await file.read()
+        with _count_errors("with-emotion"):
+            content: bytes = await read_upload(file)
+            return await _analyze_with_emotion(db, _camera_key(x_camera_id), content)
 
-        # First, do face recognition
-        new_embedding = extract_face_embedding(content)
-        users = db.query(User).all()
-        
-        if not users:
-            raise HTTPException(status_code=404, detail="No registered users to match against")
+    except HTTPException:
+        raise
+    except ValueError as ve:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
+    except Exception as e:
+        logger.error(f"Enhanced face matching failed: {e}")
+        raise HTTPException(status_code=500, detail="Enhanced face matching failed")
 
-        best_user = None
-        best_score = -1.0
-        for user in users:
-            stored_embedding = bytes_to_embedding(user.face_embedding)
-            score = cosine_similarity(new_embedding, stored_embedding)
-            if score > best_score:
-                best_score = score
-                best_user = user
-
-        # Get emotion detection results
-        detector = get_emotion_detector()
-        emotion_result = detector.process_frame(content)
-        
-        result = {
-            "face_recognition": {
-                "user_id": best_user.id if best_user and best_score >= settings.match_threshold else None,
-                "user_name": best_user.name if best_user and best_score >= settings.match_threshold else None,
-                "score": best_score,
-                "threshold_met": best_score >= settings.match_threshold if best_user else False
-            },
-            "emotion_detection": emotion_result,
-            "timestamp": datetime.utcnow().isoformat()
-        }
 
-        # If face is recognized and emotion detection successful, create attendance
-        if best_user and best_score >= settings.match_threshold:
-            window_start = datetime.utcnow() - timedelta(seconds=settings.attendance_dedup_seconds)
-            recent = (
-                db.query(Attendance)
-                .filter(Attendance.user_id == best_user.id, Attendance.timestamp >= window_start)
-                .first()
-            )
-            
-            created = False
-            if recent is None:
-                attendance = Attendance(user_id=best_user.id)
-                db.add(attendance)
-                db.commit()
-                created = True
-            
-            result["face_recognition"]["attendance_created"] = created
-            
-            # Store emotion data if successful
-            if emotion_result.get('success'):
-                # Get or create emotion session for this user
-                active_session = db.query(EmotionSession).filter(
-                    EmotionSession.user_id == best_user.id,
-                    EmotionSession.session_end.is_(None)
-                ).first()
-                
-                if not active_session:
-                    active_session = EmotionSession(user_id=best_user.id)
-                    db.add(active_session)
-                    db.commit()
-                    db.refresh(active_session)
-                
-                # Store emotion record
-                emotion_data = emotion_result.get('emotion', {})
-                gaze_data = emotion_result.get('gaze', {})
-                face_bbox = emotion_result.get('face_bbox', {})
-                
-                emotion_record = EmotionRecord(
-                    session_id=active_session.id,
-                    dominant_emotion=emotion_data.get('dominant_emotion', 'neutral'),
-                    emotion_confidence=emotion_data.get('confidence', 0.0),
-                    is_looking_at_camera=gaze_data.get('is_looking_at_camera', False),
-                    eye_contact_confidence=gaze_data.get('confidence', 0.0),
-                    face_bbox_x=face_bbox.get('x'),
-                    face_bbox_y=face_bbox.get('y'),
-                    face_bbox_width=face_bbox.get('width'),
-                    face_bbox_height=face_bbox.get('height')
-                )
-                
-                db.add(emotion_record)
-                db.commit()
-                
-                result["emotion_session_id"] = active_session.id
-
-        return result
+@router.get("/emotion/{job_id}")
+async def emotion_result(job_id: str, wait: float = Query(0, ge=0, le=10, description="Seconds to wait for a pending analysis")):
+    """Background emotion/gaze analysis of a `/match/with-emotion` frame.
+
+    `status` is `pending`, `done` (with `emotion_detection` and, for a
+    recognized user, the `emotion_session_id` it was recorded in), `failed`
+    or `dropped` (not analyzed under load). With `wait`, a pending analysis is
+    awaited for up to that many seconds before answering. Results are kept for
+    EMOTION_RESULT_TTL_SECONDS.
+    """
+    job = emotion_stage.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired emotion job")
+    return (await emotion_stage.wait(job, wait)).to_dict()
+
+
+def _parse_embedding_request(body: bytes, content_type: str, model: Optional[str], model_version: Optional[str]) -> np.ndarray:
+    """Decode a `/match/embedding` body (raw float32 or JSON with base64) and check model compatibility."""
+    if content_type.startswith("application/json"):
+        try:
+            payload = json.loads(body)
+            model = payload.get("model", model)
+            model_version = payload.get("model_version", model_version)
+            encoded = payload["embeddings"]
+            if isinstance(encoded, str):
+                encoded = [encoded]
+            blob = b"".join(base64.b64decode(item, validate=True) for item in encoded)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise ValueError('Expected JSON {"model", "model_version", "embeddings": [base64, ...]}')
+    else:
+        blob = body
+
+    if (model or "").lower() != EMBEDDING_MODEL.lower() or model_version != settings.embedding_model_version:
+        raise ValueError(
+            f"Incompatible embedding model {model!r} version {model_version!r}; "
+            f"expected {EMBEDDING_MODEL!r} version {settings.embedding_model_version!r}"
+        )
+    embeddings = embeddings_from_bytes(blob)
+    if len(embeddings) > settings.batch_max_frames:
+        raise HTTPException(status_code=413, detail=f"Too many embeddings (max {settings.batch_max_frames})")
+    return embeddings
+
 
+@router.post("/embedding")
+async def match_embedding(
+    request: Request,
+    model: Optional[str] = Query(None, description="Embedding model name (binary bodies)"),
+    model_version: Optional[str] = Query(None, description="Embedding model version (binary bodies)"),
+    db: AsyncSession = Depends(get_db),
+):
+    """Match embeddings computed on the camera instead of a JPEG.
+
+    The body is either raw little-endian float32 values (`application/octet-stream`,
+    128 per embedding, model tag in the query string) or JSON with base64
+    encoded embeddings. Only the gallery lookup and attendance logic run here,
+    no image decoding or model inference. Several embeddings are treated like
+    the faces of one frame (`/match/stream?multi=true`).
+    """
+    try:
+        with _count_errors("embedding"):
+            embeddings = _parse_embedding_request(
+                await request.body(), request.headers.get("content-type", ""), model, model_version
+            )
+            results = await _recognize_embeddings(db, embeddings)
+        for r in results:
+            count_outcome("embedding", _outcome(r["user_id"] is not None, r["user_id"] is not None and not r["created"]))
+        recognized = [r["user_id"] for r in results if r["user_id"] is not None]
+        return {
+            "count": len(results),
+            "recognized": sorted(recognized),
+            "matches": results,
+            "next_frame_ms": recommend_interval_ms(
+                recognized=bool(recognized),
+                deduped=bool(recognized) and not any(r["created"] for r in results),
+            ),
+        }
     except HTTPException:
         raise
     except ValueError as ve:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
     except Exception as e:
-        logger.error(f"Enhanced face matching failed: {e}")
-        raise HTTPException(status_code=500, detail="Enhanced face matching failed")
\ No newline at end of file
+        logger.error(f"Embedding match failed: {e}")
+        raise HTTPException(status_code=500, detail="Embedding match failed")
+
+
+def _parse_captured_at(value: Optional[str], now: datetime) -> datetime:
+    """Parse a client capture time (ISO 8601) into naive UTC; missing means now."""
+    if not value:
+        return now
+    captured_at = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    if captured_at.tzinfo is not None:
+        captured_at = captured_at.astimezone(timezone.utc).replace(tzinfo=None)
+    if captured_at - now > timedelta(seconds=settings.batch_max_clock_skew_seconds):
+        raise ValueError("Capture time is in the future")
+    return captured_at
+
+
+async def _match_batch(db: AsyncSession, contents: List[bytes], captured_at: List[Optional[datetime]], errors: List[Optional[str]]) -> Dict[str, Any]:
+    """Recognize a backlog of frames: batched embedding, one gallery product, one attendance write."""
+    pending = [i for i, error in enumerate(errors) if error is None]
+    embedded: List[Dict[str, Any]] = []
+    # One inference slot per chunk, so live check-ins get workers between chunks
+    size = max(1, settings.embedding_batch_size)
+    for start in range(0, len(pending), size):
+        embedded.extend(await run_inference(
+            extract_face_embeddings_many, [contents[i] for i in pending[start:start + size]], size, request_class=BATCH
+        ))
+
+    frames = [
+        {"index": i, "captured_at": captured_at[i].isoformat() if captured_at[i] else None,
+         "user_id": None, "user_name": None, "score": None, "created": False, "error": errors[i]}
+        for i in range(len(contents))
+    ]
+    single: List[Tuple[int, np.ndarray]] = []
+    for i, entry in zip(pending, embedded):
+        if entry["error"]:
+            frames[i]["error"] = entry["error"]
+        elif not entry["faces"]:
+            frames[i]["error"] = "No face detected"
+        elif len(entry["faces"]) > 1:
+            frames[i]["error"] = "Multiple faces detected. Please ensure only one face is visible."
+        else:
+            single.append((i, entry["faces"][0]["embedding"]))
+
+    if single:
+        matches = await _gallery_matches(db, np.stack([embedding for _, embedding in single]))
+
+        events: List[Tuple[int, datetime]] = []
+        event_frames: List[int] = []
+        for (i, _), match in zip(single, matches):
+            frames[i]["score"] = match.score
+            if match.score >= settings.match_threshold:
+                frames[i]["user_id"] = match.id
+                frames[i]["user_name"] = match.name
+                events.append((match.id, captured_at[i]))
+                event_frames.append(i)
+        for idx in await db.run_sync(_record_attendance_at, events):
+            frames[event_frames[idx]]["created"] = True
+
+    for f in frames:
+        if f["error"]:
+            count_outcome("batch", "no_face" if f["error"] == "No face detected" else "invalid")
+        else:
+            count_outcome("batch", _outcome(f["user_id"] is not None, f["user_id"] is not None and not f["created"]))
+
+    return {
+        "frame_count": len(frames),
+        "recognized": sum(1 for f in frames if f["user_id"] is not None),
+        "attendance_created": sum(1 for f in frames if f["created"]),
+        "errors": sum(1 for f in frames if f["error"]),
+        "frames": frames,
+    }
+
+
+@router.post("/batch")
+async def match_batch(
+    files: List[UploadFile] = File(...),
+    captured_at: Optional[List[str]] = Form(None),
+    db: AsyncSession = Depends(get_db),
+):
+    """Replay a backlog of frames collected while a camera was offline.
+
+    Send the frames as repeated `files` parts and, in the same order, their
+    capture times as repeated `captured_at` fields (ISO 8601; naive values are
+    UTC, empty means now). Faces are embedded in batches, all frames are
+    matched against the gallery in one matrix product and attendance is
+    recorded at the capture times, deduplicated within the dedup window around
+    each capture time. Per-frame problems (bad file, no face, several faces,
+    bad timestamp) are reported in that frame's `error` without failing the
+    batch.
+    """
+    if len(files) > settings.batch_max_frames:
+        raise HTTPException(status_code=413, detail=f"Too many frames (max {settings.batch_max_frames})")
+    captured_at = captured_at or []
+    if captured_at and len(captured_at) != len(files):
+        raise HTTPException(status_code=400, detail="captured_at must have one entry per file")
+
+    now = datetime.utcnow()
+    contents: List[bytes] = []
+    times: List[Optional[datetime]] = []
+    errors: List[Optional[str]] = []
+    for i, file in enumerate(files):
+        error = None
+        captured = None
+        content = b""
+        if not (file.filename or "").lower().endswith((".jpg", ".jpeg", ".png")):
+            error = "Invalid file format"
+        else:
+            try:
+                content = await read_upload(file)
+                captured = _parse_captured_at(captured_at[i] if captured_at else None, now)
+            except HTTPException as he:
+                error = he.detail
+            except ValueError as ve:
+                error = f"Invalid captured_at: {ve}"
+        contents.append(content)
+        times.append(captured)
+        errors.append(error)
+
+    try:
+        with _count_errors("batch"):
+            return await _match_batch(db, contents, times, errors)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Batch match failed: {e}")
+        raise HTTPException(status_code=500, detail="Batch match failed")
+
+
+@dataclass
+class StreamConnection:
+    """State kept for the lifetime of one `/match/ws` connection."""
+    camera_key: str
+    emotion_session_id: Optional[int] = None
+    frames: int = 0
+    # Frame replies and emotion pushes share the socket
+    send_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    pushes: Set[asyncio.Task] = field(default_factory=set)
+
+
+def _parse_frame_message(message: bytes) -> Tuple[Dict[str, Any], bytes]:
+    """Split a binary frame message into its JSON header and JPEG payload.
+
+    Layout: 4-byte big-endian header length, UTF-8 JSON header, image bytes.
+    """
+    if len(message) < 4:
+        raise ValueError("Frame message too short")
+    header_len = int.from_bytes(message[:4], "big")
+    if header_len > len(message) - 4:
+        raise ValueError("Frame header length exceeds message size")
+    header = json.loads(message[4:4 + header_len]) if header_len else {}
+    if not isinstance(header, dict):
+        raise ValueError("Frame header must be a JSON object")
+    return header, message[4 + header_len:]
+
+
+async def _process_ws_frame(conn: StreamConnection, header: Dict[str, Any], content: bytes) -> Dict[str, Any]:
+    if not content:
+        raise ValueError("Empty frame")
+    mode = header.get("mode", "emotion")
+    if mode not in ("emotion", "stream", "multi"):
+        raise ValueError(f"Unknown mode: {mode}")
+    # A session per frame: no transaction or pooled connection is held
+    # between frames, however long the camera stays connected
+    async with AsyncSessionLocal() as db:
+        if mode == "emotion":
+            result = await _analyze_with_emotion(db, conn.camera_key, content)
+        else:
+            result = await _stream_frame(db, conn.camera_key, content, multi=mode == "multi")
+    conn.frames += 1
+    return result
+
+
+async def _push_emotion(websocket: WebSocket, conn: StreamConnection, job: EmotionJob, seq: Any) -> None:
+    """Send a frame's emotion analysis on its connection once the background stage has finished it."""
+    await job.done.wait()
+    if job.emotion_session_id is not None:
+        conn.emotion_session_id = job.emotion_session_id
+    try:
+        async with conn.send_lock:
+            await websocket.send_json({"type": "emotion", "seq": seq, **job.to_dict()})
+    except Exception as e:
+        # Connection closed in the meantime
+        logger.debug(f"Emotion push for job {job.id} not delivered: {e}")
+
+
+@router.websocket("/ws")
+async def match_websocket(websocket: WebSocket, camera_id: Optional[str] = None):
+    """Persistent channel for camera clients.
+
+    The client sends binary messages (see `_parse_frame_message`) whose header
+    may carry `seq` (echoed back) and `mode`: `emotion` (default, same as
+    `/match/with-emotion`), `stream` or `multi` (same as `/match/stream`).
+    Each frame is answered with a JSON message on the same connection,
+    including the recommended `next_frame_ms` before the next frame and the
+    frame's stage durations in `server_timing`. The identity track and
+    emotion session id live as long as the connection, so no per-frame HTTP
+    or multipart parsing is paid; each frame gets its own short DB session.
+
+    Frame replies have `type: frame`. In `emotion` mode the emotion and gaze
+    analysis finishes after the reply and is pushed as a second message with
+    `type: emotion`, the frame's `seq` and the fields of `/match/emotion/{job_id}`.
+    """
+    await websocket.accept()
+    conn = StreamConnection(camera_key=camera_id or f"ws-{uuid.uuid4().hex[:12]}")
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            header: Dict[str, Any] = {}
+            with tracing.trace(f"WS /match/ws {conn.camera_key}") as frame_trace:
+                try:
+                    with _count_errors("ws"):
+                        if message.get("bytes") is None:
+                            raise ValueError("Expected a binary frame message")
+                        if len(message["bytes"]) > settings.max_upload_bytes:
+                            raise HTTPException(status_code=413, detail=f"Frame too large (max {settings.max_upload_bytes} bytes)")
+                        header, content = _parse_frame_message(message["bytes"])
+                        result = await _process_ws_frame(conn, header, content)
+                except HTTPException as he:
+                    result = {"error": he.detail, "status": he.status_code, "next_frame_ms": recommend_interval_ms()}
+                except ValueError as ve:
+                    result = {"error": str(ve), "status": status.HTTP_400_BAD_REQUEST, "next_frame_ms": recommend_interval_ms()}
+                except Exception as e:
+                    logger.error(f"WebSocket frame processing failed: {e}")
+                    result = {"error": "Frame processing failed", "status": 500, "next_frame_ms": recommend_interval_ms()}
+            reply = {
+                "type": "frame",
+                "seq": header.get("seq"),
+                "frames": conn.frames,
+                "emotion_session_id": conn.emotion_session_id,
+                **result,
+            }
+            if settings.server_timing_enabled:
+                # No per-message headers on a WebSocket; same stages as Server-Timing
+                reply["server_timing"] = frame_trace.as_dict()
+            async with conn.send_lock:
+                await websocket.send_json(reply)
+            job = emotion_stage.get((result.get("emotion_detection") or {}).get("job_id"))
+            if job is not None and job.status == PENDING:
+                push = asyncio.create_task(_push_emotion(websocket, conn, job, header.get("seq")))
+                conn.pushes.add(push)
+                push.add_done_callback(conn.pushes.discard)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for push in list(conn.pushes):
+            push.cancel()
+        track_cache.drop(conn.camera_key)
@@ -2,13 +2,20 @@
 """
 Startup script for the Face Recognition Attendance System
 Handles initialization and startup gracefully for container environments
+
+Only cheap work (directories, database tables) runs before the app starts
+serving; models are imported, loaded and warmed up in parallel background
+threads so /health answers immediately on a cold start.
 """
 
-import os
 import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from utils.readiness import readiness
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,52 +27,97 @@ def ensure_directories():
         uploads_dir = Path("uploads")
         uploads_dir.mkdir(exist_ok=True)
         logger.info(f"Uploads directory ready: {uploads_dir.absolute()}")
-        
+
         # Create logs directory if needed
         logs_dir = Path("logs")
         logs_dir.mkdir(exist_ok=True)
         logger.info(f"Logs directory ready: {logs_dir.absolute()}")
-        
+
     except Exception as e:
         logger.error(f"Failed to create directories: {e}")
         raise
 
-def wait_for_dependencies():
-    """Wait for any external dependencies to be ready"""
-    # Add any dependency checks here if needed
-    # For now, just a small delay to ensure system is ready
-    time.sleep(1)
-    logger.info("Dependencies check completed")
+def _warm_up_group(group, warmup):
+    """Run one warm-up function (which imports its heavy modules) and record timings."""
+    try:
+        for name, (load_seconds, warmup_seconds) in warmup().items():
+            readiness.record(name, load_seconds, warmup_seconds)
+            logger.info(f"Model {name}: loaded in {load_seconds:.2f}s, warmed up in {warmup_seconds:.2f}s")
+    except Exception as e:
+        logger.error(f"Warm-up of {group} models failed: {e}")
+        readiness.record(group, 0.0, 0.0, error=str(e))
+
+def _import_recognition():
+    from models.face_recognition import warmup_models
+    return warmup_models()
+
+def _import_emotion():
+    from models.emotion_detection import warmup_emotion_models
+    return warmup_emotion_models()
+
+def warm_up_models():
+    """Load every model and run a synthetic frame through each inference path.
+
+    Recognition and emotion models load in parallel. Marks the service ready
+    when every model warmed up, so /ready keeps returning 503 until the first
+    real request no longer pays for weight loading or graph tracing. If any
+    model failed, the service never becomes ready and /ready reports the
+    errors.
+    """
+    start = time.perf_counter()
+    groups = (("recognition", _import_recognition), ("emotion", _import_emotion))
+    with ThreadPoolExecutor(max_workers=len(groups), thread_name_prefix="model-load") as pool:
+        for future in [pool.submit(_warm_up_group, group, warmup) for group, warmup in groups]:
+            future.result()
+    readiness.record_phase("models", time.perf_counter() - start)
+    if not readiness.finish():
+        logger.error(f"Service not ready, model warm-up failed: {readiness.errors()}")
+    log_startup_report()
+
+def log_startup_report():
+    report = readiness.report()
+    phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in report["startup"].items())
+    models = ", ".join(
+        f"{name} {info['load_seconds'] + info['warmup_seconds']:.2f}s" + (" (failed)" if info["error"] else "")
+        for name, info in report["models"].items()
+    )
+    logger.info(f"Startup timing: {phases}; models: {models}; ready after {report['elapsed_seconds']:.2f}s")
 
 def main():
     """Main startup function"""
     try:
         logger.info("Starting Face Recognition Attendance System...")
-        
+
         # Ensure directories exist
+        start = time.perf_counter()
         ensure_directories()
-        
-        # Wait for dependencies
-        wait_for_dependencies()
-        
+        readiness.record_phase("directories", time.perf_counter() - start)
+
         # Import and initialize database
-        from db import init_db
+        start = time.perf_counter()
+        from db import SessionLocal, init_db
         init_db()
-        logger.info("Database initialized successfully")
-        
-        # Import and initialize face recognition
+        # Stored embeddings may come from a model a re-embedding job switched to
+        from models.reembed import apply_switched_version
+        db = SessionLocal()
         try:
-            from models.face_recognition import FaceRecognitionModel
-            model = FaceRecognitionModel()
-            logger.info("Face recognition model loaded successfully")
-        except Exception as e:
-            logger.warning(f"Face recognition model not loaded: {e}")
-        
-        logger.info("Startup completed successfully")
-        
+            apply_switched_version(db)
+        finally:
+            db.close()
+        readiness.record_phase("database", time.perf_counter() - start)
+        logger.info("Database initialized successfully")
+
+        # Load and warm up models in the background; /ready reports 503 until done
+        threading.Thread(target=warm_up_models, name="model-warmup", daemon=True).start()
+        logger.info("Startup completed successfully, models loading in background")
+
     except Exception as e:
         logger.error(f"Startup failed: {e}")
         raise
 
 if __name__ == "__main__":
     main()
+    # Keep the process alive until models are warm when run standalone
+    while not readiness.finished:
+        time.sleep(0.1)
+    raise SystemExit(0 if readiness.ready else 1)
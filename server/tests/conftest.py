@@ -0,0 +1,31 @@
+"""Test setup: the server modules on the path and a throwaway database.
+
+Settings are read at import, so the environment is set before any server
+module is imported. TEST_DATABASE_URL runs the tests against another
+database (e.g. PostgreSQL); by default they use a temporary SQLite file.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVER_DIR))
+
+_workdir = tempfile.mkdtemp(prefix="presensense-tests-")
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL", f"sqlite:///{_workdir}/test.db")
+os.environ["UPLOADS_DIR"] = os.path.join(_workdir, "uploads")
+os.environ.setdefault("GCP_BUCKET_NAME", "")
+
+
+@pytest.fixture
+def database():
+    """Fresh tables for one test."""
+    from db import Base, engine, init_db
+
+    Base.metadata.drop_all(bind=engine)
+    init_db()
+    yield engine
+    engine.dispose()
@@ -0,0 +1,67 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from config import settings
+from db import Attendance, SessionLocal, User, dedup_bucket
+from routes.match import _insert_attendance, _record_attendance_at
+
+WINDOW = timedelta(seconds=settings.attendance_dedup_seconds)
+# Two seconds before a bucket boundary
+BOUNDARY = datetime(2026, 1, 1, 10, 5, 0)
+BEFORE = BOUNDARY - timedelta(seconds=2)
+AFTER = BOUNDARY + timedelta(seconds=1)
+
+
+def _add_users(*user_ids):
+    with SessionLocal() as db:
+        db.add_all([User(id=user_id, name=f"user {user_id}", face_image_url="", face_embedding=b"") for user_id in user_ids])
+        db.commit()
+
+
+def _attendance(user_id):
+    with SessionLocal() as db:
+        return [row.timestamp for row in db.query(Attendance).filter(Attendance.user_id == user_id).order_by(Attendance.timestamp)]
+
+
+def test_buckets_straddle_boundary():
+    assert dedup_bucket(AFTER) == dedup_bucket(BEFORE) + 1
+
+
+def test_later_row_in_next_bucket_dedups(database):
+    _add_users(1)
+    with SessionLocal() as db:
+        assert _insert_attendance(db, [(1, AFTER)])
+        assert _insert_attendance(db, [(1, BEFORE)]) == []
+        assert _insert_attendance(db, [(1, AFTER + WINDOW)])
+    assert _attendance(1) == [AFTER, AFTER + WINDOW]
+
+
+def test_concurrent_inserts_across_bucket_boundary(database):
+    _add_users(1)
+    threads = 16
+    barrier = threading.Barrier(threads)
+
+    def insert(i):
+        with SessionLocal() as db:
+            barrier.wait()
+            return len(_insert_attendance(db, [(1, BEFORE if i % 2 else AFTER)]))
+
+    with ThreadPoolExecutor(threads) as pool:
+        assert sum(pool.map(insert, range(threads))) == 1
+    assert len(_attendance(1)) == 1
+
+
+def test_record_attendance_at_dedups_within_batch_and_stored(database):
+    _add_users(1, 2)
+    with SessionLocal() as db:
+        _insert_attendance(db, [(2, AFTER)])
+        created = _record_attendance_at(db, [
+            (1, AFTER),
+            (1, BEFORE),
+            (2, BEFORE),
+            (1, BEFORE + WINDOW),
+        ])
+    assert created == {1, 3}
+    assert _attendance(1) == [BEFORE, BEFORE + WINDOW]
+    assert _attendance(2) == [AFTER]
@@ -0,0 +1,75 @@
+"""Converted backends against DeepFace (see `benchmarks/parity.py`).
+
+Skipped unless DeepFace is installed and the converted weights are in
+MODEL_DIR (`python -m models.backends.convert`). With PARITY_PHOTOS set to a
+directory of labelled photos (`<person>/*.jpg`) the full parity check runs
+on them as well.
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from config import settings
+from models.backends import create_backend
+from models.backends.lite_backend import model_path
+from models.gallery import normalize_rows
+from utils.readiness import synthetic_frame
+
+pytest.importorskip("deepface")
+
+# Minimum cosine similarity to DeepFace's embedding of the same face
+BACKENDS = [
+    ("onnx", "none", 0.99),
+    ("tflite", "none", 0.99),
+    ("onnx", "int8", 0.95),
+    ("tflite", "int8", 0.95),
+]
+
+
+def _faces():
+    """Face crops as `detect_faces` returns them (RGB, 0-1), so both backends embed the same pixels."""
+    rng = np.random.default_rng(1)
+    frame = synthetic_frame()[:, :, ::-1].astype(np.float32) / 255
+    noise = [rng.random((160, 160, 3), dtype=np.float32) for _ in range(3)]
+    return [frame, frame[40:200, 80:240]] + noise
+
+
+@pytest.fixture(scope="module")
+def reference():
+    return create_backend("deepface")
+
+
+def _candidate(runtime, quantization):
+    if not model_path(settings.model_dir, "facenet", runtime, quantization).exists():
+        pytest.skip(f"No converted {runtime} {quantization} weights in {settings.model_dir}")
+    backend = create_backend(runtime, quantization)
+    try:
+        backend.warmup_recognition()
+    except RuntimeError as e:
+        # e.g. no TFLite interpreter installed
+        pytest.skip(str(e))
+    return backend
+
+
+@pytest.mark.parametrize("runtime, quantization, min_similarity", BACKENDS)
+def test_embeddings_match_deepface(reference, runtime, quantization, min_similarity):
+    candidate = _candidate(runtime, quantization)
+    faces = _faces()
+    expected = normalize_rows(reference.embed_faces(faces))
+    actual = normalize_rows(candidate.embed_faces(faces))
+    similarities = np.sum(expected * actual, axis=1)
+    assert similarities.min() >= min_similarity, similarities
+
+
+@pytest.mark.skipif(not os.getenv("PARITY_PHOTOS"), reason="PARITY_PHOTOS not set")
+@pytest.mark.parametrize("runtime, quantization, min_similarity", BACKENDS)
+def test_parity_on_photos(reference, runtime, quantization, min_similarity):
+    from benchmarks import parity
+
+    candidate = _candidate(runtime, quantization)
+    report = parity.run(parity.load_photos(Path(os.environ["PARITY_PHOTOS"])), reference, candidate)
+    # The converted backends detect faces without DeepFace's alignment, hence the lower bar
+    assert report["similarity"]["mean"] >= min(min_similarity, 0.95)
+    assert report["decision_agreement"] >= 0.98
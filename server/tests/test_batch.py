@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from config import settings
+from db import Attendance, SessionLocal, User
+from models.face_recognition import EMBEDDING_DIM, embedding_to_bytes
+from routes import match
+from routes.match import _parse_captured_at
+
+NOW = datetime(2026, 10, 19, 9, 0, 0)
+
+
+def _embedding(axis):
+    embedding = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    embedding[axis] = 1.0
+    return embedding
+
+
+# Frame contents the fake model recognizes: one face of user 1 or 2, or none
+FACES = {b"user 1": [_embedding(0)], b"user 2": [_embedding(1)], b"nobody": []}
+
+
+@pytest.fixture
+def client(database, monkeypatch):
+    with SessionLocal() as db:
+        db.add_all([
+            User(id=user_id, name=f"user {user_id}", face_image_url="", face_embedding=embedding_to_bytes(_embedding(user_id - 1)))
+            for user_id in (1, 2)
+        ])
+        db.commit()
+
+    chunks = []
+
+    def extract_face_embeddings_many(images, batch_size):
+        chunks.append(len(images))
+        return [{"faces": [{"embedding": e} for e in FACES[image]], "error": None} for image in images]
+
+    monkeypatch.setattr(match, "extract_face_embeddings_many", extract_face_embeddings_many)
+    monkeypatch.setattr(settings, "embedding_batch_size", 2)
+    app = FastAPI()
+    app.include_router(match.router, prefix="/match")
+    with TestClient(app) as client:
+        client.chunks = chunks
+        yield client
+
+
+def _replay(client, frames):
+    return client.post(
+        "/match/batch",
+        files=[("files", (f"{i}.jpg", content, "image/jpeg")) for i, (content, _) in enumerate(frames)],
+        data={"captured_at": [captured_at for _, captured_at in frames]},
+    )
+
+
+def test_batch_embeds_in_chunks_and_dedups(client):
+    start = datetime.utcnow() - timedelta(hours=1)
+    response = _replay(client, [
+        (b"user 1", start.isoformat()),
+        (b"user 1", (start + timedelta(seconds=30)).isoformat()),
+        (b"user 2", start.isoformat()),
+        (b"nobody", start.isoformat()),
+        (b"user 2", (start + timedelta(seconds=settings.attendance_dedup_seconds + 1)).isoformat()),
+    ])
+    assert response.status_code == 200
+    body = response.json()
+    assert client.chunks == [2, 2, 1]
+    assert [f["user_id"] for f in body["frames"]] == [1, 1, 2, None, 2]
+    assert [f["created"] for f in body["frames"]] == [True, False, True, False, True]
+    assert body["frames"][3]["error"] == "No face detected"
+    assert (body["recognized"], body["attendance_created"], body["errors"]) == (4, 3, 1)
+    with SessionLocal() as db:
+        assert db.query(Attendance).count() == 3
+
+
+def test_batch_reports_bad_timestamps_per_frame(client):
+    future = datetime.utcnow() + timedelta(seconds=settings.batch_max_clock_skew_seconds + 60)
+    response = _replay(client, [(b"user 1", future.isoformat()), (b"user 2", "yesterday")])
+    assert response.status_code == 200
+    frames = response.json()["frames"]
+    assert frames[0]["error"] == "Invalid captured_at: Capture time is in the future"
+    assert frames[1]["error"].startswith("Invalid captured_at")
+    # Neither frame reached the model
+    assert client.chunks == []
+
+
+def test_batch_needs_one_captured_at_per_file(client):
+    response = _replay(client, [(b"user 1", NOW.isoformat()), (b"user 2", "")])
+    assert response.status_code == 200
+    response = client.post(
+        "/match/batch",
+        files=[("files", ("0.jpg", b"user 1", "image/jpeg")), ("files", ("1.jpg", b"user 2", "image/jpeg"))],
+        data={"captured_at": [NOW.isoformat()]},
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("value, expected", [
+    (None, NOW),
+    ("", NOW),
+    ("2026-10-19T08:30:00", datetime(2026, 10, 19, 8, 30)),
+    ("2026-10-19T08:30:00Z", datetime(2026, 10, 19, 8, 30)),
+    ("2026-10-19T10:30:00+02:00", datetime(2026, 10, 19, 8, 30)),
+    # Within the allowed clock skew
+    ((NOW + timedelta(seconds=settings.batch_max_clock_skew_seconds)).isoformat(), NOW + timedelta(seconds=settings.batch_max_clock_skew_seconds)),
+])
+def test_parse_captured_at(value, expected):
+    assert _parse_captured_at(value, NOW) == expected
+
+
+@pytest.mark.parametrize("value", [
+    (NOW + timedelta(seconds=settings.batch_max_clock_skew_seconds + 1)).isoformat(),
+    "2026-10-19T11:00:00+01:00",
+    "not a time",
+])
+def test_parse_captured_at_rejects(value):
+    with pytest.raises(ValueError):
+        _parse_captured_at(value, NOW)
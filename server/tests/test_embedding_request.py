@@ -0,0 +1,67 @@
+import base64
+import json
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from config import settings
+from models.face_recognition import EMBEDDING_DIM, EMBEDDING_MODEL, embeddings_from_bytes
+from routes.match import _parse_embedding_request
+
+EMBEDDINGS = np.arange(2 * EMBEDDING_DIM, dtype=np.float32).reshape(2, EMBEDDING_DIM)
+RAW = EMBEDDINGS.astype("<f4").tobytes()
+OCTET = "application/octet-stream"
+
+
+def _json(**fields):
+    payload = {"model": EMBEDDING_MODEL, "model_version": settings.embedding_model_version}
+    payload.update(fields)
+    return json.dumps(payload).encode()
+
+
+def test_embeddings_from_bytes():
+    np.testing.assert_array_equal(embeddings_from_bytes(RAW), EMBEDDINGS)
+    for blob in (b"", RAW[:-4], np.full(EMBEDDING_DIM, np.nan, dtype="<f4").tobytes()):
+        with pytest.raises(ValueError):
+            embeddings_from_bytes(blob)
+
+
+def test_raw_body_with_model_in_query():
+    parsed = _parse_embedding_request(RAW, OCTET, EMBEDDING_MODEL.lower(), settings.embedding_model_version)
+    np.testing.assert_array_equal(parsed, EMBEDDINGS)
+
+
+def test_json_body_with_base64_embeddings():
+    encoded = [base64.b64encode(row.astype("<f4").tobytes()).decode() for row in EMBEDDINGS]
+    np.testing.assert_array_equal(_parse_embedding_request(_json(embeddings=encoded), "application/json", None, None), EMBEDDINGS)
+    # A single string is one embedding
+    parsed = _parse_embedding_request(_json(embeddings=encoded[0]), "application/json; charset=utf-8", None, None)
+    np.testing.assert_array_equal(parsed, EMBEDDINGS[:1])
+
+
+@pytest.mark.parametrize("model, version", [
+    (None, None),
+    ("ArcFace", None),
+    (EMBEDDING_MODEL, None),
+    (EMBEDDING_MODEL, "older-model-version"),
+])
+def test_model_version_mismatch_is_rejected(model, version):
+    with pytest.raises(ValueError, match="Incompatible embedding model"):
+        _parse_embedding_request(RAW, OCTET, model, version)
+    encoded = base64.b64encode(RAW).decode()
+    with pytest.raises(ValueError, match="Incompatible embedding model"):
+        _parse_embedding_request(_json(model=model, model_version=version, embeddings=[encoded]), "application/json", None, None)
+
+
+@pytest.mark.parametrize("body", [b"not json", b'{"model": "Facenet"}', b'{"embeddings": ["@@"]}', b"[]"])
+def test_malformed_json_is_rejected(body):
+    with pytest.raises(ValueError, match="Expected JSON"):
+        _parse_embedding_request(body, "application/json", None, None)
+
+
+def test_too_many_embeddings(monkeypatch):
+    monkeypatch.setattr(settings, "batch_max_frames", 1)
+    with pytest.raises(HTTPException) as too_many:
+        _parse_embedding_request(RAW, OCTET, EMBEDDING_MODEL, settings.embedding_model_version)
+    assert too_many.value.status_code == 413
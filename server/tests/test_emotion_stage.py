@@ -0,0 +1,35 @@
+import asyncio
+
+from utils.emotion_stage import DROPPED, PENDING, EmotionStage
+
+
+def test_max_jobs_enforced_behind_a_pending_job():
+    async def run():
+        release = asyncio.Event()
+
+        async def analyze(content):
+            await release.wait()
+            return {"success": False}
+
+        async def store(user_id, result):
+            return 1
+
+        stage = EmotionStage(analyze, store, workers=1, max_queue=1, max_wait=60, ttl=60, max_jobs=5)
+        head = stage.submit("cam", None, b"head")
+        await asyncio.sleep(0)  # the worker takes the head and blocks on it
+        queued = stage.submit("cam", None, b"queued")
+        dropped = [stage.submit("cam", None, b"frame") for _ in range(20)]
+
+        assert head.status == queued.status == PENDING
+        assert all(job.status == DROPPED for job in dropped)
+        assert len(stage._jobs) <= stage.max_jobs + 1
+        # Pending jobs are never evicted, the newest finished ones are kept
+        assert stage.get(head.id) is head and stage.get(queued.id) is queued
+        assert stage.get(dropped[-1].id) is dropped[-1]
+        assert stage.get(dropped[0].id) is None
+
+        release.set()
+        await stage.wait(queued, 1)
+        await stage.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from routes.match import _camera_key, _frame_signature
+from utils import frame_cache as caching
+from utils.frame_cache import FrameCache
+
+RESULT = {"user_id": 1, "score": 0.9}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(caching.time, "monotonic", clock)
+    return clock
+
+
+def _signature(level):
+    return np.full((32, 32), level, dtype=np.float32)
+
+
+def test_unchanged_frame_hits_and_changed_frame_misses(clock):
+    cache = FrameCache(threshold=0.05, max_age=10)
+    assert cache.lookup("stream", "cam", _signature(0.5)) is None
+    cache.store("stream", "cam", _signature(0.5), RESULT)
+
+    assert cache.lookup("stream", "cam", _signature(0.52)) == dict(RESULT, cached=True)
+    assert cache.lookup("stream", "cam", _signature(0.6)) is None
+    # Per camera and per pipeline
+    assert cache.lookup("stream", "other", _signature(0.5)) is None
+    assert cache.lookup("with-emotion", "cam", _signature(0.5)) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 4)
+
+
+def test_results_expire_after_max_age(clock):
+    cache = FrameCache(threshold=0.05, max_age=10)
+    cache.store("stream", "cam", _signature(0.5), RESULT)
+    clock.now += 10
+    assert cache.lookup("stream", "cam", _signature(0.5)) is not None
+    clock.now += 0.1
+    assert cache.lookup("stream", "cam", _signature(0.5)) is None
+
+
+def test_least_recently_used_camera_is_evicted():
+    cache = FrameCache(threshold=0.05, max_age=10, max_entries=2)
+    for camera in ("a", "b"):
+        cache.store("stream", camera, _signature(0.5), RESULT)
+    assert cache.lookup("stream", "a", _signature(0.5)) is not None
+    cache.store("stream", "c", _signature(0.5), RESULT)
+    assert cache.lookup("stream", "b", _signature(0.5)) is None
+    assert cache.lookup("stream", "a", _signature(0.5)) is not None
+
+
+def test_frames_without_camera_id_are_not_cached():
+    assert _camera_key("kiosk-1") == "kiosk-1"
+    assert _camera_key(None) is None and _camera_key("  ") is None
+    assert _frame_signature(None, b"any frame") is None
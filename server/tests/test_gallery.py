@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from models.gallery import best_matches, build_gallery, top_k_matches, user_scores
+
+NAMES = {1: "one", 2: "two", 3: "three"}
+
+
+def _gallery():
+    rng = np.random.default_rng(0)
+    # Interleaved template rows: user 1 has three, user 2 one, user 3 two
+    row_user_ids = np.array([1, 3, 2, 1, 3, 1])
+    return build_gallery(row_user_ids, rng.normal(size=(len(row_user_ids), 16)), NAMES)
+
+
+def test_user_scores_take_the_best_template_of_each_user():
+    gallery = _gallery()
+    assert list(gallery.user_ids) == [1, 2, 3] and list(gallery.segments) == [0, 3, 4]
+    assert list(gallery.row_user_ids()) == [1, 1, 1, 2, 3, 3]
+
+    queries = np.random.default_rng(1).normal(size=(5, 16))
+    scores = user_scores(gallery, queries)
+    rows = (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ gallery.matrix.T
+    expected = np.stack([rows[:, gallery.row_user_ids() == u].max(axis=1) for u in gallery.user_ids], axis=1)
+    np.testing.assert_allclose(scores, expected, rtol=1e-5)
+
+
+def test_best_and_top_k_agree_with_user_scores():
+    gallery = _gallery()
+    queries = np.random.default_rng(2).normal(size=(5, 16))
+    scores = user_scores(gallery, queries)
+    for query, best, top in zip(scores, best_matches(gallery, queries), top_k_matches(gallery, queries, 3)):
+        assert best.id == gallery.user_ids[np.argmax(query)]
+        assert best.score == pytest.approx(top[0].score)
+        assert [m.id for m in top] == list(gallery.user_ids[np.argsort(-query)])
+
+
+def test_query_equal_to_a_secondary_template_matches_its_user():
+    gallery = _gallery()
+    # Third template of user 1 (last row of its segment)
+    match = best_matches(gallery, gallery.matrix[2])[0]
+    assert (match.id, match.name) == (1, "one")
+    assert abs(match.score - 1.0) < 1e-5
+
+
+def test_single_template_gallery_has_no_segments():
+    gallery = build_gallery(np.array([2, 1]), np.eye(2, 4), NAMES)
+    assert gallery.segments is None
+    np.testing.assert_allclose(user_scores(gallery, np.eye(2, 4)), [[0, 1], [1, 0]])
@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from utils import inference
+from utils.inference import BATCH, EMOTION, ENROLL, LIVE, InferenceScheduler, RequestClass
+
+
+def _scheduler(workers, deadline=0.2):
+    return InferenceScheduler(workers, [
+        RequestClass(LIVE, 0, workers, deadline),
+        RequestClass(EMOTION, 1, 1, deadline),
+        RequestClass(ENROLL, 2, 1, deadline),
+        RequestClass(BATCH, 3, 1, 5),
+    ])
+
+
+def test_live_admitted_while_a_long_batch_job_runs(monkeypatch):
+    async def run():
+        scheduler = _scheduler(2)
+        monkeypatch.setattr(inference, "scheduler", scheduler)
+        release = asyncio.Event()
+
+        async def batch():
+            await scheduler.acquire(BATCH)
+            try:
+                await release.wait()
+            finally:
+                scheduler.release(BATCH)
+
+        job = asyncio.create_task(batch())
+        await asyncio.sleep(0)
+        start = time.monotonic()
+        assert await inference.run_inference(lambda: "live") == "live"
+        assert time.monotonic() - start < scheduler.classes[LIVE].deadline
+
+        # The other worker stays reserved: background work queues behind the batch job
+        with pytest.raises(HTTPException) as busy:
+            await scheduler.acquire(ENROLL)
+        assert busy.value.status_code == 503
+        release.set()
+        await job
+
+    asyncio.run(run())
+
+
+def test_freed_worker_goes_to_the_highest_priority_waiter():
+    async def run():
+        scheduler = _scheduler(1, deadline=1)
+        await scheduler.acquire(ENROLL)
+        order = []
+
+        async def wait(name):
+            await scheduler.acquire(name)
+            order.append(name)
+            scheduler.release(name)
+
+        waiters = [asyncio.create_task(wait(name)) for name in (EMOTION, LIVE)]
+        await asyncio.sleep(0)
+        scheduler.release(ENROLL)
+        await asyncio.gather(*waiters)
+        assert order == [LIVE, EMOTION]
+
+    asyncio.run(run())
+
+
+def test_request_past_its_deadline_gets_503():
+    async def run():
+        scheduler = _scheduler(1, deadline=0.05)
+        await scheduler.acquire(BATCH)
+        with pytest.raises(HTTPException) as busy:
+            await scheduler.acquire(LIVE)
+        assert busy.value.status_code == 503
+        assert busy.value.headers["Retry-After"] == "1"
+        assert scheduler.queued(LIVE) == 0
+        scheduler.release(BATCH)
+        assert scheduler.depth() == 0
+
+    asyncio.run(run())
@@ -0,0 +1,89 @@
+import threading
+
+import numpy as np
+import pytest
+
+from utils import inference_cache as caching
+from utils.inference_cache import InferenceCache, _sizeof
+
+VALUE = np.zeros(1000, dtype=np.float32)
+# Room for two entries of VALUE
+TWO_ENTRIES = 2 * (_sizeof(VALUE) + 200) + 10
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = InferenceCache(max_bytes=TWO_ENTRIES, ttl=60)
+    cache.store("faces", b"a", VALUE)
+    cache.store("faces", b"b", VALUE)
+    assert cache.lookup("faces", b"a") is not None
+    cache.store("faces", b"c", VALUE)
+
+    assert cache.lookup("faces", b"b") is None
+    assert cache.lookup("faces", b"a") is not None and cache.lookup("faces", b"c") is not None
+    stats = cache.stats()
+    assert (stats["entries"], stats["evictions"]) == (2, 1)
+    assert stats["bytes"] <= TWO_ENTRIES
+    # Larger than the whole cache: not stored at all
+    cache.store("faces", b"d", np.zeros(10000, dtype=np.float32))
+    assert cache.lookup("faces", b"d") is None and cache.stats()["entries"] == 2
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(caching.time, "monotonic", clock)
+    cache = InferenceCache(max_bytes=TWO_ENTRIES, ttl=60)
+    cache.store("faces", b"a", VALUE)
+    clock.now += 60
+    assert cache.lookup("faces", b"a") is not None
+    clock.now += 1
+    assert cache.lookup("faces", b"a") is None
+    assert cache.stats()["bytes"] == 0
+
+
+def test_results_are_keyed_by_kind_and_content_and_copied():
+    cache = InferenceCache(max_bytes=TWO_ENTRIES, ttl=60)
+    cache.store("faces", b"a", {"faces": [1]})
+    assert cache.lookup("emotion", b"a") is None
+    result = cache.lookup("faces", b"a")
+    result["faces"].append(2)
+    assert cache.lookup("faces", b"a") == {"faces": [1]}
+
+
+def test_value_errors_are_cached_and_concurrent_misses_compute_once():
+    cache = InferenceCache(max_bytes=TWO_ENTRIES, ttl=60)
+    calls = []
+
+    def no_face():
+        calls.append(1)
+        raise ValueError("No face detected")
+
+    for _ in range(2):
+        with pytest.raises(ValueError, match="No face detected"):
+            cache.get_or_compute("faces", b"blank", no_face)
+    assert len(calls) == 1
+
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return VALUE
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("faces", b"frame", slow))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    assert started.wait(5)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(results) == 4 and len(calls) == 2
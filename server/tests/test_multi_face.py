@@ -0,0 +1,44 @@
+import asyncio
+
+import numpy as np
+
+from db import AsyncSessionLocal, Attendance, SessionLocal, User
+from models.face_recognition import EMBEDDING_DIM, embedding_to_bytes
+from routes.match import _recognize_embeddings
+
+
+def _embedding(*weights):
+    embedding = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    embedding[:len(weights)] = weights
+    return embedding
+
+
+def _recognize(embeddings):
+    async def run():
+        async with AsyncSessionLocal() as db:
+            return await _recognize_embeddings(db, np.stack(embeddings))
+
+    return asyncio.run(run())
+
+
+def test_every_recognized_face_gets_one_attendance_row(database):
+    with SessionLocal() as db:
+        db.add_all([
+            User(id=1, name="user 1", face_image_url="", face_embedding=embedding_to_bytes(_embedding(1))),
+            User(id=2, name="user 2", face_image_url="", face_embedding=embedding_to_bytes(_embedding(0, 1))),
+        ])
+        db.commit()
+
+    faces = [_embedding(1, 0.2), _embedding(0, 1), _embedding(1), _embedding(0, 0, 1)]
+    results = _recognize(faces)
+    # The same person twice in a frame: only their best face is recognized
+    assert [r["user_id"] for r in results] == [None, 2, 1, None]
+    assert [r["created"] for r in results] == [False, True, True, False]
+    assert results[0]["score"] > 0.9 and results[3]["score"] < 0.1
+
+    # Within the dedup window, nobody gets a second row
+    results = _recognize(faces)
+    assert [r["user_id"] for r in results] == [None, 2, 1, None]
+    assert not any(r["created"] for r in results)
+    with SessionLocal() as db:
+        assert sorted(a.user_id for a in db.query(Attendance)) == [1, 2]
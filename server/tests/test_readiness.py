@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+import main
+import startup
+from utils.readiness import Readiness
+
+
+@pytest.fixture
+def readiness(monkeypatch):
+    fresh = Readiness()
+    monkeypatch.setattr(startup, "readiness", fresh)
+    monkeypatch.setattr(main, "readiness", fresh)
+    monkeypatch.setattr(startup, "_import_recognition", lambda: {"facenet": (0.1, 0.2)})
+    return fresh
+
+
+def test_ready_after_every_model_warmed_up(readiness, monkeypatch, database):
+    monkeypatch.setattr(startup, "_import_emotion", lambda: {"emotion": (0.1, 0.1)})
+    startup.warm_up_models()
+    assert readiness.ready
+    assert main.readiness_probe()["status"] == "ready"
+
+
+def test_failed_warm_up_is_not_ready(readiness, monkeypatch):
+    def fail():
+        raise RuntimeError("emotion weights missing")
+
+    monkeypatch.setattr(startup, "_import_emotion", fail)
+    startup.warm_up_models()
+    assert readiness.finished and not readiness.ready
+
+    response = main.readiness_probe()
+    body = json.loads(response.body)
+    assert response.status_code == 503
+    assert body["status"] == "warmup_failed"
+    assert body["errors"] == {"emotion": "emotion weights missing"}
+    assert body["models"]["facenet"]["error"] is None
@@ -0,0 +1,80 @@
+import threading
+
+import numpy as np
+import pytest
+
+from config import settings
+from db import EmbeddingVersion, FaceTemplate, ReembedJob, SessionLocal, User
+from models.face_recognition import EMBEDDING_DIM, bytes_to_embedding, embedding_to_bytes
+from models.reembed import ReembedConflict, ReembedRunner
+
+
+def test_switch_waits_for_enrollments_and_holds_off_new_ones():
+    runner = ReembedRunner()
+    runner.begin_enrollment()
+    entered, leave = threading.Event(), threading.Event()
+
+    def switch():
+        with runner._enrollments_held():
+            entered.set()
+            leave.wait(5)
+
+    thread = threading.Thread(target=switch)
+    thread.start()
+    # The enrollment in progress keeps the switch waiting
+    assert not entered.wait(0.2)
+    with pytest.raises(ReembedConflict):
+        runner.begin_enrollment()
+
+    runner.end_enrollment()
+    assert entered.wait(5)
+    with pytest.raises(ReembedConflict):
+        runner.begin_enrollment()
+
+    leave.set()
+    thread.join(5)
+    runner.begin_enrollment()
+    runner.end_enrollment()
+
+
+def _ready_job(db):
+    db.add(User(id=1, name="user 1", face_image_url="u1.jpg", face_embedding=embedding_to_bytes(np.ones(EMBEDDING_DIM, dtype=np.float32))))
+    db.add(FaceTemplate(id=5, user_id=1, embedding=embedding_to_bytes(np.ones(EMBEDDING_DIM, dtype=np.float32)), face_image_url="t5.jpg"))
+    job = ReembedJob(version="v2", backend="onnx", quantization="none", status="ready", user_cursor=1, users_done=1, images_done=1, images_failed=1)
+    db.add(job)
+    db.flush()
+    new = embedding_to_bytes(np.full(EMBEDDING_DIM, 2, dtype=np.float32))
+    db.add_all([
+        EmbeddingVersion(job_id=job.id, version="v2", user_id=1, template_id=None, face_image_url="u1.jpg", embedding=new),
+        EmbeddingVersion(job_id=job.id, version="v2", user_id=1, template_id=5, face_image_url="t5.jpg", error="ValueError: no face"),
+    ])
+    db.commit()
+    return job
+
+
+def test_forced_switch_keeps_and_reports_failed_images(database):
+    with SessionLocal() as db:
+        job = _ready_job(db)
+        with pytest.raises(ReembedConflict):
+            ReembedRunner()._switch_embeddings(db, job, None, None, force=False)
+        db.rollback()
+
+        result = ReembedRunner()._switch_embeddings(db, job, None, None, force=True)
+        assert (result["users_updated"], result["templates_disabled"]) == (1, 1)
+        assert result["failures"] == [
+            {"user_id": 1, "template_id": 5, "face_image_url": "t5.jpg", "error": "ValueError: no face"}
+        ]
+        # The template stays, with an embedding that never matches
+        template = db.get(FaceTemplate, 5)
+        assert not bytes_to_embedding(template.embedding).any()
+        assert db.get(ReembedJob, job.id).status == "completed"
+
+
+def test_switch_refused_with_several_processes(database, monkeypatch):
+    monkeypatch.setattr(settings, "web_concurrency", 2)
+    with SessionLocal() as db:
+        job_id = _ready_job(db).id
+    with pytest.raises(ReembedConflict, match="WEB_CONCURRENCY=2"):
+        ReembedRunner().switch(job_id)
+    with SessionLocal() as db:
+        assert db.get(ReembedJob, job_id).status == "ready"
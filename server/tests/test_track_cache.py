@@ -0,0 +1,101 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from db import Attendance, AsyncSessionLocal, FaceTemplate, SessionLocal, User
+from models.face_recognition import EMBEDDING_DIM, embedding_to_bytes
+from routes import match
+from utils import track_cache as tracking
+from utils.track_cache import TrackCache, box_iou
+
+BOX = (100, 100, 80, 80)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(tracking.time, "monotonic", clock)
+    return clock
+
+
+def test_box_iou():
+    assert box_iou(BOX, BOX) == 1.0
+    assert box_iou(BOX, (300, 300, 80, 80)) == 0.0
+    assert box_iou((0, 0, 10, 10), (5, 0, 10, 10)) == pytest.approx(50 / 150)
+
+
+def test_track_follows_overlapping_boxes_until_it_breaks(clock):
+    cache = TrackCache(iou_threshold=0.5, reverify_seconds=30, ttl_seconds=10)
+    assert cache.follow("cam", BOX) is None
+    cache.start("cam", 7, 0.9, BOX)
+
+    track = cache.follow("cam", (105, 100, 80, 80))
+    assert track is not None and track.user_id == 7
+    # Overlap is measured against the last box, so a slow drift keeps the track
+    assert cache.follow("cam", (115, 100, 80, 80)) is track
+    assert cache.follow("other", BOX) is None
+
+    assert cache.follow("cam", (300, 300, 80, 80)) is None
+    assert cache.follow("cam", (115, 100, 80, 80)) is None
+    assert cache.stats()["broken"] == 1
+
+
+def test_track_expires_and_needs_reverify(clock):
+    cache = TrackCache(iou_threshold=0.5, reverify_seconds=30, ttl_seconds=10)
+    cache.start("cam", 7, 0.9, BOX)
+    for _ in range(4):
+        clock.now += 8
+        track = cache.follow("cam", BOX)
+        assert track is not None
+    assert cache.needs_reverify(track)
+    cache.reverify(track, 0.8)
+    assert not cache.needs_reverify(track) and track.score == 0.8
+
+    clock.now += 11
+    assert cache.follow("cam", BOX) is None
+
+
+def _embedding(axis):
+    embedding = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    embedding[axis] = 1.0
+    return embedding
+
+
+def test_tracked_frames_reverify_against_every_template(database, monkeypatch):
+    with SessionLocal() as db:
+        db.add(User(id=1, name="user 1", face_image_url="", face_embedding=embedding_to_bytes(_embedding(0))))
+        db.add(FaceTemplate(user_id=1, embedding=embedding_to_bytes(_embedding(1)), face_image_url=""))
+        db.commit()
+
+    cache = TrackCache(iou_threshold=0.5, reverify_seconds=30, ttl_seconds=10)
+    cache.start("cam", 1, 0.9, BOX)
+    track = cache.follow("cam", BOX)
+    monkeypatch.setattr(match, "track_cache", cache)
+    frame = {}
+    monkeypatch.setattr(match, "_track_frame", lambda camera_key, content: (track, BOX, frame.get("embedding")))
+
+    async def run():
+        async with AsyncSessionLocal() as db:
+            return await match._match_tracked_frame(db, "cam", b"frame")
+
+    # Box overlap alone keeps the identity but records nothing
+    result = asyncio.run(run())
+    assert (result["user_id"], result["tracked"], result["created"]) == (1, True, False)
+    with SessionLocal() as db:
+        assert db.query(Attendance).count() == 0
+
+    # Re-verification matches the user's second template, not just the primary embedding
+    frame["embedding"] = _embedding(1)
+    result = asyncio.run(run())
+    assert (result["user_id"], result["tracked"], result["created"]) == (1, True, True)
+    assert result["score"] == pytest.approx(1.0)
+    assert cache.stats()["reverified"] == 1
@@ -0,0 +1,52 @@
+import pytest
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+
+from config import settings
+from utils.uploads import RequestSizeLimitMiddleware, read_upload
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(settings, "max_request_bytes", 1000)
+    monkeypatch.setattr(settings, "max_upload_bytes", 600)
+    app = FastAPI()
+    app.add_middleware(RequestSizeLimitMiddleware)
+    parsed = []
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        parsed.append(file.filename)
+        return {"size": len(await read_upload(file))}
+
+    client = TestClient(app)
+    client.parsed = parsed
+    return client
+
+
+def test_small_upload_passes(client):
+    response = client.post("/upload", files={"file": ("a.jpg", b"x" * 500, "image/jpeg")})
+    assert response.json() == {"size": 500}
+
+
+def test_oversized_file_within_request_limit(client):
+    response = client.post("/upload", files={"file": ("a.jpg", b"x" * 700, "image/jpeg")})
+    assert response.status_code == 413
+
+
+def test_content_length_over_limit_is_rejected_before_parsing(client):
+    response = client.post("/upload", files={"file": ("a.jpg", b"x" * 5000, "image/jpeg")})
+    assert response.status_code == 413
+    assert client.parsed == []
+
+
+def test_chunked_body_over_limit_is_rejected(client):
+    body = b"--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.jpg\"\r\n\r\n" + b"x" * 5000 + b"\r\n--b--\r\n"
+
+    def chunks():
+        for i in range(0, len(body), 256):
+            yield body[i:i + 256]
+
+    response = client.post("/upload", content=chunks(), headers={"content-type": "multipart/form-data; boundary=b"})
+    assert response.status_code == 413
+    assert client.parsed == []
@@ -0,0 +1,46 @@
+import pytest
+
+from db import SessionLocal, User
+from routes.admin import _none_match
+from utils.user_directory import UserDirectory
+
+ETAG = '"users-1a2b3c4d-7"'
+
+
+@pytest.mark.parametrize("header, matches", [
+    ('"users-1a2b3c4d-7"', True),
+    ('W/"users-1a2b3c4d-7"', True),
+    ('"users-1a2b3c4d-6", "users-1a2b3c4d-7"', True),
+    ('"a,b" ,W/"users-1a2b3c4d-7"', True),
+    ("*", True),
+    (" * ", True),
+    ('"users-1a2b3c4d-6"', False),
+    ('"users-1a2b3c4d-7', False),
+    ("users-1a2b3c4d-7", False),
+    ("", False),
+])
+def test_if_none_match(header, matches):
+    assert _none_match(header, ETAG) is matches
+
+
+def _add_user(user_id):
+    with SessionLocal() as db:
+        db.add(User(id=user_id, name=f"user {user_id}", face_image_url="", face_embedding=b""))
+        db.commit()
+
+
+def test_directories_agree_across_processes(database):
+    # One directory per worker process
+    first, second = UserDirectory(), UserDirectory()
+    _add_user(1)
+    with SessionLocal() as db:
+        etag, users = first.get(db)
+        assert second.get(db) == (etag, users)
+
+    # Enrolled through another process: both see the new list and tag
+    _add_user(2)
+    with SessionLocal() as db:
+        new_etag, users = first.get(db)
+        assert new_etag != etag and [u["id"] for u in users] == [1, 2]
+        assert second.get(db)[0] == new_etag
+        assert second.names(db) == {1: "user 1", 2: "user 2"}
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routes import match
+from routes.match import _parse_frame_message
+
+
+def _message(header, payload=b"jpeg"):
+    encoded = json.dumps(header).encode() if header is not None else b""
+    return len(encoded).to_bytes(4, "big") + encoded + payload
+
+
+def test_parse_frame_message():
+    assert _parse_frame_message(_message({"seq": 3, "mode": "stream"})) == ({"seq": 3, "mode": "stream"}, b"jpeg")
+    # No header at all, and a header without payload
+    assert _parse_frame_message(_message(None)) == ({}, b"jpeg")
+    assert _parse_frame_message(_message({"seq": 1}, b"")) == ({"seq": 1}, b"")
+
+
+@pytest.mark.parametrize("message", [
+    b"",
+    b"\x00\x00\x01",
+    (100).to_bytes(4, "big") + b"{}",
+    (6).to_bytes(4, "big") + b"[1, 2]jpeg",
+    (5).to_bytes(4, "big") + b"{seq:jpeg",
+])
+def test_malformed_frame_messages(message):
+    # json.JSONDecodeError is a ValueError too, so every case answers 400
+    with pytest.raises(ValueError):
+        _parse_frame_message(message)
+
+
+def test_bad_frames_are_answered_and_the_connection_stays_open():
+    app = FastAPI()
+    app.include_router(match.router, prefix="/match")
+    with TestClient(app).websocket_connect("/match/ws?camera_id=test") as ws:
+        ws.send_bytes(b"\x00")
+        assert ws.receive_json()["status"] == 400
+        ws.send_bytes(_message({"seq": 7, "mode": "sideways"}))
+        reply = ws.receive_json()
+        assert (reply["seq"], reply["status"], reply["frames"]) == (7, 400, 0)
+        assert reply["error"] == "Unknown mode: sideways"
+        ws.send_bytes(_message({"seq": 8}, b""))
+        assert ws.receive_json()["error"] == "Empty frame"
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+
+@dataclass
+class AttendanceEvent:
+    attendance_id: int
+    user_id: int
+    user_name: Optional[str]
+    timestamp: datetime
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "attendance_id": self.attendance_id,
+            "user_id": self.user_id,
+            "user_name": self.user_name,
+            "timestamp": self.timestamp.isoformat(),
+        }
+
+
+class AttendanceFeed:
+    """Fan-out of new attendance rows to live dashboard subscribers.
+
+    Routes record attendance on the event loop, but sync sessions in scripts
+    and benchmarks publish from their own threads, so `publish` hands events
+    to each subscriber's event loop with `call_soon_threadsafe`. A subscriber
+    that falls `max_queue` events behind is dropped; its dashboard reconnects
+    and resumes from the last attendance id it saw.
+    """
+
+    def __init__(self, max_queue: int = 256):
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._subscribers: Dict[asyncio.Queue, asyncio.AbstractEventLoop] = {}
+
+    def subscribe(self) -> asyncio.Queue:
+        """Register a subscriber on the running event loop; `None` in the queue means dropped."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_queue + 1)
+        with self._lock:
+            self._subscribers[queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, events: List[AttendanceEvent]) -> None:
+        if not events:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, events)
+            except RuntimeError:
+                # Loop already closed
+                self.unsubscribe(queue)
+
+    def _deliver(self, queue: asyncio.Queue, events: List[AttendanceEvent]) -> None:
+        with self._lock:
+            if queue not in self._subscribers:
+                return
+        for event in events:
+            if queue.qsize() >= self.max_queue:
+                self.unsubscribe(queue)
+                queue.put_nowait(None)
+                return
+            queue.put_nowait(event)
+
+
+attendance_feed = AttendanceFeed()
@@ -0,0 +1,225 @@
+import asyncio
+import contextvars
+import logging
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from utils.metrics import EMOTION_JOBS, EMOTION_QUEUE_DEPTH, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+DROPPED = "dropped"
+
+
+@dataclass
+class EmotionJob:
+    """Emotion/gaze analysis of one check-in frame, after its recognition was answered."""
+    id: str
+    camera_key: Optional[str]
+    user_id: Optional[int]
+    content: Optional[bytes]  # released once analyzed
+    queued_at: float
+    status: str = PENDING
+    emotion_detection: Optional[Dict[str, Any]] = None
+    emotion_session_id: Optional[int] = None
+    error: Optional[str] = None
+    finished_at: Optional[float] = None
+    follows: Optional["EmotionJob"] = field(default=None, repr=False)
+    done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    def summary(self) -> Dict[str, Any]:
+        """`emotion_detection` of a check-in response: the analysis once done, else its status."""
+        if self.status == DONE:
+            return {**self.emotion_detection, "job_id": self.id, "status": self.status}
+        summary = {"success": False, "job_id": self.id, "status": self.status}
+        if self.error:
+            summary["error"] = self.error
+        return summary
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "user_id": self.user_id,
+            "emotion_detection": self.emotion_detection,
+            "emotion_session_id": self.emotion_session_id,
+            "error": self.error,
+            "elapsed_ms": round(((self.finished_at or time.monotonic()) - self.queued_at) * 1000, 1),
+        }
+
+
+class EmotionStage:
+    """Background emotion/gaze analysis of check-in frames.
+
+    Recognition and attendance are answered first; the frame is then queued
+    here and `workers` tasks on the event loop analyze it through `analyze`
+    (the inference pool, under the emotion request class) and store the
+    result for a recognized user through `store`. Bursts wait in the queue
+    instead of in the check-in responses; frames arriving while `max_queue`
+    are already waiting are dropped, and so are the ones not analyzed within
+    `max_wait` seconds, so a sustained overload sheds stale frames instead of
+    analyzing them ever later. Finished jobs can be looked up for `ttl` seconds,
+    the oldest going first once more than `max_jobs` are kept.
+    Everything is used from the event loop.
+    """
+
+    def __init__(
+        self,
+        analyze: Callable[[bytes], Awaitable[Dict[str, Any]]],
+        store: Callable[[int, Dict[str, Any]], Awaitable[int]],
+        workers: int,
+        max_queue: int,
+        max_wait: float,
+        ttl: float,
+        max_jobs: int = 10000,
+    ):
+        self.analyze = analyze
+        self.store = store
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self.max_wait = max_wait
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._jobs: Dict[str, EmotionJob] = {}
+        # Finished jobs, oldest first; pending ones are bounded by the queue
+        self._finished: Deque[EmotionJob] = deque()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        EMOTION_QUEUE_DEPTH.set_function(self.queued)
+
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        # Jobs of a previous event loop can never finish
+        self._jobs.clear()
+        self._finished.clear()
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        # A fresh context, so the workers do not inherit the submitting request's trace
+        self._tasks = [contextvars.Context().run(loop.create_task, self._work()) for _ in range(self.workers)]
+
+    def submit(
+        self, camera_key: Optional[str], user_id: Optional[int], content: bytes, follows: Optional[EmotionJob] = None
+    ) -> EmotionJob:
+        """Queue a frame for analysis.
+
+        With `follows`, the frame is not analyzed: it takes the analysis of
+        that earlier job (a near-duplicate frame), once finished, and only
+        stores it for `user_id`.
+        """
+        self._ensure_started()
+        self._expire()
+        job = EmotionJob(id=uuid.uuid4().hex, camera_key=camera_key, user_id=user_id, content=content, queued_at=time.monotonic())
+        self._jobs[job.id] = job
+        if follows is not None:
+            job.content = None
+            job.follows = follows
+            if follows.status != PENDING and (follows.status != DONE or user_id is None):
+                self._adopt(job)
+                return job
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self._finish(job, DROPPED, "Emotion queue full")
+        return job
+
+    def get(self, job_id: Optional[str]) -> Optional[EmotionJob]:
+        self._expire()
+        return self._jobs.get(job_id) if job_id else None
+
+    async def wait(self, job: EmotionJob, timeout: float) -> EmotionJob:
+        """Wait up to `timeout` seconds for the job to finish."""
+        if timeout > 0 and job.status == PENDING:
+            try:
+                await asyncio.wait_for(job.done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    def _expire(self) -> None:
+        """Drop finished jobs past their TTL, and the oldest finished ones beyond `max_jobs`."""
+        cutoff = time.monotonic() - self.ttl
+        while self._finished and (self._finished[0].finished_at <= cutoff or len(self._jobs) > self.max_jobs):
+            job = self._finished.popleft()
+            self._jobs.pop(job.id, None)
+
+    def _finish(self, job: EmotionJob, status: str, error: Optional[str] = None) -> None:
+        job.status = status
+        job.error = error
+        job.content = None
+        job.finished_at = time.monotonic()
+        job.done.set()
+        self._finished.append(job)
+        EMOTION_JOBS.labels(status=status).inc()
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Emotion analysis of job {job.id} failed: {e}")
+                self._finish(job, FAILED, "Emotion analysis failed")
+
+    def _adopt(self, job: EmotionJob) -> bool:
+        """Take the outcome of the followed job; True when its analysis still has to be stored."""
+        follows, job.follows = job.follows, None
+        job.emotion_detection = follows.emotion_detection
+        if follows.status != DONE:
+            self._finish(job, follows.status, follows.error)
+            return False
+        if job.user_id is None:
+            self._finish(job, DONE)
+            return False
+        return True
+
+    async def _run(self, job: EmotionJob) -> None:
+        if job.follows is not None:
+            # Queued behind the followed job, which is finished or being analyzed
+            await job.follows.done.wait()
+            if not self._adopt(job):
+                return
+        else:
+            waited = time.monotonic() - job.queued_at
+            STAGE_SECONDS.labels(stage="emotion_queue").observe(waited)
+            if waited > self.max_wait:
+                self._finish(job, DROPPED, f"Not analyzed within {self.max_wait:g}s")
+                return
+            try:
+                job.emotion_detection = await self.analyze(job.content)
+            except HTTPException as he:
+                # Still queued for an inference worker at the emotion deadline
+                self._finish(job, DROPPED, he.detail)
+                return
+            except ValueError as ve:
+                self._finish(job, FAILED, str(ve))
+                return
+        if job.user_id is not None and job.emotion_detection.get("success"):
+            job.emotion_session_id = await self.store(job.user_id, job.emotion_detection)
+        self._finish(job, DONE)
+
+    async def stop(self) -> None:
+        """Cancel the workers; frames still queued are not analyzed."""
+        tasks, self._tasks = self._tasks, []
+        if self._loop is not asyncio.get_running_loop():
+            tasks = []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loop = None
+        self._queue = None
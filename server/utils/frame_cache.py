@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from config import settings
+
+# Side length of the grayscale thumbnail used to compare frames
+_SIGNATURE_SIZE = 32
+
+
+def frame_signature(image_bytes: bytes) -> Optional[np.ndarray]:
+    """Return a small normalized grayscale thumbnail of a frame.
+
+    The frame is decoded at 1/8 resolution, which is much cheaper than a full
+    decode and still plenty for a 32x32 thumbnail. Returns None if the bytes
+    cannot be decoded.
+    """
+    import cv2
+
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    image = cv2.imdecode(nparr, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None:
+        return None
+    thumb = cv2.resize(image, (_SIGNATURE_SIZE, _SIGNATURE_SIZE), interpolation=cv2.INTER_AREA)
+    return thumb.astype(np.float32) / 255.0
+
+
+def frame_difference(a: np.ndarray, b: np.ndarray) -> float:
+    """Mean absolute difference between two signatures, in [0, 1]."""
+    return float(np.mean(np.abs(a - b)))
+
+
+class FrameCache:
+    """Per-camera cache of the last analyzed frame and its result.
+
+    A frame whose signature differs from the cached one by less than
+    `threshold` (and which arrives within `max_age` seconds) is considered
+    unchanged, and the cached result is served instead of re-running
+    recognition and emotion analysis.
+    """
+
+    def __init__(self, threshold: float, max_age: float, max_entries: int = 1024):
+        self.threshold = threshold
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[np.ndarray, Dict[str, Any], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, namespace: str, key: str, signature: Optional[np.ndarray]) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached result flagged `cached: True`, or None."""
+        if signature is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is not None:
+                cached_signature, result, stored_at = entry
+                if now - stored_at <= self.max_age and frame_difference(signature, cached_signature) < self.threshold:
+                    self._entries.move_to_end((namespace, key))
+                    self.hits += 1
+                    return dict(result, cached=True)
+            self.misses += 1
+            return None
+
+    def store(self, namespace: str, key: str, signature: Optional[np.ndarray], result: Dict[str, Any]) -> None:
+        if signature is None:
+            return
+        with self._lock:
+            self._entries[(namespace, key)] = (signature, dict(result), time.monotonic())
+            self._entries.move_to_end((namespace, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop every cached result (e.g. after the gallery changed)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": settings.frame_cache_enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "entries": len(self._entries),
+                "threshold": self.threshold,
+                "max_age_seconds": self.max_age,
+            }
+
+
+frame_cache = FrameCache(
+    threshold=settings.frame_cache_threshold,
+    max_age=settings.frame_cache_max_age_seconds,
+)
@@ -0,0 +1,225 @@
+import asyncio
+import contextvars
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from config import settings
+from utils import tracing
+from utils.metrics import INFERENCE_DROPPED, INFERENCE_QUEUE_DEPTH, INFERENCE_QUEUED
+
+# Model inference runs on a small dedicated pool instead of the event loop, so
+# health checks and cheap requests stay responsive while frames queue up.
+# MediaPipe FaceMesh keeps per-instance tracking state; it only runs under the
+# emotion class, whose concurrency therefore stays at 1.
+_executor = ThreadPoolExecutor(max_workers=settings.inference_workers, thread_name_prefix="inference")
+
+LIVE = "live"
+EMOTION = "emotion"
+ENROLL = "enroll"
+BATCH = "batch"
+REEMBED = "reembed"
+
+
+@dataclass(frozen=True)
+class RequestClass:
+    name: str
+    priority: int  # lower is served first
+    concurrency: int  # inference workers the class may hold at once
+    deadline: float  # seconds a request may wait for a worker
+
+
+def _request_classes(workers: int) -> List[RequestClass]:
+    def limit(concurrency: int) -> int:
+        return min(_background_workers(workers), max(1, concurrency))
+
+    return [
+        RequestClass(LIVE, 0, workers, settings.inference_live_deadline_ms / 1000),
+        RequestClass(EMOTION, 1, limit(settings.inference_emotion_concurrency), settings.inference_emotion_deadline_ms / 1000),
+        RequestClass(ENROLL, 2, limit(settings.inference_enroll_concurrency), settings.inference_enroll_deadline_ms / 1000),
+        RequestClass(BATCH, 3, limit(settings.inference_batch_concurrency), settings.inference_batch_deadline_ms / 1000),
+        RequestClass(REEMBED, 4, limit(settings.inference_reembed_concurrency), settings.inference_reembed_deadline_ms / 1000),
+    ]
+
+
+def _background_workers(workers: int) -> int:
+    """Workers the background classes may hold together; one is kept for check-ins."""
+    return max(1, workers - 1)
+
+
+class InferenceScheduler:
+    """Admission to the inference pool by request class.
+
+    A request starts right away when a worker is free, its class is under its
+    concurrency limit and no request of the same or a higher priority is
+    waiting; otherwise it queues (FIFO within its class). Whenever a worker
+    frees up it goes to the highest-priority class with a waiting request and
+    room under its limit, so check-ins jump ahead of queued background work.
+    Together the background classes (every class but the highest-priority
+    one) hold at most `workers - 1` workers, so with two or more workers a
+    long enrollment or replay never leaves a check-in without one. Requests whose deadline passes while
+    queued are dropped before they reach a worker. Everything except the
+    counters is used from the event loop.
+    """
+
+    def __init__(self, workers: int, classes: List[RequestClass]):
+        self.workers = workers
+        self.classes = {c.name: c for c in classes}
+        self._order = sorted(classes, key=lambda c: c.priority)
+        self._background = {c.name for c in self._order[1:]}
+        self.background_workers = _background_workers(workers)
+        self._queues: Dict[str, Deque[Tuple[asyncio.Future, float]]] = {c.name: deque() for c in classes}
+        self._running = {c.name: 0 for c in classes}
+        self._busy = 0
+        self._background_busy = 0
+        self._lock = threading.Lock()
+        for c in classes:
+            INFERENCE_QUEUED.labels(request_class=c.name).set_function(partial(self.queued, c.name))
+
+    def depth(self) -> int:
+        """Requests waiting for or running on the pool."""
+        with self._lock:
+            return self._busy + sum(len(q) for q in self._queues.values())
+
+    def queued(self, name: str) -> int:
+        return len(self._queues[name])
+
+    def _has_room(self, request_class: RequestClass) -> bool:
+        if self._running[request_class.name] >= request_class.concurrency:
+            return False
+        return request_class.name not in self._background or self._background_busy < self.background_workers
+
+    def _can_start(self, request_class: RequestClass) -> bool:
+        return self._busy < self.workers and self._has_room(request_class)
+
+    def _start(self, name: str) -> None:
+        self._running[name] += 1
+        self._busy += 1
+        if name in self._background:
+            self._background_busy += 1
+
+    def _dispatch(self) -> None:
+        """Hand free workers to the queued requests, highest priority first."""
+        now = time.monotonic()
+        while self._busy < self.workers:
+            for request_class in self._order:
+                queue = self._queues[request_class.name]
+                while queue and (queue[0][0].done() or queue[0][1] <= now):
+                    # Timed out (its waiter is dropping it) or about to
+                    waiter, _ = queue.popleft()
+                    if not waiter.done():
+                        waiter.set_exception(self._dropped(request_class))
+                if queue and self._has_room(request_class):
+                    waiter, _ = queue.popleft()
+                    self._start(request_class.name)
+                    waiter.set_result(None)
+                    break
+            else:
+                return
+
+    def _dropped(self, request_class: RequestClass) -> HTTPException:
+        INFERENCE_DROPPED.labels(request_class=request_class.name).inc()
+        return HTTPException(
+            status_code=503,
+            detail=f"Server busy: {request_class.name} request not started within {request_class.deadline:g}s",
+            headers={"Retry-After": str(max(1, math.ceil(request_class.deadline)))},
+        )
+
+    async def acquire(self, name: str) -> None:
+        """Wait for a worker slot, or raise 503 once the class deadline passes."""
+        request_class = self.classes[name]
+        with self._lock:
+            ahead = any(self._queues[c.name] for c in self._order if c.priority <= request_class.priority)
+            if not ahead and self._can_start(request_class):
+                self._start(name)
+                return
+            waiter = asyncio.get_running_loop().create_future()
+            entry = (waiter, time.monotonic() + request_class.deadline)
+            self._queues[name].append(entry)
+        try:
+            await asyncio.wait_for(waiter, request_class.deadline)
+        except BaseException as e:
+            with self._lock:
+                if entry in self._queues[name]:
+                    self._queues[name].remove(entry)
+                granted = waiter.done() and not waiter.cancelled() and waiter.exception() is None
+            if granted:
+                # Cancelled (client gone) right after a worker was handed over
+                self.release(name)
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._dropped(request_class) from None
+            raise
+
+    def release(self, name: str) -> None:
+        with self._lock:
+            self._running[name] -= 1
+            self._busy -= 1
+            if name in self._background:
+                self._background_busy -= 1
+            self._dispatch()
+
+
+scheduler = InferenceScheduler(settings.inference_workers, _request_classes(settings.inference_workers))
+
+
+def queue_depth() -> int:
+    """Requests currently waiting for or running on the inference pool."""
+    return scheduler.depth()
+
+
+INFERENCE_QUEUE_DEPTH.set_function(queue_depth)
+
+# Event loop of the server, for inference submitted from background threads
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def bind_event_loop(loop: asyncio.AbstractEventLoop) -> None:
+    """Set the loop the scheduler runs on; called when the server starts."""
+    global _loop
+    _loop = loop
+
+
+async def run_inference(fn: Callable[..., Any], *args: Any, request_class: str = LIVE, **kwargs: Any) -> Any:
+    """Run a blocking inference pipeline on the inference pool.
+
+    The request waits for a worker under its `request_class` (see
+    `InferenceScheduler`) and fails with 503 if none frees up before the
+    class deadline. The caller's context is copied onto the worker so stages
+    timed there are added to the request trace, along with the time spent
+    queued.
+    """
+    submitted = time.perf_counter()
+    await scheduler.acquire(request_class)
+    call = partial(fn, *args, **kwargs)
+
+    def run() -> Any:
+        tracing.record("inference_queue", time.perf_counter() - submitted)
+        return tracing.profiled(call)
+
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, contextvars.copy_context().run, run)
+    finally:
+        scheduler.release(request_class)
+
+
+def run_inference_blocking(fn: Callable[..., Any], *args: Any, request_class: str, **kwargs: Any) -> Any:
+    """`run_inference` for background threads: blocks the calling thread until done.
+
+    The request is scheduled on the server's event loop, so it competes for
+    the inference pool under its class like any request. Without a running
+    server (scripts, benchmarks) `fn` runs on the calling thread. Never call
+    this from the event loop.
+    """
+    loop = _loop
+    if loop is None or loop.is_closed():
+        return fn(*args, **kwargs)
+    coroutine = run_inference(fn, *args, request_class=request_class, **kwargs)
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
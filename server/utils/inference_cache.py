@@ -0,0 +1,197 @@
+import copy
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+from config import settings
+from utils.metrics import INFERENCE_CACHE_BYTES, INFERENCE_CACHE_REQUESTS
+
+
+def content_key(content: bytes) -> str:
+    """Hash of the image bytes; identical uploads share a key."""
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def _sizeof(value: Any) -> int:
+    """Approximate memory held by a cached value."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes + sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_sizeof(k) + _sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class _Failure:
+    """A cached ValueError (no face, several faces, undecodable image)."""
+
+    def __init__(self, message: str):
+        self.message = message
+
+
+class InferenceCache:
+    """LRU cache of model results keyed by the hash of the image bytes.
+
+    Retried uploads, re-sends after client timeouts and the same frame posted
+    to several endpoints then run the models once. Entries expire after
+    `ttl` seconds and the least recently used ones are evicted once their
+    estimated size exceeds `max_bytes`. Concurrent requests for the same key
+    wait for the first one instead of running the model again.
+
+    ValueErrors (no face, several faces) are cached too, since they are as
+    deterministic as the results; other exceptions are not.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, enabled: bool = True):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled and max_bytes > 0
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int, float]]" = OrderedDict()
+        self._pending: Dict[Hashable, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get(self, key: Hashable, now: float) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, size, stored_at = entry
+        if now - stored_at > self.ttl:
+            del self._entries[key]
+            self._bytes -= size
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put(self, key: Hashable, value: Any) -> None:
+        size = _sizeof(value) + 200  # key, tuple and OrderedDict node
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._entries[key] = (value, size, time.monotonic())
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    @staticmethod
+    def _result(value: Any) -> Any:
+        if isinstance(value, _Failure):
+            raise ValueError(value.message)
+        # Callers get their own copy and may modify it
+        return copy.deepcopy(value)
+
+    def lookup(self, kind: str, content: bytes) -> Optional[Any]:
+        """Cached result for these image bytes, or None (counted as a miss).
+
+        Raises the cached ValueError for images that failed before.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            value = self._get((kind, content_key(content)), time.monotonic())
+            if value is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        INFERENCE_CACHE_REQUESTS.labels(kind=kind, result="miss" if value is None else "hit").inc()
+        return None if value is None else self._result(value)
+
+    def store(self, kind: str, content: bytes, value: Any) -> None:
+        if not self.enabled:
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._put((kind, content_key(content)), value)
+
+    def get_or_compute(
+        self,
+        kind: str,
+        content: bytes,
+        compute: Callable[[], Any],
+        cacheable: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """Cached result of `compute()` for these image bytes, computing it on a miss.
+
+        Results for which `cacheable(result)` is false are returned but not kept.
+        """
+        if not self.enabled:
+            return compute()
+        key = (kind, content_key(content))
+        while True:
+            with self._lock:
+                value = self._get(key, time.monotonic())
+                if value is not None:
+                    self.hits += 1
+                else:
+                    waiting = self._pending.get(key)
+                    if waiting is None:
+                        self._pending[key] = threading.Event()
+                        self.misses += 1
+                        break
+            if value is not None:
+                INFERENCE_CACHE_REQUESTS.labels(kind=kind, result="hit").inc()
+                return self._result(value)
+            # Same image in flight on another thread: wait for its result, then
+            # look again (recompute if it failed with something other than ValueError)
+            waiting.wait()
+        INFERENCE_CACHE_REQUESTS.labels(kind=kind, result="miss").inc()
+
+        try:
+            try:
+                value = compute()
+            except ValueError as e:
+                with self._lock:
+                    self._put(key, _Failure(str(e)))
+                raise
+            if cacheable is not None and not cacheable(value):
+                return value
+            with self._lock:
+                self._put(key, value)
+            return self._result(value)
+        finally:
+            with self._lock:
+                self._pending.pop(key).set()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+            }
+
+
+inference_cache = InferenceCache(
+    max_bytes=settings.inference_cache_max_bytes,
+    ttl=settings.inference_cache_ttl_seconds,
+    enabled=settings.inference_cache_enabled,
+)
+INFERENCE_CACHE_BYTES.set_function(inference_cache.size_bytes)
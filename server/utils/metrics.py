@@ -0,0 +1,96 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from prometheus_client import Counter, Gauge, Histogram, generate_latest
+
+from utils import tracing
+
+# Stages span sub-millisecond gallery products to multi-second cold DeepFace calls
+_STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STAGE_SECONDS = Histogram(
+    "presensense_stage_seconds",
+    "Time spent in one pipeline stage",
+    ["stage"],
+    buckets=_STAGE_BUCKETS,
+)
+OUTCOMES = Counter(
+    "presensense_match_outcomes_total",
+    "Frames by pipeline and outcome (matched, deduped, no_match, no_face, invalid, error)",
+    ["pipeline", "outcome"],
+)
+GALLERY_SIZE = Gauge("presensense_gallery_size", "Registered users in the last loaded gallery")
+GALLERY_TEMPLATES = Gauge("presensense_gallery_templates", "Face templates (embedding rows) in the last loaded gallery")
+GALLERY_BYTES = Gauge("presensense_gallery_bytes", "Memory of the last loaded gallery's embedding matrix and indexes")
+INFERENCE_QUEUE_DEPTH = Gauge("presensense_inference_queue_depth", "Requests waiting for or running on the inference pool")
+INFERENCE_QUEUED = Gauge(
+    "presensense_inference_queued",
+    "Requests waiting for an inference worker, by request class (live, emotion, enroll, batch)",
+    ["request_class"],
+)
+INFERENCE_DROPPED = Counter(
+    "presensense_inference_dropped_total",
+    "Requests dropped before inference because they waited past their class deadline",
+    ["request_class"],
+)
+EMOTION_QUEUE_DEPTH = Gauge("presensense_emotion_queue_depth", "Check-in frames waiting for background emotion/gaze analysis")
+EMOTION_JOBS = Counter(
+    "presensense_emotion_jobs_total",
+    "Background emotion/gaze analyses by final status (done, failed, dropped)",
+    ["status"],
+)
+INFERENCE_CACHE_REQUESTS = Counter(
+    "presensense_inference_cache_requests_total",
+    "Inference cache lookups by kind (embedding, faces, emotion) and result (hit, miss)",
+    ["kind", "result"],
+)
+INFERENCE_CACHE_BYTES = Gauge("presensense_inference_cache_bytes", "Estimated memory held by the inference cache")
+REEMBED_IMAGES = Counter(
+    "presensense_reembed_images_total",
+    "Stored face images processed by re-embedding jobs, by result (embedded, failed)",
+    ["result"],
+)
+
+# Labelled children are resolved once; .labels() on every call costs a lock and a dict lookup
+_stage_children: Dict[str, Histogram] = {}
+
+
+def _stage_child(name: str) -> Histogram:
+    child = _stage_children.get(name)
+    if child is None:
+        child = _stage_children[name] = STAGE_SECONDS.labels(stage=name)
+    return child
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a block into the `presensense_stage_seconds` histogram and the current request trace."""
+    child = _stage_child(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        child.observe(elapsed)
+        tracing.record(name, elapsed)
+
+
+def count_outcome(pipeline: str, outcome: str) -> None:
+    OUTCOMES.labels(pipeline=pipeline, outcome=outcome).inc()
+
+
+def error_outcome(exc: Exception) -> str:
+    """Outcome label for a failed frame."""
+    if isinstance(exc, ValueError):
+        return "no_face" if "no face" in str(exc).lower() else "invalid"
+    status_code = getattr(exc, "status_code", 500)
+    if status_code == 404:
+        return "no_match"
+    return "invalid" if 400 <= status_code < 500 else "error"
+
+
+def render() -> bytes:
+    """Current metrics in the Prometheus text exposition format."""
+    return generate_latest()
+
@@ -0,0 +1,22 @@
+from config import settings
+from utils.inference import queue_depth
+
+
+def recommend_interval_ms(recognized: bool = False, deduped: bool = False, stable: bool = False) -> int:
+    """Suggest how long a camera client should wait before sending its next frame.
+
+    Starts from the default client cadence and backs off when the inference
+    queue is busy, when the user in front of the camera is already recognized
+    and their attendance deduped, and when the scene has not changed (cached
+    or tracked result). The result is clamped to the configured bounds.
+    """
+    interval = float(settings.client_interval_ms)
+
+    # Each queued request per inference worker adds one base interval
+    interval *= 1.0 + queue_depth() / max(1, settings.inference_workers)
+    if recognized and deduped:
+        interval *= 2.0
+    if stable:
+        interval *= 1.5
+
+    return int(min(settings.client_interval_max_ms, max(settings.client_interval_min_ms, interval)))
@@ -0,0 +1,71 @@
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+
+def synthetic_frame(width: int = 320, height: int = 240) -> np.ndarray:
+    """A deterministic BGR frame used to push every model through one inference."""
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    # A bright ellipse roughly where a face would be, so detectors do real work
+    yy, xx = np.mgrid[0:height, 0:width]
+    mask = ((xx - width / 2) / (width / 5)) ** 2 + ((yy - height / 2) / (height / 3)) ** 2 <= 1
+    frame[mask] = (180, 200, 230)
+    return frame
+
+
+class Readiness:
+    """Tracks startup phases and model load/warm-up progress for the /ready probe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[str, Dict[str, Any]] = {}
+        self._phases: Dict[str, float] = {}
+        self._started_at = time.monotonic()
+        self._finished_at: Optional[float] = None
+        self.ready = False
+
+    def record(self, name: str, load_seconds: float, warmup_seconds: float, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._models[name] = {
+                "load_seconds": round(load_seconds, 3),
+                "warmup_seconds": round(warmup_seconds, 3),
+                "error": error,
+            }
+
+    def record_phase(self, name: str, seconds: float) -> None:
+        """Record the duration of a startup phase (imports, database, models...)."""
+        with self._lock:
+            self._phases[name] = round(seconds, 3)
+
+    def errors(self) -> Dict[str, str]:
+        """Error of every model that failed to load or warm up."""
+        with self._lock:
+            return {name: info["error"] for name, info in self._models.items() if info["error"]}
+
+    def finish(self) -> bool:
+        """End startup; the service is ready only if no model failed. Returns readiness."""
+        with self._lock:
+            self._finished_at = time.monotonic()
+            self.ready = not any(info["error"] for info in self._models.values())
+            return self.ready
+
+    @property
+    def finished(self) -> bool:
+        return self._finished_at is not None
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            end = self._finished_at if self._finished_at is not None else time.monotonic()
+            return {
+                "ready": self.ready,
+                "finished": self._finished_at is not None,
+                "elapsed_seconds": round(end - self._started_at, 3),
+                "startup": dict(self._phases),
+                "models": {name: dict(info) for name, info in self._models.items()},
+            }
+
+
+readiness = Readiness()
@@ -1,6 +1,6 @@
-from google.cloud import storage
 from pathlib import Path
 from config import settings
+from utils.metrics import stage
 import uuid
 import os
 
@@ -19,17 +19,43 @@ async def upload_bytes_to_gcp(filename: str, data: bytes) -> str:
 	Returns a public URL or local path served under /uploads.
 	"""
 	safe_name = _randomized_name(filename)
-	if settings.gcp_bucket_name:
-		try:
-			client = storage.Client()
-			bucket = client.bucket(settings.gcp_bucket_name)
-			blob = bucket.blob(safe_name)
-			blob.upload_from_string(data)
-			return blob.public_url
-		except Exception:
-			pass
-	# Local fallback
-	local_path = UPLOADS_DIR / safe_name
-	local_path.write_bytes(data)
+	with stage("storage_upload"):
+		if settings.gcp_bucket_name:
+			try:
+				from google.cloud import storage
+
+				client = storage.Client()
+				bucket = client.bucket(settings.gcp_bucket_name)
+				blob = bucket.blob(safe_name)
+				blob.upload_from_string(data)
+				return blob.public_url
+			except Exception:
+				pass
+		# Local fallback
+		local_path = UPLOADS_DIR / safe_name
+		local_path.write_bytes(data)
 	# This will be served by FastAPI StaticFiles mounted at /uploads
-	return f"/uploads/{safe_name}"
\ No newline at end of file
+	return f"/uploads/{safe_name}"
+
+def read_stored_image(url: str) -> bytes:
+	"""Read back an image saved by `upload_bytes_to_gcp`, given the URL it returned.
+
+	Local `/uploads/...` paths are read from disk and URLs in GCP_BUCKET_NAME
+	through the storage client (the bucket need not be public); any other
+	URL is fetched over HTTP.
+	"""
+	with stage("storage_read"):
+		if url.startswith("/uploads/"):
+			return (UPLOADS_DIR / Path(url).name).read_bytes()
+		bucket_prefix = f"https://storage.googleapis.com/{settings.gcp_bucket_name}/"
+		if settings.gcp_bucket_name and url.startswith(bucket_prefix):
+			from urllib.parse import unquote
+			from google.cloud import storage
+
+			client = storage.Client()
+			return client.bucket(settings.gcp_bucket_name).blob(unquote(url[len(bucket_prefix):])).download_as_bytes()
+		import requests
+
+		response = requests.get(url, timeout=30)
+		response.raise_for_status()
+		return response.content
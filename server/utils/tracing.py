@@ -0,0 +1,214 @@
+import logging
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Only the API routers are traced; static files, health checks and /metrics are not
+TRACED_PREFIXES = ("/match", "/emotion", "/admin")
+
+
+class RequestTrace:
+    """Stage durations collected while serving one request or WebSocket frame.
+
+    `metrics.stage()` adds to the trace of the current context, and
+    `run_inference` copies that context onto the inference thread, so model,
+    decode, database and storage stages all land in the same trace. Repeated
+    stages (one embedding call per face) are summed.
+    """
+
+    def __init__(self, label: str, profile_id: Optional[str] = None):
+        self.label = label
+        self.profile_id = profile_id
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stages: Dict[str, List[float]] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            entry = self._stages.get(name)
+            if entry is None:
+                self._stages[name] = [seconds, 1]
+            else:
+                entry[0] += seconds
+                entry[1] += 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def stages(self) -> List[Tuple[str, float, int]]:
+        """(name, seconds, calls) in the order stages first ran."""
+        with self._lock:
+            return [(name, entry[0], int(entry[1])) for name, entry in self._stages.items()]
+
+    def server_timing(self) -> str:
+        """`Server-Timing` header value, durations in milliseconds."""
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds, _ in self.stages()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+    def as_dict(self) -> Dict[str, float]:
+        timing = {name: round(seconds * 1000, 1) for name, seconds, _ in self.stages()}
+        timing["total"] = round(self.elapsed() * 1000, 1)
+        return timing
+
+    def breakdown(self) -> str:
+        return ", ".join(
+            f"{name}={seconds * 1000:.1f}ms" + (f" x{calls}" if calls > 1 else "")
+            for name, seconds, calls in self.stages()
+        ) or "no stages"
+
+
+_current: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current.get()
+
+
+def record(name: str, seconds: float) -> None:
+    """Add a stage duration to the current trace, if any."""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+def _log_if_slow(trace: RequestTrace, status_code: Optional[int] = None) -> None:
+    total_ms = trace.elapsed() * 1000
+    if settings.slow_request_ms > 0 and total_ms >= settings.slow_request_ms:
+        logger.warning(
+            f"Slow request: {trace.label} -> {status_code if status_code is not None else '-'} "
+            f"in {total_ms:.0f}ms ({trace.breakdown()})"
+        )
+
+
+@contextmanager
+def trace(label: str) -> Iterator[RequestTrace]:
+    """Trace a unit of work outside the HTTP middleware, e.g. one WebSocket frame."""
+    request_trace = RequestTrace(label)
+    token = _current.set(request_trace)
+    try:
+        yield request_trace
+    finally:
+        _current.reset(token)
+        _log_if_slow(request_trace)
+
+
+# Sampling profiler (debug only)
+
+_profiler_missing_logged = False
+
+
+def _profiler_class():
+    global _profiler_missing_logged
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        if not _profiler_missing_logged:
+            logger.warning("PROFILING_ENABLED is set but pyinstrument is not installed; profiling skipped")
+            _profiler_missing_logged = True
+        return None
+    return Profiler
+
+
+def _profile_requested(scope: Dict[str, Any]) -> bool:
+    if not settings.profiling_enabled:
+        return False
+    for key, value in scope.get("headers", []):
+        if key == b"x-profile" and value.strip() in (b"1", b"true"):
+            return True
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    return query.get("profile", [""])[-1] in ("1", "true")
+
+
+def _save_profile(profiler: Any, profile_id: str, suffix: str) -> None:
+    try:
+        settings.profile_dir.mkdir(parents=True, exist_ok=True)
+        path = settings.profile_dir / f"{profile_id}-{suffix}.html"
+        path.write_text(profiler.output_html(), encoding="utf-8")
+        logger.info(f"Profile written to {path}")
+    except Exception as e:
+        logger.error(f"Failed to write profile {profile_id}: {e}")
+
+
+def profiled(fn: Callable[[], Any]) -> Any:
+    """Call `fn`, sampling this thread if the current request asked for a profile.
+
+    The request-level profiler only samples the event loop thread; inference
+    runs on the pool, so `run_inference` profiles that part separately.
+    """
+    trace_ = _current.get()
+    if trace_ is None or trace_.profile_id is None:
+        return fn()
+    Profiler = _profiler_class()
+    if Profiler is None:
+        return fn()
+    profiler = Profiler(async_mode="disabled")
+    profiler.start()
+    try:
+        return fn()
+    finally:
+        profiler.stop()
+        _save_profile(profiler, trace_.profile_id, "inference")
+
+
+class RequestTracingMiddleware:
+    """ASGI middleware adding `Server-Timing` to traced routes and logging slow requests.
+
+    The header is written when the response starts, so it covers everything
+    up to the first byte; for the SSE feed that is only the backlog query.
+    With `PROFILING_ENABLED`, a request sent with `?profile=1` or
+    `X-Profile: 1` is sampled with pyinstrument and an HTML report is written
+    to `PROFILE_DIR`; its id is returned in `X-Profile-Id`.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(TRACED_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        profiler = None
+        profile_id = None
+        if _profile_requested(scope):
+            Profiler = _profiler_class()
+            if Profiler is not None:
+                slug = re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_")
+                profile_id = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{slug}-{uuid.uuid4().hex[:6]}"
+                profiler = Profiler(async_mode="enabled")
+
+        request_trace = RequestTrace(f"{scope['method']} {scope['path']}", profile_id)
+        token = _current.set(request_trace)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                if settings.server_timing_enabled:
+                    headers.append((b"server-timing", request_trace.server_timing().encode("latin-1")))
+                    headers.append((b"timing-allow-origin", b"*"))
+                if profile_id is not None:
+                    headers.append((b"x-profile-id", profile_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+                _log_if_slow(request_trace, message.get("status"))
+            await send(message)
+
+        if profiler is not None:
+            profiler.start()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            if profiler is not None:
+                profiler.stop()
+                _save_profile(profiler, profile_id, "request")
@@ -0,0 +1,130 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import settings
+
+Box = Tuple[int, int, int, int]  # x, y, width, height
+
+
+def detect_face_boxes(image_bytes: bytes) -> List[Box]:
+    """Cheap Haar-cascade face boxes in full-resolution coordinates.
+
+    The frame is decoded at half resolution; this is only used to follow a
+    face that has already been identified, not to identify it.
+    """
+    import cv2
+    from models.emotion_detection import get_emotion_detector
+
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    image = cv2.imdecode(nparr, cv2.IMREAD_REDUCED_COLOR_2)
+    if image is None:
+        return []
+    faces = get_emotion_detector().detect_faces_opencv(image)
+    return [(int(x) * 2, int(y) * 2, int(w) * 2, int(h) * 2) for x, y, w, h in faces]
+
+
+def box_iou(a: Box, b: Box) -> float:
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+
+@dataclass
+class Track:
+    user_id: int
+    score: float
+    box: Box
+    last_seen: float
+    last_verified: float
+
+
+class TrackCache:
+    """Short-lived per-camera identity tracks.
+
+    Once a camera's face has been recognized, following frames whose single
+    face box overlaps the previous one by at least `iou_threshold` keep the
+    identity without a new embedding (but do not record attendance). Every
+    `reverify_seconds` the track is re-checked against the tracked user's
+    templates only, and a track that is not seen for `ttl_seconds` expires.
+    """
+
+    def __init__(self, iou_threshold: float, reverify_seconds: float, ttl_seconds: float):
+        self.iou_threshold = iou_threshold
+        self.reverify_seconds = reverify_seconds
+        self.ttl_seconds = ttl_seconds
+        self._tracks: Dict[str, Track] = {}
+        self._lock = threading.Lock()
+        self.confirmed = 0
+        self.reverified = 0
+        self.broken = 0
+        self.started = 0
+
+    def follow(self, camera_key: str, box: Box) -> Optional[Track]:
+        """Return the camera's live track if `box` continues it, else drop it."""
+        now = time.monotonic()
+        with self._lock:
+            track = self._tracks.get(camera_key)
+            if track is None:
+                return None
+            if now - track.last_seen > self.ttl_seconds or box_iou(track.box, box) < self.iou_threshold:
+                del self._tracks[camera_key]
+                self.broken += 1
+                return None
+            track.box = box
+            track.last_seen = now
+            return track
+
+    def needs_reverify(self, track: Track) -> bool:
+        return time.monotonic() - track.last_verified >= self.reverify_seconds
+
+    def confirm(self) -> None:
+        with self._lock:
+            self.confirmed += 1
+
+    def reverify(self, track: Track, score: float) -> None:
+        with self._lock:
+            track.score = score
+            track.last_verified = time.monotonic()
+            self.reverified += 1
+
+    def start(self, camera_key: str, user_id: int, score: float, box: Box) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._tracks[camera_key] = Track(user_id=user_id, score=score, box=box, last_seen=now, last_verified=now)
+            self.started += 1
+
+    def drop(self, camera_key: str) -> None:
+        with self._lock:
+            if self._tracks.pop(camera_key, None) is not None:
+                self.broken += 1
+
+    def clear(self) -> None:
+        """Forget every track (e.g. after the stored embeddings changed model)."""
+        with self._lock:
+            self._tracks.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": settings.track_cache_enabled,
+                "active_tracks": len(self._tracks),
+                "started": self.started,
+                "confirmed_without_embedding": self.confirmed,
+                "reverified": self.reverified,
+                "broken": self.broken,
+            }
+
+
+track_cache = TrackCache(
+    iou_threshold=settings.track_iou_threshold,
+    reverify_seconds=settings.track_reverify_seconds,
+    ttl_seconds=settings.track_ttl_seconds,
+)
@@ -0,0 +1,138 @@
+import json
+from typing import Optional, Tuple
+
+import numpy as np
+from fastapi import HTTPException, UploadFile
+
+from config import settings
+from utils.metrics import stage
+
+_CHUNK_SIZE = 64 * 1024
+
+# Routes whose bodies may exceed MAX_REQUEST_BYTES
+_BATCH_PATHS = ("/match/batch",)
+
+
+def _too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Request body too large (max {max_bytes} bytes)")
+
+
+class RequestSizeLimitMiddleware:
+    """ASGI middleware rejecting request bodies over MAX_REQUEST_BYTES with 413.
+
+    Starlette spools a multipart body (in memory, then a temporary file)
+    before the route runs, so per-file limits come too late to protect
+    memory and disk. A `Content-Length` over the limit is answered before
+    any of the body is read; bodies without one (chunked) are counted as
+    they are received and fail once they pass it. /match/batch uses
+    BATCH_MAX_REQUEST_BYTES instead.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        max_bytes = settings.batch_max_request_bytes if scope["path"] in _BATCH_PATHS else settings.max_request_bytes
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_bytes:
+            body = json.dumps({"detail": _too_large(max_bytes).detail}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 413,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), (b"connection", b"close")],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    # Raised inside the route's body parsing, so it becomes a 413 response
+                    raise _too_large(max_bytes)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+# OpenCV decodes JPEGs directly at 1/2, 1/4 or 1/8 scale with these flags
+_REDUCED_COLOR = {2: "IMREAD_REDUCED_COLOR_2", 4: "IMREAD_REDUCED_COLOR_4", 8: "IMREAD_REDUCED_COLOR_8"}
+
+
+async def read_upload(file: UploadFile, max_bytes: Optional[int] = None) -> bytes:
+    """Read an uploaded file into memory, failing with 413 if it exceeds `max_bytes`.
+
+    By now Starlette has spooled the file, within the request body limit of
+    `RequestSizeLimitMiddleware`; this caps each file of a multipart body,
+    and checks the size before copying it into memory when it is known.
+    """
+    max_bytes = settings.max_upload_bytes if max_bytes is None else max_bytes
+    if file.size is not None:
+        if file.size > max_bytes:
+            raise HTTPException(status_code=413, detail=f"File too large (max {max_bytes} bytes)")
+        # Size known up front: one exact-size read, no chunk list to join
+        return await file.read(file.size)
+    chunks = []
+    total = 0
+    while True:
+        chunk = await file.read(_CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise HTTPException(status_code=413, detail=f"File too large (max {max_bytes} bytes)")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def image_size(image_bytes: bytes) -> Optional[Tuple[int, int]]:
+    """(width, height) read from the image header only, or None if unknown."""
+    from PIL import Image, UnidentifiedImageError
+    import io
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            return img.size
+    except (UnidentifiedImageError, OSError):
+        return None
+
+
+def decode_image(image_bytes: bytes, max_side: Optional[int] = None) -> Tuple[np.ndarray, float]:
+    """Decode an image to BGR, no larger than the models need.
+
+    Images whose long side exceeds `max_side` are decoded straight at 1/2,
+    1/4 or 1/8 resolution (the smallest reduction that fits, so the result
+    is between half and all of `max_side`) and full-resolution pixels never
+    exist in memory. Only images too large even at 1/8 are resized after
+    decoding. Returns (image, scale) where scale maps decoded coordinates
+    back to the original (original = decoded / scale). Raises ValueError
+    when the bytes are not an image.
+    """
+    import cv2
+
+    max_side = settings.decode_max_side if max_side is None else max_side
+    size = image_size(image_bytes)
+    factor = 1
+    if size is not None and max_side > 0 and max(size) > max_side:
+        factor = next((f for f in (2, 4) if max(size) / f <= max_side), 8)
+
+    with stage("decode"):
+        flag = getattr(cv2, _REDUCED_COLOR[factor]) if factor > 1 else cv2.IMREAD_COLOR
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flag)
+        if image is None:
+            raise ValueError("Could not decode image")
+
+        # Compare long sides: decoding applies EXIF rotation, the header size does not
+        scale = 1.0 / factor if size is None else max(image.shape[:2]) / max(size)
+        long_side = max(image.shape[:2])
+        if max_side > 0 and long_side > max_side:
+            ratio = max_side / long_side
+            image = cv2.resize(image, (round(image.shape[1] * ratio), round(image.shape[0] * ratio)), interpolation=cv2.INTER_AREA)
+            scale *= ratio
+    return image, scale
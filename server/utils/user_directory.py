@@ -0,0 +1,71 @@
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from db import User
+
+State = Tuple[int, int]  # number of users, highest user id
+
+
+class UserDirectory:
+    """Cached list of registered users (id, name, image URL), keyed by table state.
+
+    Users are only ever added, so the user count and highest id identify
+    the list. Every read checks them with one aggregate query and rebuilds
+    the list when they moved, so enrollments made by other worker processes
+    are picked up; the ETag is built from the same state, so every process
+    hands out the same tag for the same list.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: Optional[State] = None
+        self._users: Optional[List[Dict[str, Any]]] = None
+        self._names: Optional[Dict[int, str]] = None
+
+    @staticmethod
+    def state(db: Session) -> State:
+        count, max_id = db.query(func.count(User.id), func.max(User.id)).one()
+        return count, max_id or 0
+
+    @staticmethod
+    def etag(state: State) -> str:
+        return f'"users-{state[0]}-{state[1]}"'
+
+    def invalidate(self) -> None:
+        """Drop the cached list (e.g. after users were rewritten in place)."""
+        with self._lock:
+            self._state = None
+            self._users = None
+            self._names = None
+
+    def get(self, db: Session) -> Tuple[str, List[Dict[str, Any]]]:
+        """Return (etag, users), querying only the listed columns when the table changed."""
+        state = self.state(db)
+        with self._lock:
+            if self._state == state and self._users is not None:
+                return self.etag(state), self._users
+        rows = db.query(User.id, User.name, User.face_image_url).order_by(User.id).all()
+        users = [{"id": r.id, "name": r.name, "face_image_url": r.face_image_url} for r in rows]
+        with self._lock:
+            self._state = state
+            self._users = users
+            self._names = None
+        return self.etag(state), users
+
+    def names(self, db: Session) -> Dict[int, str]:
+        """Map of user id to name, built from the cached list."""
+        _, users = self.get(db)
+        with self._lock:
+            if self._users is users and self._names is not None:
+                return self._names
+        names = {u["id"]: u["name"] for u in users}
+        with self._lock:
+            if self._users is users:
+                self._names = names
+        return names
+
+
+user_directory = UserDirectory()